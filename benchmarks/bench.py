@@ -0,0 +1,312 @@
+"""
+Benchmarks of fernetfs : mount, metadata and data paths.
+
+    python3 benchmarks/bench.py run [--quick] [--output results.json]
+    python3 benchmarks/bench.py compare baseline.json results.json [--threshold 0.2]
+
+run prints (or writes) the results as JSON, compare flags the benchmarks whose time grew by more
+than the threshold against a saved baseline and exits with 1 if any did. The fastest sample is
+compared by default, it is the least sensitive to a busy machine.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cryptography
+
+from fernetfs.filesystem import FileSystem
+
+PASSWORD = b"benchmark password"
+BLOCK_SIZE = 1024 * 1024
+
+KiB = 1024
+MiB = 1024 * KiB
+GiB = 1024 * MiB
+
+FULL = {
+    "file_sizes": [KiB, 64 * KiB, MiB, 16 * MiB, 256 * MiB, GiB],
+    "ls_entries": [10, 100, 1000, 10000, 100000],
+    "depths": [1, 4, 16, 64],
+    "tmpfile_sizes": [KiB, MiB, 16 * MiB],
+    "mkdir_count": 100,
+    "repeat": 5,
+    "min_time": 0.2,
+}
+
+QUICK = {
+    "file_sizes": [KiB, 64 * KiB, MiB],
+    "ls_entries": [10, 100, 1000],
+    "depths": [1, 4, 16],
+    "tmpfile_sizes": [KiB, MiB],
+    "mkdir_count": 20,
+    "repeat": 3,
+    "min_time": 0.02,
+}
+
+
+def human_size(size:int)->str:
+    for unit, factor in (("GiB", GiB), ("MiB", MiB), ("KiB", KiB)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+
+    return f"{size}B"
+
+
+class Bench:
+    def __init__(self, iterations:int, sub_iterations:int, repeat:int, min_time:float) -> None:
+        self._iterations = iterations
+        self._sub_iterations = sub_iterations
+        self._repeat = repeat
+        self._min_time = min_time
+        self._root = tempfile.mkdtemp(prefix="fernetfs-bench-")
+        self._count = 0
+        self.results = {}
+
+    def close(self)->None:
+        shutil.rmtree(self._root, ignore_errors=True)
+
+    def new_filesystem(self)->FileSystem:
+        # each benchmark runs on a new filesystem, mounted
+        self._count += 1
+        path = os.path.join(self._root, str(self._count))
+        os.mkdir(path)
+
+        fs = FileSystem()
+        fs.create(PASSWORD, path, self._iterations, 16, self._sub_iterations)
+        fs.mount(PASSWORD, path, self._iterations)
+        return fs
+
+    def record(self, name:str, seconds:list, operations:int=1, size:int=None, **params)->None:
+        result = {
+            "params": params,
+            "operations": operations,
+            "seconds": seconds,
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "mean": statistics.mean(seconds),
+        }
+        if size is not None:
+            result["throughput"] = size / result["median"] if result["median"] > 0 else 0.0
+
+        self.results[name] = result
+        print(f"{name:<32} median {result['median'] * 1000:10.3f} ms", file=sys.stderr)
+
+    def measure(self, function, setup=None)->list:
+        # each sample is the mean time of the function, called until min_time is spent in it, so that
+        # fast operations are not lost in the noise. The setup is not timed
+        seconds = []
+        for _ in range(self._repeat):
+            total = 0.0
+            calls = 0
+            while calls == 0 or total < self._min_time:
+                if setup is not None:
+                    setup()
+                start = time.perf_counter()
+                function()
+                total += time.perf_counter() - start
+                calls += 1
+            seconds.append(total / calls)
+
+        return seconds
+
+    def bench_create_mount(self)->None:
+        paths = []
+
+        def create():
+            self._count += 1
+            path = os.path.join(self._root, str(self._count))
+            os.mkdir(path)
+            FileSystem().create(PASSWORD, path, self._iterations, 16, self._sub_iterations)
+            paths.append(path)
+
+        self.record("create", self.measure(create), iterations=self._iterations)
+        self.record("mount", self.measure(lambda: FileSystem().mount(PASSWORD, paths[0], self._iterations)), iterations=self._iterations)
+
+    def bench_mkdir(self, count:int)->None:
+        fs = self.new_filesystem()
+        batches = iter(range(sys.maxsize))
+
+        def mkdir():
+            # a new parent for each call, so that all calls fill a directory of the same size
+            parent = f"/d{next(batches)}"
+            fs.mkdir(parent)
+            for i in range(count):
+                fs.mkdir(f"{parent}/d{i}")
+
+        self.record("mkdir", self.measure(mkdir), count, count=count)
+
+    def bench_file(self, size:int)->None:
+        fs = self.new_filesystem()
+        block = os.urandom(min(size, BLOCK_SIZE))
+
+        def write():
+            with fs.open("/file", "wb") as f:
+                written = 0
+                while written < size:
+                    written += f.write(block[:size - written])
+
+        buffer = bytearray(BLOCK_SIZE)
+
+        def read():
+            with fs.open("/file", "rb") as f:
+                while f.readinto(buffer):
+                    pass
+
+        self.record(f"write/{human_size(size)}", self.measure(write), size=size, file_size=size)
+        self.record(f"read/{human_size(size)}", self.measure(read), size=size, file_size=size)
+
+    def bench_ls(self, entries:int)->None:
+        fs = self.new_filesystem()
+        fs.mkdir("/dir")
+        with fs.batch():
+            for i in range(entries):
+                with fs.open(f"/dir/f{i}", "wb") as f:
+                    f.write(b"")
+
+        # ls lists the directory holding the last component of the path
+        cache = fs.get_listing_cache()
+        self.record(f"ls/{entries}/cold", self.measure(lambda: fs.ls("/dir/."), cache.clear), entries=entries)
+        self.record(f"ls/{entries}/warm", self.measure(lambda: fs.ls("/dir/.")), entries=entries)
+
+    def bench_resolution(self, depth:int)->None:
+        fs = self.new_filesystem()
+        path = ""
+        for i in range(depth):
+            path += f"/d{i}"
+            fs.mkdir(path)
+        path += "/file"
+        with fs.open(path, "wb") as f:
+            f.write(b"")
+
+        def clear():
+            fs.get_listing_cache().clear()
+            fs.get_resolution_cache().clear()
+
+        self.record(f"resolve/{depth}/cold", self.measure(lambda: fs.is_file_exist(path), clear), depth=depth)
+        self.record(f"resolve/{depth}/warm", self.measure(lambda: fs.is_file_exist(path)), depth=depth)
+
+    def bench_tmpfile(self, size:int)->None:
+        fs = self.new_filesystem()
+        with fs.open("/file", "wb") as f:
+            f.write(os.urandom(size))
+
+        # decryption into RAM, a command changing nothing, then the write back
+        self.record(f"tmpfile/{human_size(size)}", self.measure(lambda: fs.open_as_tmpfile("/file").run("true")), size=size, file_size=size)
+
+    def run(self, config:dict)->None:
+        self.bench_create_mount()
+        self.bench_mkdir(config["mkdir_count"])
+        for size in config["file_sizes"]:
+            self.bench_file(size)
+        for entries in config["ls_entries"]:
+            self.bench_ls(entries)
+        for depth in config["depths"]:
+            self.bench_resolution(depth)
+        for size in config["tmpfile_sizes"]:
+            self.bench_tmpfile(size)
+
+
+def run(args)->int:
+    config = dict(QUICK if args.quick else FULL)
+    if args.repeat is not None:
+        config["repeat"] = args.repeat
+
+    if args.min_time is not None:
+        config["min_time"] = args.min_time
+
+    bench = Bench(args.iterations, args.sub_iterations, config["repeat"], config["min_time"])
+    try:
+        bench.run(config)
+    finally:
+        bench.close()
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cryptography": cryptography.__version__,
+            "quick": args.quick,
+            "iterations": args.iterations,
+            "sub_iterations": args.sub_iterations,
+            "repeat": config["repeat"],
+            "min_time": config["min_time"],
+        },
+        "results": bench.results,
+    }
+
+    if args.output is None:
+        json.dump(output, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4)
+
+    return 0
+
+
+def compare(args)->int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = []
+    for name in sorted(baseline.keys() & current.keys()):
+        before = baseline[name][args.statistic]
+        after = current[name][args.statistic]
+        ratio = after / before if before > 0 else float("inf")
+
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - args.threshold:
+            flag = "improvement"
+
+        print(f"{name:<32} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms  x{ratio:6.2f}  {flag}")
+
+    for name in sorted(baseline.keys() - current.keys()):
+        print(f"{name:<32} missing from {args.current}")
+
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main()->int:
+    parser = argparse.ArgumentParser(description="fernetfs benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = commands.add_parser("run", help="run the benchmarks and emit the results as JSON")
+    parser_run.add_argument("--quick", action="store_true", help="small sizes only, for a quick check")
+    parser_run.add_argument("--output", help="write the results to this file instead of stdout")
+    parser_run.add_argument("--repeat", type=int, help="number of measures of each benchmark")
+    parser_run.add_argument("--min-time", type=float, help="minimum time of each measure, fast benchmarks are repeated")
+    parser_run.add_argument("--iterations", type=int, default=480000, help="PBKDF2 iterations of the password")
+    parser_run.add_argument("--sub-iterations", type=int, default=48000, help="PBKDF2 iterations of the containers")
+    parser_run.set_defaults(function=run)
+
+    parser_compare = commands.add_parser("compare", help="compare results with a baseline")
+    parser_compare.add_argument("baseline", help="the results of reference")
+    parser_compare.add_argument("current", help="the results to check")
+    parser_compare.add_argument("--threshold", type=float, default=0.2, help="relative slowdown flagged as a regression")
+    parser_compare.add_argument("--statistic", choices=["min", "median", "mean"], default="min", help="the time compared")
+    parser_compare.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import logging
+
+from fernetfs.filesystem import FileSystem
+
+_log = logging.getLogger("AsyncFileSystem")
+
+
+class AsyncFile:
+    def __init__(self, file, data, run) -> None:
+        """
+        An asynchronous handle on a file opened by AsyncFileSystem. Each operation runs in the executor
+        of the filesystem, operations on the same handle are run one after the other.
+
+        :param file: The BasicFile returned by FileSystem.open
+        :type file: BasicFile
+        :param data: The file object of the opened BasicFile
+        :param run: The coroutine function running a blocking call in the executor
+        """
+
+        self._file = file
+        self._data = data
+        self._run = run
+        self._lock = asyncio.Lock()
+
+    async def _call(self, method, *args):
+        async with self._lock:
+            return await self._run(method, *args)
+
+    async def read(self, size:int=-1):
+        return await self._call(self._data.read, size)
+
+    async def readline(self, size:int=-1):
+        return await self._call(self._data.readline, size)
+
+    async def write(self, data)->int:
+        return await self._call(self._data.write, data)
+
+    async def seek(self, offset:int, whence:int=0)->int:
+        return await self._call(self._data.seek, offset, whence)
+
+    async def tell(self)->int:
+        return await self._call(self._data.tell)
+
+    async def flush(self)->None:
+        await self._call(self._data.flush)
+
+    async def aclose(self)->None:
+        """
+        It closes the file, a written file is encrypted and moved to its place at this point
+        """
+
+        await self._call(self._file.__exit__, None, None, None)
+
+    @property
+    def closed(self)->bool:
+        return self._data.closed
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+class AsyncFileSystem:
+    def __init__(self, filesystem:FileSystem=None, executor=None) -> None:
+        """
+        An asyncio front-end of FileSystem : key derivation, cryptography and disk I/O run in an
+        executor so that the event loop is never blocked, and operations run concurrently. Concurrent
+        identical read-only operations (ls, is_file_exist, is_directory_exist) share a single run. File
+        contents are read and written through AsyncFile handles.
+
+        :param filesystem: The filesystem to use, a new one by default
+        :type filesystem: FileSystem
+        :param executor: The concurrent.futures executor running blocking calls, the default executor
+        of the event loop if None
+        """
+
+        self._filesystem = filesystem if filesystem is not None else FileSystem()
+        self._executor = executor
+        self._inflight = {}
+        # bumped when a modification starts and when it ends, reads are only shared within one value
+        self._generation = 0
+
+
+    def get_filesystem(self)->FileSystem:
+        return self._filesystem
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def _modify(self, function, *args, **kwargs):
+        # reads started before or during the change must not be shared with later callers
+        self._generation += 1
+        try:
+            return await self._run(function, *args, **kwargs)
+        finally:
+            self._generation += 1
+
+    async def _coalesce(self, function, *args):
+        key = (self._generation, function.__name__, args)
+        future = self._inflight.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(self._run(function, *args))
+            self._inflight[key] = future
+
+            def forget(done):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+            future.add_done_callback(forget)
+        else:
+            _log.debug("Join %s%s", function.__name__, args)
+
+        # a cancelled caller doesn't cancel the others
+        return await asyncio.shield(future)
+
+    async def create(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16, sub_iterations:int=48000)->None:
+        await self._modify(self._filesystem.create, secret, current_working_directory, iterations, salt_size, sub_iterations)
+
+    async def mount(self, secret:bytes, current_working_directory:str, iterations:int=480000)->None:
+        await self._modify(self._filesystem.mount, secret, current_working_directory, iterations)
+
+    async def unmount(self)->None:
+        await self._modify(self._filesystem.unmount)
+
+    async def mkdir(self, path:str)->None:
+        await self._modify(self._filesystem.mkdir, path)
+
+    def _open(self, path:str, mode:str)->tuple:
+        file = self._filesystem.open(path, mode)
+        return file, file.__enter__()
+
+    async def open(self, path:str, mode:str)->AsyncFile:
+        # a new file is added to its listing when it is opened
+        if "r" in mode:
+            file, data = await self._run(self._open, path, mode)
+        else:
+            file, data = await self._modify(self._open, path, mode)
+
+        return AsyncFile(file, data, self._run)
+
+    async def remove_file(self, path:str)->None:
+        await self._modify(self._filesystem.remove_file, path)
+
+    async def remove_directory(self, path:str, recursive:bool=False)->None:
+        await self._modify(self._filesystem.remove_directory, path, recursive)
+
+    async def is_file_exist(self, path:str)->bool:
+        return await self._coalesce(self._filesystem.is_file_exist, path)
+
+    async def is_directory_exist(self, path:str)->bool:
+        return await self._coalesce(self._filesystem.is_directory_exist, path)
+
+    async def ls(self, path:str)->dict:
+        # the shared result is copied for each caller
+        return dict(await self._coalesce(self._filesystem.ls, path))
+
+    async def walk(self, path:str="/", topdown:bool=True, workers:int=4, max_pending:int=64)->list:
+        """
+        It returns the (dirpath, dirnames, filenames) tuples of FileSystem.walk as a list
+        """
+
+        return await self._run(lambda: list(self._filesystem.walk(path, topdown, workers, max_pending)))
+
+    async def compact(self, path:str)->None:
+        await self._modify(self._filesystem.compact, path)
+
+    async def convert(self)->int:
+        return await self._modify(self._filesystem.convert)
+
+    async def import_tree(self, source:str, destination:str="/", **kwargs)->dict:
+        return await self._modify(self._filesystem.import_tree, source, destination, **kwargs)
+
+    async def export_tree(self, source:str, destination:str, **kwargs)->dict:
+        return await self._run(self._filesystem.export_tree, source, destination, **kwargs)
@@ -1,14 +1,37 @@
 import io
+import os
+import fcntl
+import struct
 import logging
+import time
+from contextlib import suppress
 
 from fernetfs.primitives import Primitives
+from fernetfs.keycache import KeyCache
+from fernetfs.stats import Stats
+from fernetfs.stream import StreamReader, StreamWriter, is_stream, MAGIC, DEFAULT_CHUNK_SIZE
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("BasicFile")
+
+# the rollback record of an append : offset of the previous last chunk, then the inode and the size
+# of the container it was taken from, followed by the previous last chunk
+_ROLLBACK = struct.Struct(">QQQ")
+
+# the longest wait for a lock held by an append in place, in seconds, before giving up
+LOCK_TIMEOUT = 10.0
+LOCK_POLL_INTERVAL = 0.01
 
 class BasicFile:
-    def __init__(self, filename:str, secret:bytes, mode:str, iterations:int=480000, salt_size=16):
+    def __init__(self, filename:str, secret:bytes, mode:str, iterations:int=480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, chunk_size:int=DEFAULT_CHUNK_SIZE, stats:Stats=None):
         self._filename = filename
+        self._tmp_filename = None
+        self._append_file = None
         self._mode = mode
-        self._primitives = Primitives(secret, iterations, salt_size)
-        self._log = logging.getLogger(f"BasicFile({filename})")
+        self._chunk_size = chunk_size
+        self._primitives = Primitives(secret, iterations, salt_size, key_cache, version, stats)
+        self._stats = stats
+        self._log = ContextLogger(_log, filename)
         self._data = None
 
     def __enter__(self):
@@ -20,61 +43,249 @@ class BasicFile:
         self._log.debug("__exit__")
         self._close_file()
 
+    def read_view(self, buffer=None)->memoryview:
+        """
+        It decrypts the whole file, without opening it with "with". This is the binary read path with
+        the fewest copies : the ciphertext is read into a reusable buffer and whole chunks are
+        decrypted straight into the destination buffer
+
+        :param buffer: A writable bytes-like object large enough for the plain data, a new bytearray
+        of the right size if None
+        :return: A memoryview of the plain data, on the buffer
+        """
+
+        if self._mode.replace("b", "") != "r" or "b" not in self._mode:
+            raise ValueError(f"read_view needs the 'rb' mode, not '{self._mode}'")
+
+        with self._open_locked() as f:
+            head = f.read(len(MAGIC))
+            f.seek(0)
+
+            if not is_stream(head):
+                self._log.debug("Read legacy container")
+                plain = self._primitives.decrypt(f.read())
+                if buffer is None:
+                    return memoryview(plain)
+
+                view = memoryview(buffer).cast("B")
+                view[:len(plain)] = plain
+                return view[:len(plain)]
+
+            with StreamReader(f, self._primitives) as reader:
+                size = reader.size()
+                view = memoryview(buffer if buffer is not None else bytearray(size)).cast("B")
+                if len(view) < size:
+                    raise ValueError(f"The buffer is too small, {size} bytes are needed")
+
+                total = 0
+                while total < size:
+                    total += reader.readinto(view[total:size])
+                # the end is only reported once the last chunk is authenticated
+                reader.readinto(bytearray(1))
+
+        return view[:size]
+
+    def _count(self, name:str)->None:
+        if self._stats is not None:
+            self._stats.add(name)
+
     def _open_file(self):
         if "r" in self._mode :
             self._log.debug("Open with r")
+            self._count("files_read")
             return self._open_file_read()
         elif "w" in self._mode :
             self._log.debug("Open with w")
+            self._count("files_written")
             return self._open_file_write()
         elif "a" in self._mode :
             self._log.debug("Open with a")
-            return self._open_file_read(append=True)
+            self._count("files_appended")
+            return self._open_file_write(append=True)
 
-    def _open_file_read(self, append:bool=False):
+    def _wrap(self, data):
         if "b" in self._mode:
-            buffer = io.BytesIO
+            return data
+
+        return io.TextIOWrapper(data, encoding="utf8", newline="\n")
+
+    def _rollback_filename(self)->str:
+        return f"{self._filename}.append"
+
+    def _recover(self, f)->None:
+        # f is opened "r+b" and exclusively locked : an append was interrupted, the previous last chunk
+        # is written back and the appended chunks are dropped. A record taken from another container,
+        # one which replaced the appended one since, is only removed
+        try:
+            with open(self._rollback_filename(), "rb") as r:
+                rollback = r.read()
+        except FileNotFoundError:
+            return
+
+        stat = os.fstat(f.fileno())
+        if len(rollback) >= _ROLLBACK.size:
+            offset, inode, size = _ROLLBACK.unpack_from(rollback)
         else:
-            buffer = io.StringIO
+            offset, inode, size = 0, None, 0
+
+        # the append only grows the container, until it is truncated on close
+        if inode == stat.st_ino and stat.st_size >= size and offset <= size:
+            self._log.warning("Rollback an interrupted append")
+            f.seek(offset)
+            f.write(rollback[_ROLLBACK.size:])
+            f.truncate()
+            f.flush()
+        else:
+            self._log.warning("Drop the rollback record of another container")
+        os.remove(self._rollback_filename())
+
+    def _lock(self, f, operation:int)->None:
+        # the lock is polled : an append in place held by the same thread, on another descriptor,
+        # raises an error instead of waiting forever
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(f.fileno(), operation | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"{self._filename} is locked by an append in progress")
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def _open_locked(self):
+        # readers share a lock on the file, so that an append in place never happens under them
+        while True:
+            if os.path.exists(self._rollback_filename()):
+                with open(self._filename, "r+b") as f:
+                    self._lock(f, fcntl.LOCK_EX)
+                    self._recover(f)
+
+            f = open(self._filename, "rb")
+            try:
+                self._lock(f, fcntl.LOCK_SH)
+            except Exception as e:
+                f.close()
+                raise e
+            # the appender may have died while we were waiting for the lock
+            if not os.path.exists(self._rollback_filename()):
+                return f
+            f.close()
+
+    def _open_file_read(self):
+        f = self._open_locked()
 
         try:
-            with open(self._filename, f"r") as f:
-                container_data = f.read()
-                
-                plain = self._primitives.decrypt(container_data)
+            head = f.read(len(MAGIC))
+            f.seek(0)
 
-                if "b" not in self._mode:
-                    plain = str(plain, "utf8")
+            if is_stream(head):
+                data = io.BufferedReader(StreamReader(f, self._primitives), self._chunk_size)
+            else:
+                self._log.debug("Read legacy container")
+                with f:
+                    data = io.BytesIO(self._primitives.decrypt(f.read()))
         except Exception as e:
-            if not append:
+            f.close()
+            raise e
+
+        self._data = self._wrap(data)
+
+    def _open_file_append(self):
+        # a segmented container is appended in place, locked against other appenders and readers. The
+        # previous last chunk is saved aside first, so that an interrupted append can be rolled back.
+        # A file being read or appended to is rewritten instead, without waiting
+        try:
+            f = open(self._filename, "r+b")
+        except FileNotFoundError:
+            self._log.debug("Append to a new file")
+            return None
+
+        try:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._log.debug("Rewrite a file in use")
+                f.close()
+                return None
+
+            self._recover(f)
+            # the rollback leaves the position at the end
+            f.seek(0)
+
+            if not is_stream(f.read(len(MAGIC))):
+                # a legacy container is rewritten as a segmented one
+                f.close()
+                return None
+
+            writer = StreamWriter(f, self._primitives, closefd=False, append=True)
+            offset, stored = writer.tail()
+
+            rollback = f"{self._rollback_filename()}.{os.getpid()}-{id(self):x}.tmp"
+            stat = os.fstat(f.fileno())
+            with open(rollback, "wb") as r:
+                r.write(_ROLLBACK.pack(offset, stat.st_ino, stat.st_size))
+                r.write(stored)
+            os.replace(rollback, self._rollback_filename())
+        except Exception as e:
+            f.close()
+            raise e
+
+        self._append_file = f
+        return writer
+
+    def _open_file_write(self, append:bool=False):
+        if append:
+            writer = self._open_file_append()
+            if writer is not None:
+                self._data = self._wrap(io.BufferedWriter(writer, writer.chunk_size()))
+                return
+
+        # the container is written aside, under a name unique to this writer, and replaces the previous
+        # one on close
+        self._tmp_filename = f"{self._filename}.{os.getpid()}-{id(self):x}.tmp"
+        writer = StreamWriter(open(self._tmp_filename, "wb"), self._primitives, self._chunk_size)
+
+        if append:
+            try:
+                with self._open_locked() as f:
+                    self._primitives.decrypt_stream(f, writer)
+            except FileNotFoundError:
+                self._log.debug("Append to a new file")
+            except Exception as e:
+                writer.close()
+                os.remove(self._tmp_filename)
+                self._tmp_filename = None
                 raise e
-            else:
-                plain = ""
 
-        self._data = buffer(plain)
+        self._data = self._wrap(io.BufferedWriter(writer, self._chunk_size))
 
-    def _open_file_write(self):
-        if "b" in self._mode:
-            self._data = io.BytesIO()
-        else:
-            self._data = io.StringIO()
+    def _replace(self)->None:
+        # the replacement is atomic, readers and appenders of the previous container keep it until
+        # they close it. The rollback record of an interrupted append goes with it
+        with suppress(FileNotFoundError):
+            os.remove(self._rollback_filename())
+        os.replace(self._tmp_filename, self._filename)
 
     def _close_file(self):
-        if "a" in self._mode or "w" in self._mode:
-            self._close_write_file()
+        if self._append_file is not None:
+            try:
+                self._data.close()
+                # the rollback is dropped before the lock is released, unless a rewrite dropped it
+                with suppress(FileNotFoundError):
+                    os.remove(self._rollback_filename())
+                if self._log.isEnabledFor(logging.DEBUG):
+                    self._log.debug("Append, now %d bytes", os.path.getsize(self._filename))
+            finally:
+                self._data = None
+                self._append_file.close()
+                self._append_file = None
+            return
 
         self._data.close()
         self._data = None
 
-    def _close_write_file(self):
-        data = self._data.getvalue()
-        self._log.debug(f"Data length : {len(data)}")
-
-        if "b" not in self._mode:
-            data = bytes(data, "utf8")
-
-        container_data = self._primitives.encrypt(data)
-
-        with open(self._filename, f"w") as f:
-            self._log.debug(f"Write {len(container_data)} bytes to {self._filename}")
-            f.write(container_data)
+        if self._tmp_filename is not None:
+            self._replace()
+            if self._log.isEnabledFor(logging.DEBUG):
+                self._log.debug("Write %d bytes", os.path.getsize(self._filename))
+            self._tmp_filename = None
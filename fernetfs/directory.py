@@ -5,13 +5,19 @@ import shutil
 
 from fernetfs.primitives import Primitives
 from fernetfs.listing import ListingDirectory
+from fernetfs.keycache import KeyCache
+from fernetfs.listingcache import ListingCache
+from fernetfs.stats import Stats
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("Directory")
 
 class Directory:
-    def __init__(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16) -> None:
-        self._primitives = Primitives(secret, iterations, salt_size)
-        self._log = logging.getLogger(f"{self.__class__.__name__}({current_working_directory})")
+    def __init__(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, listing_cache:ListingCache=None, journal:bool=False, stats:Stats=None) -> None:
+        self._primitives = Primitives(secret, iterations, salt_size, key_cache, version, stats)
+        self._log = ContextLogger(_log, current_working_directory)
         self._current_working_directory = current_working_directory
-        self._listing = ListingDirectory(secret, current_working_directory, iterations, salt_size)
+        self._listing = ListingDirectory(secret, current_working_directory, iterations, salt_size, key_cache, version, listing_cache, journal, stats)
 
     def check_path(self, path:str)->None:
         if path.endswith("/"):
@@ -29,70 +35,61 @@ class Directory:
 
 
     def mkdir(self, name:str)->str:
-        listing = self._listing.get()
-
         name = self.check_path(name)
 
-        if name in listing:
-            raise OSError(f"Directory {name} already exists")
+        with self._listing.lock:
+            if self._listing.lookup(name) is not None:
+                raise OSError(f"Directory {name} already exists")
 
-        listing = self._listing.add(name, listing)
+            hash_name = self._listing.new_hash()
 
-        hash_name = listing[name]
+            full_hash_name = os.path.join(self._current_working_directory, hash_name)
+            os.mkdir(full_hash_name)
+            self._log.debug("Create directory %s -> %s", name, full_hash_name)
+            self._listing.insert(name, hash_name)
 
-        full_hash_name = os.path.join(self._current_working_directory, hash_name)
-        os.mkdir(full_hash_name)
-        self._log.debug(f"Create directory {name} -> {full_hash_name}")
-        self._listing.write(listing)
         return hash_name
 
     def ls(self)->list:
-        listing = self._listing.get()
+        return self._listing.keys()
 
-        return list(listing.keys())
+    def entries(self)->dict:
+        """
+        It returns the hashed name of each sub-directory, by name
+        """
 
-    def gethash(self, name:str)->str:
-        listing = self._listing.get()
+        return self._listing.items()
 
+    def gethash(self, name:str)->str:
         name = self.check_path(name)
 
-        if name not in listing:
-            raise Exception(f"No directory named {name}")
+        hash_name = self._listing.lookup(name)
 
-        hash_name = listing[name]
+        if hash_name is None:
+            raise Exception(f"No directory named {name}")
 
         return hash_name
 
     def exists(self, name:str)->bool:
-        listing = self._listing.get()
-
         name = self.check_path(name)
 
-        if name not in listing:
-            return False
-        return True
+        return self._listing.lookup(name) is not None
 
     def rm(self, name, recursive=False)->None:
-        listing = self._listing.get()
-
-        name = self.check_path(name)
-
-        if name not in listing:
-            raise Exception(f"No directory named {name}")
+        with self._listing.lock:
+            hash_name = self.gethash(name)
 
-        full_path = os.path.join(self._current_working_directory, listing[name])
+            full_path = os.path.join(self._current_working_directory, hash_name)
 
-        if not recursive:
-            os.rmdir(full_path)
-        else:
-            shutil.rmtree(full_path)
+            if not recursive:
+                os.rmdir(full_path)
+            else:
+                shutil.rmtree(full_path)
 
-        del listing[name]
+            self._listing.discard(self.check_path(name))
 
-        if len(listing) > 0:
-            self._listing.write(listing)
-        else:
-            self._listing.remove()
+    def compact(self)->None:
+        self._listing.compact()
 
     def cwd(self):
         return self._current_working_directory
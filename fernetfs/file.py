@@ -1,23 +1,34 @@
 import logging
 import os.path
 import os
+import glob
+from contextlib import suppress
 
 from fernetfs.basicfile import BasicFile
 from fernetfs.primitives import Primitives
 from fernetfs.listing import ListingFile
 from fernetfs.tmpfile import TmpFile
+from fernetfs.keycache import KeyCache
+from fernetfs.listingcache import ListingCache
+from fernetfs.stats import Stats
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("File")
 
 
 class File():
-    def __init__(self, secret: bytes, current_working_directory: str, iterations: int = 480000, salt_size=16):
+    def __init__(self, secret: bytes, current_working_directory: str, iterations: int = 480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, listing_cache:ListingCache=None, journal:bool=False, stats:Stats=None):
         self._current_working_directory = current_working_directory
-        self._primitives = Primitives(secret, iterations, salt_size)
-        self._log = logging.getLogger(f"File({current_working_directory})")
-        self._listing = ListingFile(secret, current_working_directory, iterations, salt_size)
+        self._primitives = Primitives(secret, iterations, salt_size, key_cache, version, stats)
+        self._log = ContextLogger(_log, current_working_directory)
+        self._listing = ListingFile(secret, current_working_directory, iterations, salt_size, key_cache, version, listing_cache, journal, stats)
 
         self._secret = secret
         self._iterations = iterations
         self._salt_size = salt_size
+        self._key_cache = key_cache
+        self._version = version
+        self._stats = stats
 
     def check_path(self, path:str)->None:
         head, _ = os.path.split(path)
@@ -26,100 +37,133 @@ class File():
             raise Exception("File must be in the current directory")
 
     def open(self, filename:str, mode:str)->BasicFile:
-        listing = self._listing.get()
-
         self.check_path(filename)
 
-        if filename not in listing:
-            if "r" in mode:
-                raise Exception(f"No file named {filename}")
-            else:
-                listing = self._listing.add(filename, listing)
+        # two writers creating the same file must agree on its hashed name, readers only share the lock
+        lock = self._listing.lock.shared() if "r" in mode else self._listing.lock
+        with lock:
+            hash_name = self._listing.lookup(filename)
 
-        hash_name = listing[filename]
-        path = os.path.join(self._current_working_directory, hash_name)
-        self._log.debug(f"Opening {filename} ({path}) in '{mode}' mode")
+            created = False
+            if hash_name is None:
+                if "r" in mode:
+                    raise Exception(f"No file named {filename}")
+                else:
+                    hash_name = self._listing.new_hash()
+                    created = True
+
+            path = os.path.join(self._current_working_directory, hash_name)
+            self._log.debug("Opening %s (%s) in '%s' mode", filename, path, mode)
+
+            # exists() is only needed to drop an inconsistent entry from the listing
+            if "r" in mode and not os.path.exists(path) and not self.exists(filename):
+                raise Exception(f"No file named {filename} ({path})")
+
+            file = BasicFile(path, self._secret, mode, self._iterations, self._salt_size, self._key_cache, self._version, stats=self._stats)
 
-        if "r" in mode and not self.exists(filename):
-            raise Exception(f"No file named {filename} ({path})")
+            # the listing is only rewritten when it changed
+            if created:
+                self._listing.insert(filename, hash_name)
 
-        file = BasicFile(path, self._secret, mode, self._iterations, self._salt_size)
-        self._listing.write(listing)
-        
         return file
 
-    def open_in_ram(self, filename:str, command:str)->TmpFile:
-        listing = self._listing.get()
+    def reserve(self, filename:str)->tuple:
+        """
+        It returns the hashed name of a file and whether it is a new file. A new file is only added to
+        the listing by commit(), once its content is written
+        """
+
+        self.check_path(filename)
+
+        hash_name = self._listing.lookup(filename)
+        if hash_name is not None:
+            return hash_name, False
 
+        return self._listing.new_hash(), True
+
+    def commit(self, filename:str, hash_name:str)->None:
+        self._listing.insert(filename, hash_name)
+
+    def open_in_ram(self, filename:str, command:str)->TmpFile:
         self.check_path(filename)
 
-        if filename not in listing:
+        if self._listing.lookup(filename) is None:
             self._log.debug("Creating empty file of RAM file")
             with self.open(filename, "wb") as f:
                 f.write(b"")
-            listing = self._listing.get()
             
-        hash_name = listing[filename]
+        hash_name = self._listing.lookup(filename)
         path = os.path.join(self._current_working_directory, hash_name)
-        file = TmpFile(self._secret, path, command, self._iterations, self._salt_size)
-        file.run()
+        file = TmpFile(self._secret, path, self._iterations, self._salt_size, self._key_cache, self._version, stats=self._stats)
+        file.run(command)
 
     def ls(self)->list:
-        listing = self._listing.get()
-        return list(listing.keys())
+        return self._listing.keys()
 
-    def exists(self, filename:str)->bool:
-        listing = self._listing.get()
+    def entries(self)->dict:
+        """
+        It returns the hashed name of each file, by name
+        """
+
+        return self._listing.items()
 
+    def exists(self, filename:str)->bool:
         self.check_path(filename)
 
-        if filename not in listing:
-            self._log.debug(f"File {filename} in not in listing")
-            return False
-        
-        hash_name = listing[filename]
-        path = os.path.join(self._current_working_directory, hash_name)
+        with self._listing.lock.shared():
+            hash_name = self._listing.lookup(filename)
+
+            if hash_name is None:
+                self._log.debug("File %s in not in listing", filename)
+                return False
+
+            path = os.path.join(self._current_working_directory, hash_name)
+
+            # prevent Inconsistent between listinges and files, a file opened for writing only
+            # exists once it is closed
+            if not os.path.exists(path):
+                if len(glob.glob(f"{glob.escape(path)}.*.tmp")) > 0:
+                    self._log.debug("File %s is being written", path)
+                    return False
 
-        # prevent Inconsistent between listinges and files
-        if not os.path.exists(path):
-            self._log.debug(f"File {path} in in fs")
-            del listing[filename]
-            self._listing.write(listing)
-            return False
+                self._log.debug("File %s in in fs", path)
+                with self._listing.lock:
+                    # upgrading the lock may let another process change the entry meanwhile
+                    if self._listing.lookup(filename) == hash_name and not os.path.exists(path):
+                        self._listing.discard(filename)
+                return False
 
-        self._log.debug(f"File {path} exists")
+        self._log.debug("File %s exists", path)
 
         return True
 
     def rm(self, filename:str)->None:
-        listing = self._listing.get()
-
         self.check_path(filename)
 
-        if not self.exists(filename):
-            raise Exception(f"No file named {filename}")
-
-        hash_name = listing[filename]
-        path = os.path.join(self._current_working_directory, hash_name)
+        with self._listing.lock:
+            if not self.exists(filename):
+                raise Exception(f"No file named {filename}")
 
-        os.remove(path)
+            hash_name = self._listing.lookup(filename)
+            path = os.path.join(self._current_working_directory, hash_name)
 
-        del listing[filename]
+            os.remove(path)
+            # the rollback record of an interrupted append would be applied to a later file of the same name
+            with suppress(FileNotFoundError):
+                os.remove(f"{path}.append")
 
-        if len(listing) > 0:
-            self._listing.write(listing)
-        else:
-            self._listing.remove()
+            self._listing.discard(filename)
 
     def get_hash(self, filename:str)->str:
-        listing = self._listing.get()
-
         self.check_path(filename)
 
-        if filename not in listing:
-            self._log.debug(f"File {filename} has no hash")
+        hash_name = self._listing.lookup(filename)
+
+        if hash_name is None:
+            self._log.debug("File %s has no hash", filename)
             raise Exception(f"File {filename} has no hash")
-        
-        hash_name = listing[filename]
 
         return hash_name
+
+    def compact(self)->None:
+        self._listing.compact()
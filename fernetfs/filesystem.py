@@ -3,29 +3,72 @@ import logging
 import os.path
 import os
 import glob
+import posixpath
+import threading
+import time
+import functools
+from collections import deque
+from contextlib import contextmanager, suppress
+from concurrent.futures import ThreadPoolExecutor
 
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import InvalidToken
 
 from fernetfs.file import File
 from fernetfs.directory import Directory
 from fernetfs.masterconfiguration import MasterConfiguration
-from fernetfs.tmpfile import TmpFile
+from fernetfs.tmpfile import TmpFile, DEFAULT_DEBOUNCE
+from fernetfs.tmpsession import TmpSession
+from fernetfs.keycache import KeyCache
+from fernetfs.listingcache import ListingCache
+from fernetfs.listinglock import ListingLock
+from fernetfs.resolutioncache import ResolutionCache
+from fernetfs.primitives import Primitives
+from fernetfs.stream import is_stream, MAGIC
+from fernetfs.stats import Stats, span
+from fernetfs.tracer import Tracer
+from fernetfs.log import ContextLogger
 
+_log = logging.getLogger("FileSystem")
+
+
+def _operation(method):
+    # counts the calls of an operation of the filesystem, and times it with the tracer if any
+    name = method.__name__
+    counter = f"op_{name}"
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._stats.add(counter)
+        with span(self._stats, name):
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 class FileSystem():
     KEY_LENGTH = 256
     SALT_LENGTH = 256
-    def __init__(self):
+    def __init__(self, key_cache_size:int=KeyCache.DEFAULT_SIZE, listing_cache_size:int=ListingCache.DEFAULT_SIZE, resolution_cache_size:int=ResolutionCache.DEFAULT_SIZE, journal_listings:bool=False, collect_stats:bool=True, tracer:Tracer=None):
         self._current_working_directory = None
         self._salt_size = None
         self._sub_iterations = None
         self._key = None
+        self._key_cache = KeyCache(key_cache_size)
+        self._listing_cache = ListingCache(listing_cache_size)
+        self._resolution_cache = ResolutionCache(resolution_cache_size)
+        # listing changes are appended to journals, for write-heavy trees
+        self._journal_listings = journal_listings
+        # counters of the work done, see stats(). The tracer, if any, times the operations and their
+        # phases (kdf, cipher, io, json); opening a file only covers its resolution, not the reads
+        self._stats = Stats(collect_stats, tracer)
 
-        self._master_conf = MasterConfiguration(FileSystem.SALT_LENGTH)
+        # once mounted, the filesystem can be shared between threads : each listing is locked during
+        # its read-modify-write cycles, so only updates of the same directory wait for each other.
+        # mount and unmount must not run concurrently with other operations
 
-        self._log = logging.getLogger(f"FileSystem(unmounted)")
+        self._master_conf = MasterConfiguration(FileSystem.SALT_LENGTH, FileSystem.KEY_LENGTH)
+
+        self._log = ContextLogger(_log, "unmounted")
 
     def create(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16, sub_iterations:int=48000)->None:
         path = os.path.join(current_working_directory, "*")
@@ -36,31 +79,139 @@ class FileSystem():
 
         self._master_conf.create(secret, current_working_directory, iterations, salt_size, sub_iterations)
 
+    @_operation
     def mount(self, secret:bytes, current_working_directory:str, iterations:int=480000)->None:
         
         try:
-            conf = self._master_conf.get(secret, current_working_directory, iterations)
+            conf = self._master_conf.get(secret, current_working_directory, iterations, stats=self._stats)
         except FileNotFoundError as e:
-            self._log.error(f"{current_working_directory} is not a valid fs ! ")
+            self._log.error("%s is not a valid fs ! ", current_working_directory)
             raise e
-        except InvalidToken as e:
-            self._log.error(f"Password is invalid !")
+        except (InvalidToken, InvalidTag) as e:
+            self._log.error("Password is invalid !")
             raise e
         
         self._current_working_directory = current_working_directory
         self._salt_size = conf["salt_size"]
         self._sub_iterations = conf["sub_iterations"]
-        salt = conf["salt"]
+        self._key = conf["key"]
+        self._key_cache.clear()
+        self._listing_cache.clear()
+        self._resolution_cache.clear()
+
+        self._log = ContextLogger(_log, current_working_directory)
+
+    def unmount(self)->None:
+        self._key_cache.clear()
+        self._listing_cache.clear()
+        self._resolution_cache.clear()
+        self._key = None
+        self._current_working_directory = None
+        self._salt_size = None
+        self._sub_iterations = None
+
+        self._log = ContextLogger(_log, "unmounted")
+
+    def get_key_cache(self)->KeyCache:
+        return self._key_cache
+
+    def get_listing_cache(self)->ListingCache:
+        return self._listing_cache
+
+    def get_resolution_cache(self)->ResolutionCache:
+        return self._resolution_cache
+
+    def get_tracer(self)->Tracer:
+        return self._stats.tracer
+
+    def stats(self)->dict:
+        """
+        It returns the counters of the work done since the creation of the filesystem or the last
+        reset_stats(), summed over all threads :
+
+        * op_<name> : calls of each operation of the filesystem
+        * pbkdf2, hkdf, key_cache_hits : key derivations, and derivations saved by the key cache
+        * listing_reads, listing_cache_hits, listing_writes : listings decrypted, served from the
+          listing cache and encrypted
+        * journal_appends, journal_records_read : records of journaled listings
+        * files_read, files_written, files_appended : files opened, by mode
+        * chunks_encrypted, bytes_encrypted, chunks_decrypted, bytes_decrypted, legacy_decrypted :
+          data going through the ciphers
+
+        Nothing is counted when the filesystem was created with collect_stats=False.
+
+        :return: The counters, by name
+        """
+
+        return self._stats.snapshot()
+
+    def reset_stats(self)->None:
+        self._stats.reset()
+
+    @_operation
+    def convert(self)->int:
+        # rewrite in place every legacy JSON container of the mounted tree as a binary container.
+        # The master configuration is keyed by the password and is left as is.
+        primitives = Primitives(self._key, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, self._stats)
+        converted = 0
+
+        for root, _, filenames in os.walk(self._current_working_directory):
+            # the listings of the directory are not rewritten by others during its conversion
+            with ListingLock.for_directory(root):
+                for filename in filenames:
+                    # journal records are binary containers already
+                    if filename == MasterConfiguration.FILENAME or filename.endswith((".tmp", ".journal", ".append")):
+                        continue
+
+                    path = os.path.join(root, filename)
+                    if self._convert_file(primitives, path):
+                        self._log.debug("Convert %s", path)
+                        converted += 1
 
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=FileSystem.KEY_LENGTH,
-            salt=salt,
-            iterations=iterations,
-        )
-        self._key = kdf.derive(secret)
+        return converted
 
-        self._log = logging.getLogger(f"FileSystem({current_working_directory})")
+    def _convert_file(self, primitives:Primitives, path:str)->bool:
+        try:
+            with open(path, "rb") as f:
+                if is_stream(f.read(len(MAGIC))):
+                    return False
+                f.seek(0)
+                plain = primitives.decrypt_json(f.read())
+        except FileNotFoundError:
+            # removed since the directory was listed
+            return False
+
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(primitives.encrypt(plain))
+            os.replace(tmp_path, path)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+        return True
+
+    @contextmanager
+    def batch(self):
+        # listing changes of the calling thread are kept in memory and each changed listing is written
+        # once on exit. Directories and file contents are still written immediately. On exit, the
+        # changes are applied to each listing read again under the lock of its directory, so the
+        # entries changed by other threads and processes during the batch are kept.
+        self._listing_cache.begin_batch()
+        try:
+            yield self
+        finally:
+            self._listing_cache.end_batch()
+
+    @_operation
+    def compact(self, path:str)->None:
+        # fold the listing journals of the directory into its listings, the directory is resolved
+        # like ls does
+        directory, _ = self._get_directory(path)
+        directory.compact()
+        self._get_file(directory).compact()
 
     def _split_path(self, path:str)->list:
         if path.startswith("/"):
@@ -71,58 +222,406 @@ class FileSystem():
 
         return list(path.split("/"))
 
-    def _get_directory(self, relative_path:Str)->Directory:
-        path = self._current_working_directory
-        directory = Directory(self._key, self._current_working_directory, self._sub_iterations, self._salt_size)
+    def _new_directory(self, path:str)->Directory:
+        return Directory(self._key, path, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, self._listing_cache, self._journal_listings, self._stats)
+
+    def _new_file(self, path:str)->File:
+        return File(self._key, path, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, self._listing_cache, self._journal_listings, self._stats)
+
+    def _resolve(self, sub_dirs:list)->Directory:
+        # start from the deepest cached directory, it is enough to check it still exists on disk
+        # since hashed names are never reused
+        depth = len(sub_dirs)
+        directory = None
+        while depth > 0:
+            prefix = "/".join(sub_dirs[:depth])
+            directory = self._resolution_cache.get(prefix)
+            if directory is not None:
+                if os.path.isdir(directory.cwd()):
+                    break
+                self._resolution_cache.invalidate(prefix)
+                directory = None
+            depth -= 1
+
+        if directory is None:
+            directory = self._resolution_cache.get("")
+            if directory is None:
+                directory = self._new_directory(self._current_working_directory)
+                self._resolution_cache.put("", directory, self._new_file(directory.cwd()))
+
+        for index in range(depth, len(sub_dirs)):
+            hash_name = directory.gethash(sub_dirs[index])
+            path = os.path.join(directory.cwd(), hash_name)
+            directory = self._new_directory(path)
+            self._resolution_cache.put("/".join(sub_dirs[:index + 1]), directory, self._new_file(path))
 
+        return directory
+
+    def _get_directory(self, relative_path:Str)->Directory:
         sub_dirs = self._split_path(relative_path)
-        for sub_dir in sub_dirs[:-1]:
-            hash_name = directory.gethash(sub_dir)
-            path = os.path.join(path, hash_name)
-            directory = Directory(self._key, path, self._sub_iterations, self._salt_size)
+        directory = self._resolve(sub_dirs[:-1])
 
         return directory, sub_dirs[-1]
 
     def _get_file(self, directory:Directory)->File:
         cwd = directory.cwd()
-        return File(self._key, cwd, self._sub_iterations, self._salt_size)
+        file = self._resolution_cache.get_file(cwd)
+        if file is None:
+            file = self._new_file(cwd)
+
+        return file
+
+    def _read_directory(self, cwd:str)->tuple:
+        # the hashed names of the sub-directories and of the files, by name
+        return self._new_directory(cwd).entries(), self._new_file(cwd).entries()
+
+    def walk(self, path:str="/", topdown:bool=True, workers:int=4, max_pending:int=64):
+        """
+        It generates the tree below a directory like os.walk, as (dirpath, dirnames, filenames)
+        tuples of logical paths and names. The listings of the next directories to visit are
+        decrypted ahead of time in a pool of threads. In top-down order, dirnames can be modified
+        in place to prune the walk.
+
+        :param path: The logical path of the directory to walk
+        :type path: str
+        :param topdown: Yield a directory before its sub-directories
+        :type topdown: bool
+        :param workers: The number of threads decrypting listings, 1 decrypts them in the caller thread
+        :type workers: int
+        :param max_pending: The maximum number of directories decrypted ahead, it bounds the memory
+        :type max_pending: int
+        """
+
+        self._stats.add("op_walk")
+
+        for dirpath, dirnames, files, _ in self._walk(path, topdown, workers, max_pending):
+            yield dirpath, dirnames, list(files)
+
+    def _walk(self, path:str, topdown:bool, workers:int, max_pending:int):
+        # like walk, with the hashed names of the files and the path on disk of the directory
+        sub_dirs = [d for d in self._split_path(path) if d != ""]
+        root = "/" + "/".join(sub_dirs)
+        root_cwd = self._resolve(sub_dirs).cwd()
+
+        # staged listing changes are only visible to the thread running the batch
+        executor = None
+        if workers > 1 and not self._listing_cache.in_batch():
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fernetfs-walk")
+
+        pending = {}
+
+        def read(cwd:str)->tuple:
+            future = pending.pop(cwd, None)
+            if future is None:
+                return self._read_directory(cwd)
+            return future.result()
 
+        # ("visit", dirpath, cwd) or ("yield", dirpath, dirnames, files, cwd), the top is the end
+        stack = [("visit", root, root_cwd)]
+        try:
+            while stack:
+                item = stack.pop()
+
+                if item[0] == "yield":
+                    yield item[1:]
+                    continue
+
+                _, dirpath, cwd = item
+                entries, files = read(cwd)
+                dirnames = list(entries)
+
+                if topdown:
+                    yield dirpath, dirnames, files, cwd
+                else:
+                    stack.append(("yield", dirpath, dirnames, files, cwd))
+
+                for name in reversed(dirnames):
+                    hash_name = entries.get(name)
+                    if hash_name is not None:
+                        stack.append(("visit", posixpath.join(dirpath, name), os.path.join(cwd, hash_name)))
+
+                # the next directories to visit are on the top of the stack
+                if executor is not None:
+                    for candidate in reversed(stack):
+                        if len(pending) >= max_pending:
+                            break
+                        if candidate[0] == "visit" and candidate[2] not in pending:
+                            pending[candidate[2]] = executor.submit(self._read_directory, candidate[2])
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _encrypt_file(self, source:str, path:str)->int:
+        # run by the workers
+        primitives = Primitives(self._key, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, self._stats)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+        with open(source, "rb") as infile:
+            primitives.encrypt_stream(infile, open(tmp_path, "wb"))
+            size = infile.tell()
+
+        os.replace(tmp_path, path)
+        return size
+
+    @_operation
+    def import_tree(self, source:str, destination:str="/", workers:int=4, max_pending:int=256, progress=None)->dict:
+        """
+        It copies a plain directory tree into an existing directory of the filesystem. Files are
+        streamed and encrypted in a pool of threads. A file is added to its listing once its content is
+        written, and each listing is written once per directory - or per max_pending files for larger
+        directories. Existing directories are merged and existing files are overwritten.
+
+        :param source: The path of the plain directory
+        :type source: str
+        :param destination: The logical path of the directory receiving the tree
+        :type destination: str
+        :param workers: The number of threads encrypting files
+        :type workers: int
+        :param max_pending: The maximum number of files being encrypted, it bounds the memory
+        :type max_pending: int
+        :param progress: A callable receiving the statistics each time files are added to a listing
+        :return: The statistics : directories, files, bytes, seconds and throughput (bytes per second)
+        """
+
+        start = time.monotonic()
+        stats = {"directories": 0, "files": 0, "bytes": 0, "seconds": 0.0, "throughput": 0.0}
+
+        sub_dirs = [d for d in self._split_path(destination) if d != ""]
+        directories = {source: self._resolve(sub_dirs)}
+
+        # groups of (File, [(filename, hash_name, created, future)]) added to their listing in order
+        pending = deque()
+        in_flight = 0
+
+        def commit()->int:
+            file, entries = pending.popleft()
+            with self.batch():
+                for filename, hash_name, created, future in entries:
+                    stats["bytes"] += future.result()
+                    if created:
+                        file.commit(filename, hash_name)
+
+            stats["files"] += len(entries)
+            stats["seconds"] = time.monotonic() - start
+            stats["throughput"] = stats["bytes"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+            if progress is not None:
+                progress(dict(stats))
+
+            return len(entries)
+
+        executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="fernetfs-import")
+        try:
+            for root, dirnames, filenames in os.walk(source):
+                directory = directories.pop(root)
+                cwd = directory.cwd()
+
+                with self.batch():
+                    for name in dirnames:
+                        # like walk, links to directories are not followed
+                        if os.path.islink(os.path.join(root, name)):
+                            continue
+                        if directory.exists(name):
+                            hash_name = directory.gethash(name)
+                        else:
+                            hash_name = directory.mkdir(name)
+                            stats["directories"] += 1
+                        directories[os.path.join(root, name)] = self._new_directory(os.path.join(cwd, hash_name))
+
+                file = self._get_file(directory)
+                group = None
+                for filename in filenames:
+                    source_path = os.path.join(root, filename)
+                    if not os.path.isfile(source_path):
+                        continue
+
+                    if in_flight >= max_pending:
+                        if pending[0] is group:
+                            group = None
+                        in_flight -= commit()
+
+                    if group is None:
+                        group = (file, [])
+                        pending.append(group)
+
+                    hash_name, created = file.reserve(filename)
+                    future = executor.submit(self._encrypt_file, source_path, os.path.join(cwd, hash_name))
+                    group[1].append((filename, hash_name, created, future))
+                    in_flight += 1
+
+            while pending:
+                commit()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self._log.info("Import %d files (%d bytes) in %.3fs, %.1f MB/s", stats["files"], stats["bytes"], stats["seconds"], stats["throughput"] / 1e6)
+        return stats
+
+    def _decrypt_file(self, path:str, target:str)->int:
+        # run by the workers, the chunks are decrypted one at a time
+        primitives = Primitives(self._key, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, self._stats)
+        # unique to the worker : a file "x" and a file "x.tmp" are exported by different workers
+        tmp_path = f"{target}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+        try:
+            with open(path, "rb") as infile, open(tmp_path, "wb") as outfile:
+                primitives.decrypt_stream(infile, outfile)
+                size = outfile.tell()
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, target)
+        return size
+
+    @_operation
+    def export_tree(self, source:str, destination:str, workers:int=4, max_pending:int=256, ignore_errors:bool=False, progress=None)->dict:
+        """
+        It copies a directory of the filesystem, with its logical names, into a plain directory which
+        is created if needed. Listings and files are decrypted in pools of threads, chunk by chunk, so
+        the memory used by each worker doesn't depend on the size of the files. A file is only written
+        under its name once it is completely decrypted and authenticated.
+
+        :param source: The logical path of the directory to export
+        :type source: str
+        :param destination: The path of the plain directory
+        :type destination: str
+        :param workers: The number of threads decrypting files
+        :type workers: int
+        :param max_pending: The maximum number of files being decrypted
+        :type max_pending: int
+        :param ignore_errors: Go on with the other files when a file can't be decrypted, the failures
+        are reported in the statistics instead of being raised
+        :type ignore_errors: bool
+        :param progress: A callable receiving the statistics each time a file is exported
+        :return: The statistics : directories, files, bytes, seconds, throughput (bytes per second)
+        and errors, a list of (logical path, error message)
+        """
+
+        start = time.monotonic()
+        stats = {"directories": 0, "files": 0, "bytes": 0, "seconds": 0.0, "throughput": 0.0, "errors": []}
+
+        # (logical path, future) in submission order
+        pending = deque()
+
+        def collect()->None:
+            path, future = pending.popleft()
+            try:
+                stats["bytes"] += future.result()
+                stats["files"] += 1
+            except Exception as e:
+                if not ignore_errors:
+                    raise
+                self._log.warning("Can't export %s : %s", path, e)
+                stats["errors"].append((path, str(e)))
+
+            stats["seconds"] = time.monotonic() - start
+            stats["throughput"] = stats["bytes"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+            if progress is not None:
+                progress(dict(stats))
+
+        root = "/" + "/".join(d for d in self._split_path(source) if d != "")
+        executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="fernetfs-export")
+        try:
+            for dirpath, _, files, cwd in self._walk(root, True, workers, max_pending):
+                relative = posixpath.relpath(dirpath, root)
+                target_directory = os.path.normpath(os.path.join(destination, relative))
+                os.makedirs(target_directory, exist_ok=True)
+                stats["directories"] += 1
+
+                for filename, hash_name in files.items():
+                    if len(pending) >= max_pending:
+                        collect()
+
+                    future = executor.submit(self._decrypt_file, os.path.join(cwd, hash_name), os.path.join(target_directory, filename))
+                    pending.append((posixpath.join(dirpath, filename), future))
+
+            while pending:
+                collect()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self._log.info("Export %d files (%d bytes) in %.3fs, %.1f MB/s", stats["files"], stats["bytes"], stats["seconds"], stats["throughput"] / 1e6)
+        return stats
+
+    @_operation
     def mkdir(self, path:str)->None:
         directory, last_dir = self._get_directory(path)
         directory.mkdir(last_dir)
+        self._resolution_cache.invalidate("/".join(self._split_path(path)))
 
+    @_operation
     def open(self, path:str, mode:str)->File:
         directory, filename = self._get_directory(path)
         file = self._get_file(directory)
         return file.open(filename, mode)
 
+    @_operation
     def open_as_tmpfile(self, path:str):
         directory, filename = self._get_directory(path)
         cwd = directory.cwd()
         file = self._get_file(directory)
         hashname = file.get_hash(filename)
         full_path = os.path.join(cwd, hashname)
-        tmpfile = TmpFile(self._key, full_path, self._sub_iterations, self._salt_size)
+        tmpfile = TmpFile(self._key, full_path, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, stats=self._stats)
         return tmpfile
 
+    @_operation
+    def open_as_tmpsession(self, paths, workers:int=4, debounce:float=DEFAULT_DEBOUNCE)->TmpSession:
+        """
+        It gathers files in a session decrypting them together into one private RAM directory, under
+        their logical paths. A directory is taken with its whole subtree.
+
+        :param paths: The logical paths of the files and directories, or a single path
+        :param workers: The number of threads decrypting and encrypting files
+        :type workers: int
+        :param debounce: The delay without save after which a file is written back, in seconds
+        :type debounce: float
+        :return: The session, not opened yet
+        """
+
+        if isinstance(paths, str):
+            paths = [paths]
+
+        files = {}
+        for path in paths:
+            sub_dirs = [d for d in self._split_path(path) if d != ""]
+            root = "/" + "/".join(sub_dirs)
+
+            if len(sub_dirs) == 0 or self.is_directory_exist(root):
+                for dirpath, _, entries, cwd in self._walk(root, True, workers, 64):
+                    for filename, hash_name in entries.items():
+                        files[posixpath.join(dirpath, filename)[1:]] = os.path.join(cwd, hash_name)
+            else:
+                directory, filename = self._get_directory(root)
+                files[root[1:]] = os.path.join(directory.cwd(), self._get_file(directory).get_hash(filename))
+
+        return TmpSession(self._key, files, self._sub_iterations, self._salt_size, self._key_cache, Primitives.VERSION_HKDF, workers, debounce, self._stats)
+
+    @_operation
     def remove_file(self, path:str)->None:
         directory, filename = self._get_directory(path)
         file = self._get_file(directory)
         file.rm(filename)
 
+    @_operation
     def remove_directory(self, path:str, recursive:bool=False)->None:
         directory, directory_name = self._get_directory(path)
         directory.rm(directory_name, recursive)
+        self._resolution_cache.invalidate("/".join(self._split_path(path)))
 
+    @_operation
     def is_file_exist(self, path:str)->bool:
         directory, filename = self._get_directory(path)
         file = self._get_file(directory)
         return file.exists(filename)
 
+    @_operation
     def is_directory_exist(self, path:str)->bool:
         directory, directoryname = self._get_directory(path)
         return directory.exists(directoryname)
 
+    @_operation
     def ls(self, path:str)->dict:
         directory, _ = self._get_directory(path)
         file = self._get_file(directory)
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+class KeyCache:
+    DEFAULT_SIZE = 1024
+
+    def __init__(self, size:int=DEFAULT_SIZE) -> None:
+        """
+        A bounded LRU cache of derived keys, indexed by the salt of the container. A cache must only
+        be shared between primitives using the same secret, typically the ones of a mounted filesystem.
+        It can be shared between threads.
+
+        :param size: The maximum number of keys kept in the cache, 0 disables the cache
+        :type size: int
+        """
+
+        self._size = size
+        self._keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, salt:bytes)->bytes:
+        """
+        It returns the key derived from the salt if it is cached, None otherwise
+
+        :param salt: The salt of the container
+        :type salt: bytes
+        :return: The cached key or None
+        """
+
+        with self._lock:
+            key = self._keys.get(salt)
+
+            if key is None:
+                self.misses += 1
+                return None
+
+            self._keys.move_to_end(salt)
+            self.hits += 1
+            return key
+
+    def put(self, salt:bytes, key:bytes)->None:
+        """
+        It stores the key derived from the salt, evicting the least recently used keys if the cache
+        is full
+
+        :param salt: The salt of the container
+        :type salt: bytes
+        :param key: The key derived from the salt
+        :type key: bytes
+        """
+
+        if self._size <= 0:
+            return
+
+        with self._lock:
+            self._keys[salt] = key
+            self._keys.move_to_end(salt)
+
+            while len(self._keys) > self._size:
+                self._keys.popitem(last=False)
+
+    def clear(self)->None:
+        """
+        It forgets all the cached keys and resets the counters
+        """
+
+        with self._lock:
+            self._keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self)->int:
+        return len(self._keys)
@@ -2,17 +2,49 @@ import logging
 import os
 import os.path
 import json
+import hmac
+import struct
+import threading
+import functools
+from contextlib import suppress
 from hashlib import sha256
 
 from fernetfs.primitives import Primitives
+from fernetfs.keycache import KeyCache
+from fernetfs.listingcache import ListingCache
+from fernetfs.listinglock import ListingLock
+from fernetfs.stats import Stats, span
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("Listing")
+
+def _synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+def _shared(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.shared():
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 class Listing:
     HASH_RANDOM_SIZE = 32
-    def __init__(self, secret:bytes, current_working_directory:str, name:str, iterations:int=480000, salt_size=16) -> None:
-        self._primitives = Primitives(secret, iterations, salt_size)
-        self._log = logging.getLogger(f"Listing({name} @ {current_working_directory})")
+    def __init__(self, secret:bytes, current_working_directory:str, name:str, iterations:int=480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, listing_cache:ListingCache=None, stats:Stats=None) -> None:
+        self._primitives = Primitives(secret, iterations, salt_size, key_cache, version, stats)
+        self._listing_cache = listing_cache
+        self._stats = stats
         self._current_working_directory = current_working_directory
         self._path = os.path.join(self._current_working_directory, name)
+        self._log = ContextLogger(_log, self._path)
+        # held by the read-modify-write cycles of the listings of the directory, it is reentrant
+        self.lock = ListingLock.for_directory(current_working_directory)
 
     def exists(self)->bool:
         return os.path.exists(self._path)
@@ -21,47 +53,610 @@ class Listing:
         self.write({})
 
     def read(self):
-        
-        with open(self._path, "r") as f:
-            encrypted_listing = f.read()
+        if self._listing_cache is not None:
+            output = self._listing_cache.get(self._path)
+            if output is not None:
+                if self._stats is not None:
+                    self._stats.add("listing_cache_hits")
+                return output
+
+        with span(self._stats, "io"):
+            with open(self._path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                encrypted_listing = bytearray(stat.st_size)
+                f.readinto(encrypted_listing)
 
         listing = self._primitives.decrypt(encrypted_listing)
-        output = json.loads(listing)
+        with span(self._stats, "json"):
+            output = json.loads(listing)
+
+        if self._stats is not None:
+            self._stats.add("listing_reads")
 
-        self._log.debug(f"Read from {self._path} with {len(output)} entries")
+        if self._listing_cache is not None:
+            self._listing_cache.put(self._path, output, stat)
+
+        self._log.debug("Read %d entries", len(output))
         return output
 
     def write(self, listing:dict):
-        json_listing = bytes(json.dumps(listing), "utf8")
+        if self._stats is not None:
+            self._stats.add("listing_writes")
+
+        with span(self._stats, "json"):
+            json_listing = bytes(json.dumps(listing), "utf8")
         encrypted_listing = self._primitives.encrypt(json_listing)
 
-        with open(self._path, "w") as f:
-            f.write(encrypted_listing)
+        # readers see either the previous or the new listing, never a partial one. The temporary name
+        # is unique to the writing thread
+        tmp_path = f"{self._path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with span(self._stats, "io"):
+            with open(tmp_path, "wb") as f:
+                f.write(encrypted_listing)
+                f.flush()
+                stat = os.fstat(f.fileno())
+            os.replace(tmp_path, self._path)
 
-        self._log.debug(f"Write to {self._path} with {len(listing)} entries")
+        if self._listing_cache is not None:
+            self._listing_cache.put(self._path, listing, stat)
+
+        self._log.debug("Write %d entries", len(listing))
 
     def get(self)->dict:
-        if self.exists():
+        try:
             listing = self.read()
-        else:
+        except FileNotFoundError:
             listing = {}
 
         return listing
 
+    def new_hash(self)->str:
+        return sha256(os.getrandom(Listing.HASH_RANDOM_SIZE)).hexdigest()
+
     def add(self, key:str, source:dict)->dict:
-        hash_name = sha256(os.getrandom(Listing.HASH_RANDOM_SIZE)).hexdigest()
+        hash_name = self.new_hash()
         source[key] = hash_name
-        self._log.debug(f"Add to {key} as {hash_name}")
+        self._log.debug("Add to %s as %s", key, hash_name)
 
         return source
 
     def remove(self):
-        os.remove(self._path)
+        if self._listing_cache is not None:
+            self._listing_cache.invalidate(self._path)
+
+        with suppress(FileNotFoundError):
+            os.remove(self._path)
+
+class ShardedListing(Listing):
+    # a flat listing above SHARD_THRESHOLD entries is split into pages, a page above PAGE_SIZE
+    # entries makes the listing grow by one page (linear hashing)
+    SHARD_THRESHOLD = 1024
+    PAGE_SIZE = 512
+    SHARD_KEY_INFO = b"fernetfs listing shard"
+    # a journal holding JOURNAL_THRESHOLD records is folded into the listing
+    JOURNAL_THRESHOLD = 256
+    _RECORD_LENGTH = struct.Struct(">I")
+    # a journal starts with a random id : a journal removed by a compaction and created again, even
+    # on the same inode, is never taken for the one replayed before
+    _JOURNAL_MAGIC = b"FFSJ"
+    _JOURNAL_HEADER = struct.Struct(">4s16s")
+
+    def __init__(self, secret:bytes, current_working_directory:str, name:str, iterations:int=480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, listing_cache:ListingCache=None, journal:bool=False, stats:Stats=None) -> None:
+        """
+        A listing stored as a single flat container while it is small, then as hash-sharded pages
+        "<name>.<n>" described by "<name>.index", so that lookups and updates of large directories
+        only decrypt and encrypt one small page. Pages are addressed with a keyed hash of the entry
+        name, which leaks nothing about the names. Flat listings are sharded as soon as an insertion
+        makes them exceed SHARD_THRESHOLD entries.
+
+        In journal mode, changes are appended as small encrypted records to "<name>.journal" instead
+        of rewriting the listing. Readers replay the journal on top of the listing, whatever their
+        mode, and the journal is compacted into the listing past JOURNAL_THRESHOLD records.
+
+        :param journal: Append changes to the journal instead of rewriting the listing
+        :type journal: bool
+        :param stats: The counters of the mounted filesystem, if any
+        :type stats: Stats
+        """
+
+        super().__init__(secret, current_working_directory, name, iterations, salt_size, key_cache, version, listing_cache, stats)
+        self._name = name
+        self._page_arguments = (secret, current_working_directory, iterations, salt_size, key_cache, version, listing_cache, stats)
+        self._index = Listing(secret, current_working_directory, f"{name}.index", iterations, salt_size, key_cache, version, listing_cache, stats)
+        self._pages = {}
+        self._shard_key = hmac.new(secret, ShardedListing.SHARD_KEY_INFO, sha256).digest()
+
+        self._journal = journal
+        self._journal_path = os.path.join(current_working_directory, f"{name}.journal")
+        # (inode, journal id, replayed size, replayed records, record count), so that only the records
+        # appended since the last read are decrypted
+        self._journal_state = None
+
+    def _page(self, number:int)->Listing:
+        page = self._pages.get(number)
+
+        if page is None:
+            secret, cwd, iterations, salt_size, key_cache, version, listing_cache, stats = self._page_arguments
+            page = Listing(secret, cwd, f"{self._name}.{number}", iterations, salt_size, key_cache, version, listing_cache, stats)
+            self._pages[number] = page
+
+        return page
+
+    def _read_index(self)->dict:
+        try:
+            return self._index.read()
+        except FileNotFoundError:
+            return None
+
+    def _load(self)->tuple:
+        # the flat listing, when it exists, is authoritative : it is only removed once the pages
+        # and the index are complete
+        try:
+            return self.read(), None
+        except FileNotFoundError:
+            pass
+
+        index = self._read_index()
+        if index is None:
+            return {}, None
+
+        return None, index
+
+    def _hash(self, key:str)->int:
+        digest = hmac.new(self._shard_key, bytes(key, "utf8"), sha256).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def _address(self, key:str, index:dict)->int:
+        level = index["level"]
+        digest = self._hash(key)
+        address = digest % (1 << level)
+
+        # pages before the split pointer have already been split
+        if address < index["split"]:
+            address = digest % (1 << (level + 1))
+
+        return address
+
+    def _page_count(self, index:dict)->int:
+        return (1 << index["level"]) + index["split"]
+
+    def _store(self, page:Listing, entries:dict)->None:
+        if len(entries) > 0:
+            page.write(entries)
+        else:
+            page.remove()
+
+    @_shared
+    def is_sharded(self)->bool:
+        return self._load()[1] is not None
+
+    @_synchronized
+    def shard(self)->None:
+        """
+        It migrates a flat listing to pages, whatever its size
+        """
+
+        listing, _ = self._load()
+        if listing is None:
+            return
+
+        # left by an interrupted migration, rebuilt from the flat listing
+        previous = self._read_index()
+
+        pages_needed = len(listing) // (self.PAGE_SIZE // 2) + 1
+        level = max(1, (pages_needed - 1).bit_length())
+        index = {"level": level, "split": 0}
+
+        pages = [{} for _ in range(1 << level)]
+        for key, value in listing.items():
+            pages[self._address(key, index)][key] = value
+
+        for number, entries in enumerate(pages):
+            self._store(self._page(number), entries)
+
+        if previous is not None:
+            for number in range(len(pages), self._page_count(previous)):
+                self._page(number).remove()
+
+        # the index is written last, readers keep using the flat listing until it exists
+        self._index.write(index)
+        self.remove()
+        self._log.debug("Shard %d entries into %d pages", len(listing), len(pages))
+
+    def _split(self, index:dict)->None:
+        level = index["level"]
+        split = index["split"]
+        new_number = split + (1 << level)
+
+        low = {}
+        high = {}
+        for key, value in self._page(split).get().items():
+            if self._hash(key) % (1 << (level + 1)) == split:
+                low[key] = value
+            else:
+                high[key] = value
+
+        self._store(self._page(split), low)
+        self._store(self._page(new_number), high)
+
+        split += 1
+        if split == 1 << level:
+            level += 1
+            split = 0
+
+        self._index.write({"level": level, "split": split})
+        self._log.debug("Split page %d into %d", index["split"], new_number)
+
+    def _base_lookup(self, key:str)->str:
+        listing, index = self._load()
+
+        if index is None:
+            return listing.get(key)
+
+        return self._page(self._address(key, index)).get().get(key)
+
+    def _base_items(self)->dict:
+        listing, index = self._load()
+
+        if index is None:
+            return listing
+
+        output = {}
+        for number in range(self._page_count(index)):
+            output.update(self._page(number).get())
+
+        return output
+
+    def _base_insert(self, key:str, value:str)->None:
+        listing, index = self._load()
+
+        if index is None:
+            listing[key] = value
+            self.write(listing)
+
+            if len(listing) > self.SHARD_THRESHOLD:
+                self.shard()
+            return
+
+        page = self._page(self._address(key, index))
+        entries = page.get()
+        entries[key] = value
+        page.write(entries)
+
+        if len(entries) > self.PAGE_SIZE:
+            self._split(index)
+
+    def _base_discard(self, key:str)->bool:
+        listing, index = self._load()
+
+        if index is None:
+            if key not in listing:
+                return False
+
+            del listing[key]
+            self._store(self, listing)
+            return True
+
+        page = self._page(self._address(key, index))
+        entries = page.get()
+        if key not in entries:
+            return False
+
+        del entries[key]
+        self._store(page, entries)
+
+        if len(entries) == 0:
+            pages = range(self._page_count(index))
+            if all(len(self._page(number).get()) == 0 for number in pages):
+                self._index.remove()
+
+        return True
+
+    def _apply(self, changes:dict)->None:
+        # the changes, None for a removal, are applied at once : each page is written once, in the
+        # order of the single changes, the index last when the flat listing is sharded
+        listing, index = self._load()
+
+        if index is None:
+            for key, value in changes.items():
+                if value is None:
+                    listing.pop(key, None)
+                else:
+                    listing[key] = value
+            self._store(self, listing)
+
+            if len(listing) > self.SHARD_THRESHOLD:
+                self.shard()
+            return
+
+        by_page = {}
+        for key, value in changes.items():
+            by_page.setdefault(self._address(key, index), {})[key] = value
+
+        # only the changed pages are read, their sizes decide the growth
+        sizes = {}
+        for number, page_changes in by_page.items():
+            page = self._page(number)
+            entries = page.get()
+            for key, value in page_changes.items():
+                if value is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = value
+            self._store(page, entries)
+            sizes[number] = len(entries)
+
+        if all(size == 0 for size in sizes.values()):
+            pages = range(self._page_count(index))
+            if all(len(self._page(number).get()) == 0 for number in pages if number not in sizes):
+                self._index.remove()
+            return
+
+        # a changed page above PAGE_SIZE entries makes the listing grow by one page, as a single
+        # insert would, until none of them is above it
+        while any(size > self.PAGE_SIZE for size in sizes.values()):
+            split = index["split"]
+            new_number = split + (1 << index["level"])
+            self._split(index)
+            index = self._read_index()
+
+            if split in sizes:
+                sizes[split] = len(self._page(split).get())
+                sizes[new_number] = len(self._page(new_number).get())
+
+    @_synchronized
+    def merge(self, changes:dict)->None:
+        """
+        It applies the changes staged by a batch to the current listing, read again under the lock of
+        the directory, so that the entries changed by others during the batch are kept
+
+        :param changes: The new value of each changed entry, None for a removed one
+        :type changes: dict
+        """
+
+        # records left by a journaling writer are older than the changes
+        if os.path.exists(self._journal_path):
+            self.compact()
+
+        self._apply(changes)
+
+    def _staged(self)->dict:
+        if self._listing_cache is None:
+            return None
+
+        return self._listing_cache.get_staged(self._path)
+
+    def _journal_header(self, f)->tuple:
+        # it returns the id of the journal and the offset of its first record. Journals written
+        # before the header have an empty id
+        header = f.read(self._JOURNAL_HEADER.size)
+        if len(header) == self._JOURNAL_HEADER.size:
+            magic, journal_id = self._JOURNAL_HEADER.unpack(header)
+            if magic == self._JOURNAL_MAGIC:
+                return journal_id, self._JOURNAL_HEADER.size
+
+        return b"", 0
+
+    def _read_journal(self)->dict:
+        # it returns the replayed records, a removed entry has a None value. The dict is owned by
+        # the listing and must not be modified
+        try:
+            f = open(self._journal_path, "rb")
+        except FileNotFoundError:
+            self._journal_state = None
+            return {}
+
+        with f:
+            stat = os.fstat(f.fileno())
+            journal_id, start = self._journal_header(f)
+
+            state = self._journal_state
+            if state is None or state[:2] != (stat.st_ino, journal_id) or stat.st_size < state[2]:
+                state = (stat.st_ino, journal_id, start, {}, 0)
+            inode, journal_id, offset, records, count = state
+
+            data = b""
+            if stat.st_size > offset:
+                f.seek(offset)
+                data = memoryview(f.read())
+
+        if len(data) > 0:
+            position = 0
+            while position + self._RECORD_LENGTH.size <= len(data):
+                (length,) = self._RECORD_LENGTH.unpack_from(data, position)
+                start = position + self._RECORD_LENGTH.size
+                # a record torn by a crash is ignored, and dropped by the next append
+                if start + length > len(data):
+                    break
+
+                key, value = json.loads(self._primitives.decrypt(data[start:start + length]))
+                records[key] = value
+                position = start + length
+                count += 1
+
+            if self._stats is not None:
+                self._stats.add("journal_records_read", count - state[4])
+
+            offset += position
+
+        self._journal_state = (inode, journal_id, offset, records, count)
+        return records
+
+    def _create_journal(self)->None:
+        # the header is written aside, a journal is never seen without it
+        tmp_path = f"{self._journal_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(self._JOURNAL_HEADER.pack(self._JOURNAL_MAGIC, os.getrandom(16)))
+            os.replace(tmp_path, self._journal_path)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+    def _append(self, key:str, value:str)->None:
+        # the caller holds the exclusive lock : the journal is replayed again, so what follows the
+        # replayed records of this very journal is a record torn by a crash, and is dropped
+        self._read_journal()
+        if self._journal_state is None:
+            self._create_journal()
+            self._read_journal()
+        inode, journal_id, offset, _, _ = self._journal_state
+
+        record = self._primitives.encrypt(bytes(json.dumps([key, value]), "utf8"))
+        with open(self._journal_path, "r+b") as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_ino, self._journal_header(f)[0]) != (inode, journal_id):
+                raise RuntimeError(f"{self._journal_path} was replaced without the lock of the directory")
+
+            if stat.st_size > offset:
+                self._log.warning("Drop a torn journal record")
+                f.truncate(offset)
+            f.seek(offset)
+            f.write(self._RECORD_LENGTH.pack(len(record)) + record)
+
+        if self._stats is not None:
+            self._stats.add("journal_appends")
+
+        self._log.debug("Journal %s%s", "removal of " if value is None else "", key)
+
+        if self._journal_state[4] + 1 >= self.JOURNAL_THRESHOLD:
+            self._compact_if_possible()
+
+    def _unstage(self, key:str)->None:
+        # a record appended to the journal overrides the change staged before
+        if self._listing_cache is not None:
+            self._listing_cache.unstage(self._path, key)
+
+    def _in_batch(self)->bool:
+        return self._listing_cache is not None and self._listing_cache.in_batch()
+
+    def _compact_if_possible(self)->None:
+        # compaction is postponed while a batch is staging the listing
+        if not self._in_batch():
+            self.compact()
+
+    def _use_journal(self)->bool:
+        if self._journal:
+            return True
+
+        if not os.path.exists(self._journal_path):
+            return False
+
+        # records left by a journaling writer must be folded first, they would override the change
+        if self._in_batch():
+            return True
+
+        self.compact()
+        return False
+
+    @_synchronized
+    def compact(self)->None:
+        """
+        It folds the journal into the listing and removes the journal. Replaying the same records
+        twice gives the same listing, so an interrupted compaction is simply done again
+        """
+
+        if self._in_batch():
+            raise RuntimeError("A journal can't be compacted during a batch")
+
+        records = self._read_journal()
+        if self._journal_state is None:
+            return
+
+        self._apply(records)
+
+        with suppress(FileNotFoundError):
+            os.remove(self._journal_path)
+        self._journal_state = None
+        self._log.debug("Compact %d journal records", len(records))
+
+    @_shared
+    def lookup(self, key:str)->str:
+        """
+        It returns the value of the entry, None if there is no such entry
+        """
+
+        staged = self._staged()
+        if staged is not None and key in staged:
+            return staged[key]
+
+        records = self._read_journal()
+        if key in records:
+            return records[key]
+
+        return self._base_lookup(key)
+
+    @_shared
+    def items(self)->dict:
+        """
+        It returns all the entries, from every page and from the journal
+        """
+
+        output = self._base_items()
+
+        for changes in (self._read_journal(), self._staged() or {}):
+            for key, value in changes.items():
+                if value is None:
+                    output.pop(key, None)
+                else:
+                    output[key] = value
+
+        return output
+
+    @_shared
+    def keys(self)->list:
+        return list(self.items())
+
+    @_synchronized
+    def insert(self, key:str, value:str)->None:
+        """
+        It adds or replaces an entry, only the page holding the entry is rewritten, or a record is
+        appended to the journal
+        """
+
+        if self._use_journal():
+            self._unstage(key)
+            self._append(key, value)
+        elif self._in_batch():
+            self._listing_cache.stage(self._path, self, key, value)
+        else:
+            self._base_insert(key, value)
+
+    @_synchronized
+    def discard(self, key:str)->bool:
+        """
+        It removes an entry, the listing files are removed with the last entry
+
+        :return: False if there was no such entry
+        """
+
+        if not self._use_journal():
+            if not self._in_batch():
+                return self._base_discard(key)
+
+            if self.lookup(key) is None:
+                return False
+
+            self._listing_cache.stage(self._path, self, key, None)
+            return True
+
+        if self.lookup(key) is None:
+            return False
+
+        self._unstage(key)
+        self._append(key, None)
+
+        # an emptied directory must not keep a journal, it could not be removed otherwise
+        if self._journal_state is not None and not self.is_sharded() and len(self.keys()) == 0:
+            self._compact_if_possible()
+
+        return True
 
-class ListingDirectory(Listing):
-    def __init__(self, secret: bytes, current_working_directory: str, iterations: int = 480000, salt_size=16) -> None:
-        super().__init__(secret, current_working_directory, ".directories", iterations, salt_size)
+class ListingDirectory(ShardedListing):
+    def __init__(self, secret: bytes, current_working_directory: str, iterations: int = 480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, listing_cache:ListingCache=None, journal:bool=False, stats:Stats=None) -> None:
+        super().__init__(secret, current_working_directory, ".directories", iterations, salt_size, key_cache, version, listing_cache, journal, stats)
 
-class ListingFile(Listing):
-    def __init__(self, secret: bytes, current_working_directory: str, iterations: int = 480000, salt_size=16) -> None:
-        super().__init__(secret, current_working_directory, ".files", iterations, salt_size)
\ No newline at end of file
+class ListingFile(ShardedListing):
+    def __init__(self, secret: bytes, current_working_directory: str, iterations: int = 480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, listing_cache:ListingCache=None, journal:bool=False, stats:Stats=None) -> None:
+        super().__init__(secret, current_working_directory, ".files", iterations, salt_size, key_cache, version, listing_cache, journal, stats)
\ No newline at end of file
@@ -0,0 +1,207 @@
+import os
+import threading
+from collections import OrderedDict
+
+def _signature(stat:os.stat_result)->tuple:
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class ListingCache:
+    DEFAULT_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, size:int=DEFAULT_SIZE) -> None:
+        """
+        A LRU cache of decrypted listings, indexed by the path of the listing. Each entry is validated
+        against a cheap stat of the listing (mtime, size and inode), so that listings written by other
+        processes are read again. The memory used by the cache is approximated by the size of the
+        encrypted listings. It can be shared between threads, each thread having its own batch.
+
+        :param size: The maximum size in bytes of the cached listings, 0 disables the cache
+        :type size: int
+        """
+
+        self._size = size
+        self._listings = OrderedDict()
+        self._used = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # listing changes staged during a batch, flushed when the outermost batch of the thread ends
+        self._batch = threading.local()
+
+    def _batch_state(self):
+        state = self._batch
+        if not hasattr(state, "depth"):
+            state.depth = 0
+            state.staged = {}
+
+        return state
+
+    def get(self, path:str)->dict:
+        """
+        It returns a copy of the cached listing if it is still up to date, None otherwise
+
+        :param path: The path of the listing
+        :type path: str
+        :return: The listing or None
+        """
+
+        with self._lock:
+            entry = self._listings.get(path)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+        signature, listing = entry
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+
+        with self._lock:
+            if stat is None or _signature(stat) != signature:
+                if self._listings.get(path) is entry:
+                    self._remove(path)
+                self.misses += 1
+                return None
+
+            if path in self._listings:
+                self._listings.move_to_end(path)
+            self.hits += 1
+
+        # cached listings are never modified, the copy is done outside of the lock
+        return dict(listing)
+
+    def put(self, path:str, listing:dict, stat:os.stat_result)->None:
+        """
+        It stores a copy of the listing, with the stat of the listing file it was read from or written
+        to. The least recently used listings are evicted if the cache is full
+
+        :param path: The path of the listing
+        :type path: str
+        :param listing: The decrypted listing
+        :type listing: dict
+        :param stat: The stat of the listing file matching the listing
+        :type stat: os.stat_result
+        """
+
+        entry = (_signature(stat), dict(listing))
+
+        with self._lock:
+            self._remove(path)
+
+            if stat.st_size > self._size:
+                return
+
+            self._listings[path] = entry
+            self._used += stat.st_size
+
+            while self._used > self._size:
+                _, ((_, size, _), _) = self._listings.popitem(last=False)
+                self._used -= size
+
+    def _remove(self, path:str)->None:
+        entry = self._listings.pop(path, None)
+
+        if entry is not None:
+            (_, size, _), _ = entry
+            self._used -= size
+
+    def invalidate(self, path:str)->None:
+        with self._lock:
+            self._remove(path)
+
+    def begin_batch(self)->None:
+        """
+        It starts a batch for the calling thread : until the matching end_batch, the entries inserted
+        in or removed from listings by the thread are only staged in memory, and each listing is written
+        once at the end. Batches can be nested, only the outermost one flushes
+        """
+
+        self._batch_state().depth += 1
+
+    def in_batch(self)->bool:
+        return self._batch_state().depth > 0
+
+    def get_staged(self, path:str)->dict:
+        """
+        It returns the changes of the listing staged by the batch of the calling thread, by entry name
+        with None for a removal, or None if there is none. The dict is owned by the batch and must not
+        be modified
+
+        :param path: The path of the listing
+        :type path: str
+        :return: The staged changes or None
+        """
+
+        staged = self._batch_state().staged.get(path)
+        if staged is None:
+            return None
+
+        return staged[1]
+
+    def stage(self, path:str, writer, key:str, value:str)->None:
+        """
+        It stages a change of a listing until the end of the batch
+
+        :param path: The path of the listing
+        :type path: str
+        :param writer: The ShardedListing used to apply the changes
+        :type writer: ShardedListing
+        :param key: The name of the entry
+        :type key: str
+        :param value: The new value of the entry, None to remove it
+        :type value: str
+        """
+
+        staged = self._batch_state().staged
+        if path not in staged:
+            staged[path] = (writer, {})
+        staged[path][1][key] = value
+
+    def unstage(self, path:str, key:str)->None:
+        staged = self._batch_state().staged.get(path)
+        if staged is not None:
+            staged[1].pop(key, None)
+
+    def end_batch(self)->None:
+        """
+        It ends a batch, the outermost one applies the staged changes of each listing to its current
+        content, read again under the lock of its directory : the entries changed by other threads and
+        processes during the batch are kept
+        """
+
+        state = self._batch_state()
+        state.depth -= 1
+
+        if state.depth > 0:
+            return
+
+        staged = state.staged
+        state.staged = {}
+
+        error = None
+        for writer, changes in staged.values():
+            # a failed listing doesn't prevent the others from being flushed
+            try:
+                writer.merge(changes)
+            except Exception as e:
+                error = error or e
+
+        if error is not None:
+            raise error
+
+    def clear(self)->None:
+        """
+        It forgets all the cached listings and resets the counters
+        """
+
+        with self._lock:
+            self._listings.clear()
+            self._used = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self)->int:
+        return len(self._listings)
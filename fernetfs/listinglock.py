@@ -0,0 +1,92 @@
+import os
+import fcntl
+import threading
+import weakref
+from contextlib import contextmanager
+
+class ListingLock:
+    # the listings of a directory can be used through several Listing objects, they share one lock
+    _locks = weakref.WeakValueDictionary()
+    _locks_lock = threading.Lock()
+
+    def __init__(self, directory:str) -> None:
+        """
+        A reentrant lock protecting the listings of a directory, between the threads of a process and
+        between processes. Threads are excluded by a RLock, processes by an advisory flock on the
+        directory itself : shared for readers, exclusive for writers. No lock file is created, so
+        the directory can still be removed once it is empty. A shared lock is upgraded if an exclusive
+        one is requested while it is held.
+
+        :param directory: The path of the directory holding the listings
+        :type directory: str
+        """
+
+        self._directory = directory
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._exclusive = False
+
+    @classmethod
+    def for_directory(cls, directory:str):
+        """
+        It returns the lock of the directory, the same one as long as it is used
+        """
+
+        with cls._locks_lock:
+            lock = cls._locks.get(directory)
+            if lock is None:
+                lock = cls(directory)
+                cls._locks[directory] = lock
+
+            return lock
+
+    def acquire(self, exclusive:bool=True)->None:
+        self._lock.acquire()
+
+        try:
+            if self._depth == 0:
+                try:
+                    self._fd = os.open(self._directory, os.O_RDONLY | os.O_DIRECTORY)
+                except FileNotFoundError:
+                    # a removed directory has nothing left to protect
+                    self._fd = None
+
+            if self._fd is not None and (self._depth == 0 or (exclusive and not self._exclusive)):
+                fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._exclusive = self._exclusive or exclusive
+        except BaseException:
+            if self._depth == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._lock.release()
+            raise
+
+        self._depth += 1
+
+    def release(self)->None:
+        self._depth -= 1
+
+        if self._depth == 0:
+            # closing the descriptor releases the flock
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._exclusive = False
+
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire(True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @contextmanager
+    def shared(self):
+        self.acquire(False)
+        try:
+            yield self
+        finally:
+            self.release()
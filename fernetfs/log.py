@@ -0,0 +1,28 @@
+import logging
+
+class ContextLogger(logging.LoggerAdapter):
+    def __init__(self, logger:logging.Logger, context) -> None:
+        """
+        It prefixes the messages of a shared logger with the context of an instance - a path, a
+        directory. The logging module keeps every logger for the life of the process, so loggers are
+        created once by module and the adapters, collected with their instance, carry the context.
+        Nothing is formatted unless the level is enabled : pass the values as arguments of the
+        message, not in an f-string.
+
+        :param logger: The logger of the module
+        :type logger: logging.Logger
+        :param context: Printed before each message
+        """
+
+        super().__init__(logger, None)
+        self.context = context
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.isEnabledFor(level):
+            context = str(self.context)
+            if args:
+                # the context is not part of the format, a % in a path must stay as it is
+                context = context.replace("%", "%%")
+            # the caller of the adapter is reported, not this method
+            kwargs["stacklevel"] = kwargs.get("stacklevel", 1) + 1
+            self.logger.log(level, f"{context} : {msg}", *args, **kwargs)
@@ -2,41 +2,141 @@ import logging
 import os
 import os.path
 import base64
+import json
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 from fernetfs.listing import Listing
+from fernetfs.primitives import Primitives
+from fernetfs.stats import Stats, span
+from fernetfs.stream import is_stream
+
+_log = logging.getLogger("MasterConfiguration")
 
 class MasterConfiguration:
     FILENAME = ".fernet"
-   
-    def __init__(self, salt_size:int=128) -> None:
-        self._log = logging.getLogger(f"MasterConfiguration")
+    # configurations without format field are a container keyed by the password, the master key is
+    # derived by a second PBKDF2
+    FORMAT_SINGLE_KDF = 2
+    # one SHA256 block : each further block of PBKDF2 output costs all the iterations again
+    STRETCHED_LENGTH = 32
+    HKDF_INFO = b"fernetfs master key"
+
+    def __init__(self, salt_size:int=128, key_length:int=256) -> None:
+        """
+        The configuration of a filesystem, in the .fernet file at its root : the master salt, the size
+        of the salts and the iterations of the containers. Reading it checks the password and returns
+        the master key.
+
+        The password is stretched once by PBKDF2 with the master salt, kept in clear, and the result is
+        expanded by HKDF into the master key. The rest of the configuration is a container keyed by the
+        master key, so decrypting it authenticates the password without a second PBKDF2. Configurations
+        written before are still read, at the cost of their two derivations.
+
+        :param salt_size: The size of the master salt
+        :type salt_size: int
+        :param key_length: The size of the master key
+        :type key_length: int
+        """
+
         self._salt_size = salt_size
+        self._key_length = key_length
 
     def exists(self, path)->bool:
         full_path = os.path.join(path, MasterConfiguration.FILENAME)
         return os.path.exists(full_path)
 
     def create(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16, sub_iterations:int=48000):
-
-        listing = Listing(secret, current_working_directory, MasterConfiguration.FILENAME, iterations, salt_size)
         if self.exists(current_working_directory):
             raise Exception("Can't overwrite salt file !")
-        
-        salt = os.getrandom(self._salt_size)
-        safe_salt = base64.urlsafe_b64encode(salt)
-        salt_structure = {
-            "salt" : str(safe_salt, "utf8"),
-            "salt_size":salt_size,
-            "sub_iterations":sub_iterations
 
+        salt = os.getrandom(self._salt_size)
+        key = self._derive_key(secret, salt, iterations)
+        primitives = Primitives(key, iterations, salt_size, version=Primitives.VERSION_HKDF)
+        configuration = {
+            "salt_size": salt_size,
+            "sub_iterations": sub_iterations,
         }
-        listing.write(salt_structure)
-        self._log.debug(f"Create master configuration")
+        structure = {
+            "format": MasterConfiguration.FORMAT_SINGLE_KDF,
+            "salt": str(base64.urlsafe_b64encode(salt), "utf8"),
+            "configuration": str(base64.urlsafe_b64encode(primitives.encrypt(bytes(json.dumps(configuration), "utf8"))), "utf8"),
+        }
+
+        # "x" doesn't let two creations overwrite each other
+        with open(os.path.join(current_working_directory, MasterConfiguration.FILENAME), "x") as f:
+            json.dump(structure, f)
+        _log.debug("Create master configuration")
 
+    def get(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16, stats:Stats=None)->dict:
+        """
+        It reads the configuration and derives the master key. A wrong password raises the error of
+        the failed decryption
 
-    def get(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16)->dict:
-        listing = Listing(secret, current_working_directory, MasterConfiguration.FILENAME, iterations, salt_size)
+        :return: The master salt, the size of the salts and the iterations of the containers, and the
+        master key as "key"
+        """
+
+        with open(os.path.join(current_working_directory, MasterConfiguration.FILENAME), "rb") as f:
+            data = f.read()
+
+        if not is_stream(data):
+            structure = json.loads(data)
+            if structure.get("format") == MasterConfiguration.FORMAT_SINGLE_KDF:
+                return self._get_single_kdf(secret, structure, iterations, stats)
+
+        return self._get_legacy(secret, current_working_directory, iterations, salt_size, stats)
+
+    def _get_single_kdf(self, secret:bytes, structure:dict, iterations:int, stats:Stats)->dict:
+        salt = base64.urlsafe_b64decode(structure["salt"])
+        key = self._derive_key(secret, salt, iterations, stats)
+
+        primitives = Primitives(key, iterations, version=Primitives.VERSION_HKDF, stats=stats)
+        configuration = json.loads(primitives.decrypt(base64.urlsafe_b64decode(structure["configuration"])))
+
+        return {
+            "salt": salt,
+            "salt_size": configuration["salt_size"],
+            "sub_iterations": configuration["sub_iterations"],
+            "key": key,
+        }
+
+    def _get_legacy(self, secret:bytes, current_working_directory:str, iterations:int, salt_size, stats:Stats)->dict:
+        listing = Listing(secret, current_working_directory, MasterConfiguration.FILENAME, iterations, salt_size, stats=stats)
         salt_structure = listing.read()
         salt_structure["salt"] = base64.urlsafe_b64decode(salt_structure["salt"])
 
+        if stats is not None:
+            stats.add("pbkdf2")
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=self._key_length,
+            salt=salt_structure["salt"],
+            iterations=iterations,
+        )
+        with span(stats, "kdf"):
+            salt_structure["key"] = kdf.derive(secret)
+
         return salt_structure
+
+    def _derive_key(self, secret:bytes, salt:bytes, iterations:int, stats:Stats=None)->bytes:
+        if stats is not None:
+            stats.add("pbkdf2")
+            stats.add("hkdf")
+
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=MasterConfiguration.STRETCHED_LENGTH,
+            salt=salt,
+            iterations=iterations,
+        )
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=self._key_length,
+            salt=None,
+            info=MasterConfiguration.HKDF_INFO,
+        )
+        with span(stats, "kdf"):
+            return hkdf.derive(kdf.derive(secret))
@@ -4,12 +4,15 @@ import os.path
 import base64
 
 from fernetfs.listing import Listing
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("MasterSalt")
 
 class MasterSalt:
     FILENAME = ".salt"
     MASTER_SALT_SIZE = 128
     def __init__(self, secret:bytes, current_working_directory:str, iterations:int=480000, salt_size=16) -> None:
-        self._log = logging.getLogger(f"MasterSalt({current_working_directory})")
+        self._log = ContextLogger(_log, current_working_directory)
         self._listing = Listing(secret, current_working_directory, MasterSalt.FILENAME, iterations, salt_size)
 
         self._cache = None
@@ -26,7 +29,7 @@ class MasterSalt:
         salt_structure = {"salt" : str(safe_salt, "utf8")}
 
         self._listing.write(salt_structure)
-        self._log.debug(f"Create salt : {salt_structure['salt']}")
+        self._log.debug("Create salt : %s", salt_structure["salt"])
 
         self._cache = salt
 
@@ -38,10 +41,10 @@ class MasterSalt:
 
         if self.exists():
             salt_structure = self._listing.read()
-            self._log.debug(f"Read existing salt : {salt_structure['salt']}")
+            self._log.debug("Read existing salt : %s", salt_structure["salt"])
         else:
             salt_structure = self.create()
-            self._log.debug(f"Read created salt : {salt_structure['salt']}")
+            self._log.debug("Read created salt : %s", salt_structure["salt"])
 
         self._cache = base64.urlsafe_b64decode(salt_structure["salt"])
 
@@ -1,16 +1,38 @@
 import base64
+import io
 import os
 import json
+import shutil
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from fernetfs.keycache import KeyCache
+from fernetfs.stats import Stats, span
+from fernetfs.stream import StreamReader, StreamWriter, is_stream, encrypt_container, decrypt_container, MAGIC, DEFAULT_CHUNK_SIZE
 
 class Primitives:
-    def __init__(self, secret:bytes, iteration:int=480000, salt_length:int=16) -> None:
+    # containers without version field use PBKDF2, suitable for passwords
+    VERSION_PBKDF2 = 1
+    # sub keys are expanded with HKDF, the secret must already be a high entropy key
+    VERSION_HKDF = 2
+    HKDF_INFO = b"fernetfs container"
+
+    def __init__(self, secret:bytes, iteration:int=480000, salt_length:int=16, key_cache:KeyCache=None, version:int=VERSION_PBKDF2, stats:Stats=None) -> None:
         self._iteration = iteration
         self._salt_length = salt_length
         self._secret = secret
+        self._key_cache = key_cache
+        self._version = version
+        self._stats = stats
+
+    def get_version(self)->int:
+        return self._version
+
+    def get_stats(self)->Stats:
+        return self._stats
 
     def secret_2_key(self, salt:bytes, secret:bytes)->bytes:
         """
@@ -22,6 +44,16 @@ class Primitives:
         :type secret: bytes
         :return: The key is being returned.
         """
+
+        if self._key_cache is not None:
+            key = self._key_cache.get(salt)
+            if key is not None:
+                if self._stats is not None:
+                    self._stats.add("key_cache_hits")
+                return key
+
+        if self._stats is not None:
+            self._stats.add("pbkdf2")
         
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
@@ -29,10 +61,58 @@ class Primitives:
             salt=salt,
             iterations=self._iteration,
         )
-        key = base64.urlsafe_b64encode(kdf.derive(secret))
+        with span(self._stats, "kdf"):
+            key = base64.urlsafe_b64encode(kdf.derive(secret))
+
+        if self._key_cache is not None:
+            self._key_cache.put(salt, key)
 
         return key
 
+    def secret_2_subkey(self, salt:bytes, secret:bytes)->bytes:
+        """
+        It takes a salt and a high entropy secret and returns a key, using HKDF instead of stretching
+        the secret again
+        
+        :param salt: a random string of bytes
+        :type salt: bytes
+        :param secret: The master key of the mounted filesystem
+        :type secret: bytes
+        :return: The key is being returned.
+        """
+
+        if self._stats is not None:
+            self._stats.add("hkdf")
+
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            info=Primitives.HKDF_INFO,
+        )
+        with span(self._stats, "kdf"):
+            key = base64.urlsafe_b64encode(hkdf.derive(secret))
+
+        return key
+
+    def derive_key(self, salt:bytes, version:int)->bytes:
+        """
+        It returns the key of a container, using the key derivation function of its version
+        
+        :param salt: The salt of the container
+        :type salt: bytes
+        :param version: The version of the container
+        :type version: int
+        :return: The key is being returned.
+        """
+
+        if version == Primitives.VERSION_PBKDF2:
+            return self.secret_2_key(salt, self._secret)
+        elif version == Primitives.VERSION_HKDF:
+            return self.secret_2_subkey(salt, self._secret)
+
+        raise ValueError(f"Unknown container version {version}")
+
     def create_salt(self, _rand=os.getrandom)->bytes:
         """
         It generates a random string of bytes of length `self._salt_length` and then encodes it using
@@ -46,30 +126,40 @@ class Primitives:
         salt = _rand(self._salt_length)
         return base64.urlsafe_b64encode(salt)
 
-    def encrypt(self, data:bytes)->str:
+    def encrypt(self, data:bytes)->bytes:
         """
         The function takes a string of data, creates a salt, uses the salt and the secret to create a
-        key, uses the key to encrypt the data, and returns the encrypted data in a JSON object
+        key, uses the key to encrypt the data, and returns the encrypted data in a binary container :
+        magic bytes, versions, salt then the raw ciphertext and MAC
         
         :param data: The data to encrypt
         :type data: bytes
-        :return: A JSON string containing the salt and the encrypted data.
+        :return: The binary container holding the salt and the encrypted data.
         """
         
-        salt = self.create_salt()
-        key = self.secret_2_key(salt, self._secret)
-        
-        f = Fernet(key)
-        encrypted = f.encrypt(data)
+        with span(self._stats, "encrypt"):
+            return encrypt_container(self, data)
 
-        container = {
-            "salt" : str(salt, "utf8"),
-            "data" : str(encrypted, "utf8")
-        }
-        return json.dumps(container, indent=4)
+    def decrypt(self, container_data)->bytes:
+        """
+        It takes a container, extracts the data and salt, uses the salt to generate a key, uses the
+        key to decrypt the data, and returns the decrypted data. Binary containers are read through a
+        memoryview, legacy JSON containers are detected and still readable. The key derivation
+        function is selected by the version of the container, so that containers written with any
+        version can be read
+        
+        :param container_data: The binary container (any bytes-like object) or a legacy JSON container
+        :type container_data: bytes
+        :return: The decrypted data.
+        """
+        
+        with span(self._stats, "decrypt"):
+            if not isinstance(container_data, str) and is_stream(container_data):
+                return decrypt_container(self, container_data)
 
+            return self.decrypt_json(container_data)
 
-    def decrypt(self, container_data:str)->str:
+    def decrypt_json(self, container_data)->bytes:
         """
         It takes a string of JSON data, converts it to a dictionary, extracts the data and salt, uses
         the salt to generate a key, uses the key to decrypt the data, and returns the decrypted data
@@ -78,17 +168,65 @@ class Primitives:
         :type container_data: str
         :return: The decrypted data.
         """
-        
-        container = json.loads(container_data)
+
+        if not isinstance(container_data, (str, bytes)):
+            container_data = bytes(container_data)
+
+        with span(self._stats, "json"):
+            container = json.loads(container_data)
         data = bytes(container["data"], "utf8")
         salt = bytes(container["salt"], "utf8")
+        version = container.get("version", Primitives.VERSION_PBKDF2)
 
-        key = self.secret_2_key(salt, self._secret)
+        key = self.derive_key(salt, version)
         f = Fernet(key)
-        plain = f.decrypt(data)
+        with span(self._stats, "cipher"):
+            plain = f.decrypt(data)
+
+        if self._stats is not None:
+            self._stats.add("legacy_decrypted")
+            self._stats.add("bytes_decrypted", len(plain))
 
         return plain
 
+    def encrypt_stream(self, infile, outfile, chunk_size:int=DEFAULT_CHUNK_SIZE)->None:
+        """
+        Read the plain data from a binary file object and write it as a segmented container, one chunk
+        at a time
+        
+        :param infile: The binary file object to read the plain data from
+        :param outfile: The binary file object to write the container to, it is closed at the end
+        :param chunk_size: The size of the plain data of each chunk
+        :type chunk_size: int
+        """
+
+        with StreamWriter(outfile, self, chunk_size) as writer:
+            shutil.copyfileobj(infile, writer, chunk_size)
+
+    def decrypt_stream(self, infile, outfile)->None:
+        """
+        Read a container from a seekable binary file object and write the plain data to another one.
+        Segmented containers are decrypted one chunk at a time, legacy JSON containers at once
+        
+        :param infile: The binary file object to read the container from
+        :param outfile: The binary file object to write the plain data to
+        """
+
+        head = infile.read(len(MAGIC))
+        infile.seek(0)
+
+        if is_stream(head):
+            with StreamReader(infile, self) as reader:
+                # whole chunks are decrypted straight into the reusable buffer
+                buffer = memoryview(bytearray(reader.chunk_size()))
+                while True:
+                    count = reader.readinto(buffer)
+                    if count == 0:
+                        break
+                    outfile.write(buffer[:count])
+        else:
+            outfile.write(self.decrypt_json(infile.read()))
+
     def encrypt_file(self, infilename:str, outfilename:str)->None:
         """
         Read the contents of the file, encrypt it, and write the encrypted contents to a file
@@ -100,16 +238,13 @@ class Primitives:
         :type outfilename: str
         """
         
-        with open(infilename, "rb") as f:
-            plain = f.read()
-
-        container = self.encrypt(plain)
-
         if outfilename is None:
-            print(container)
+            with open(infilename, "rb") as f:
+                plain = f.read()
+            print(self.encrypt(plain))
         else:
-            with open(outfilename, "w") as f:
-                f.write(container)
+            with open(infilename, "rb") as fin, open(outfilename, "wb") as fout:
+                self.encrypt_stream(fin, fout)
 
     def decrypt_file(self, infilename:str, outfilename:str)->None:
         """
@@ -122,16 +257,14 @@ class Primitives:
         :type outfilename: str
         """
         
-        with open(infilename, "r") as f:
-            container = f.read()
-
-        plain = self.decrypt(container)
-
         if outfilename is None:
-            print(plain)
+            plain = io.BytesIO()
+            with open(infilename, "rb") as fin:
+                self.decrypt_stream(fin, plain)
+            print(plain.getvalue())
         else:
-            with open(outfilename, "wb") as f:
-                f.write(plain)
+            with open(infilename, "rb") as fin, open(outfilename, "wb") as fout:
+                self.decrypt_stream(fin, fout)
 
     def verify_file(self, infilename:str)->bool:
         """
@@ -142,10 +275,9 @@ class Primitives:
         :return: The decrypted file.
         """
         
-        with open(infilename, "rb") as f:
-            container = f.read()
         try:
-            plain = self.decrypt(container)
+            with open(infilename, "rb") as f, open(os.devnull, "wb") as null:
+                self.decrypt_stream(f, null)
             return True
         except:
             return False
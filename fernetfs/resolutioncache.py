@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+class ResolutionCache:
+    DEFAULT_SIZE = 4096
+
+    def __init__(self, size:int=DEFAULT_SIZE) -> None:
+        """
+        A LRU cache mapping logical directory paths of a mounted filesystem to their Directory and
+        File objects, and so to their hashed path on disk. It can be shared between threads.
+
+        :param size: The maximum number of directories kept in the cache, 0 disables the cache
+        :type size: int
+        """
+
+        self._size = size
+        self._entries = OrderedDict()
+        self._files = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, prefix:str):
+        """
+        It returns the Directory cached for the logical path, None otherwise
+
+        :param prefix: The logical path of the directory, without leading and trailing "/"
+        :type prefix: str
+        :return: The Directory or None
+        """
+
+        with self._lock:
+            entry = self._entries.get(prefix)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(prefix)
+            self.hits += 1
+            return entry[0]
+
+    def get_file(self, cwd:str):
+        """
+        It returns the File cached for the directory on disk, None otherwise
+
+        :param cwd: The path on disk of the directory
+        :type cwd: str
+        :return: The File or None
+        """
+
+        with self._lock:
+            return self._files.get(cwd)
+
+    def put(self, prefix:str, directory, file)->None:
+        if self._size <= 0:
+            return
+
+        with self._lock:
+            self._remove(prefix)
+            self._entries[prefix] = (directory, file)
+            self._files[directory.cwd()] = file
+
+            while len(self._entries) > self._size:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._files.pop(evicted.cwd(), None)
+
+    def _remove(self, prefix:str)->None:
+        entry = self._entries.pop(prefix, None)
+
+        if entry is not None:
+            self._files.pop(entry[0].cwd(), None)
+
+    def invalidate(self, prefix:str)->None:
+        """
+        It forgets the logical path and all the paths below it
+
+        :param prefix: The logical path of the directory, without leading and trailing "/"
+        :type prefix: str
+        """
+
+        children = prefix + "/"
+        with self._lock:
+            for key in [k for k in self._entries if k == prefix or k.startswith(children) or prefix == ""]:
+                self._remove(key)
+
+    def clear(self)->None:
+        with self._lock:
+            self._entries.clear()
+            self._files.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self)->int:
+        return len(self._entries)
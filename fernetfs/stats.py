@@ -0,0 +1,95 @@
+import threading
+from contextlib import nullcontext
+
+# returned by span() when nothing is traced
+_NO_SPAN = nullcontext()
+
+def span(stats, name:str):
+    """
+    It returns a context manager timing a span with the tracer of the stats, if there are stats and
+    a tracer
+
+    :param stats: The counters of the mounted filesystem, or None
+    :type stats: Stats
+    :param name: The name of the operation or of the phase
+    :type name: str
+    """
+
+    if stats is None or stats.tracer is None:
+        return _NO_SPAN
+
+    return stats.tracer.span(name)
+
+class Stats:
+    def __init__(self, enabled:bool=True, tracer=None) -> None:
+        """
+        Counters of the work done by a mounted filesystem : key derivations, listings and chunks
+        decrypted and encrypted, files opened, operations. Each thread increments its own counters
+        without lock, they are only summed when read. The counters of ended threads are kept.
+
+        The stats also carry the tracer of the filesystem, if any, to the code doing the work.
+
+        :param enabled: Count, otherwise add() does nothing
+        :type enabled: bool
+        :param tracer: The tracer timing the operations and their phases
+        :type tracer: Tracer
+        """
+
+        self.enabled = enabled
+        self.tracer = tracer
+        self._local = threading.local()
+        # (thread, counters) of the threads which counted something
+        self._threads = []
+        # counters of the ended threads
+        self._ended = {}
+        self._lock = threading.Lock()
+
+    def _counters(self)->dict:
+        counters = getattr(self._local, "counters", None)
+        if counters is None:
+            counters = {}
+            self._local.counters = counters
+            with self._lock:
+                self._collect_ended()
+                self._threads.append((threading.current_thread(), counters))
+
+        return counters
+
+    def _collect_ended(self)->None:
+        # called with the lock held, it folds the counters of the ended threads
+        alive = []
+        for thread, counters in self._threads:
+            if thread.is_alive():
+                alive.append((thread, counters))
+            else:
+                for name, value in counters.copy().items():
+                    self._ended[name] = self._ended.get(name, 0) + value
+        self._threads = alive
+
+    def add(self, name:str, value:int=1)->None:
+        if not self.enabled:
+            return
+
+        counters = self._counters()
+        counters[name] = counters.get(name, 0) + value
+
+    def snapshot(self)->dict:
+        """
+        It returns the sum of the counters of all threads, by name
+        """
+
+        with self._lock:
+            self._collect_ended()
+            total = dict(self._ended)
+            for _, counters in self._threads:
+                # copy() doesn't let the owner thread change the dict while it is read
+                for name, value in counters.copy().items():
+                    total[name] = total.get(name, 0) + value
+
+        return dict(sorted(total.items()))
+
+    def reset(self)->None:
+        with self._lock:
+            self._ended.clear()
+            for _, counters in self._threads:
+                counters.clear()
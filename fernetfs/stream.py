@@ -0,0 +1,434 @@
+import base64
+import io
+import os
+import struct
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from fernetfs.stats import span
+
+# Segmented container :
+#   header : MAGIC | stream version (1) | kdf version (1) | chunk size (4) | salt size (1) | salt
+#   chunks : nonce (12) | AES-256-GCM ciphertext (chunk size, less for the last one) | tag (16)
+# Each chunk is authenticated with the header, its index and a flag set on the last chunk only,
+# so chunks can't be reordered, swapped between files or dropped at the end.
+MAGIC = b"\x89FFS"
+STREAM_VERSION = 1
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_CACHE_CHUNKS = 4
+NONCE_SIZE = 12
+TAG_SIZE = 16
+CHUNK_OVERHEAD = NONCE_SIZE + TAG_SIZE
+
+_HEADER = struct.Struct(">4sBBIB")
+_CHUNK_AAD = struct.Struct(">QB")
+
+# decrypt_into lets chunks be decrypted straight into the caller's buffer, older versions of
+# cryptography only return new bytes
+_DECRYPT_INTO = hasattr(AESGCM, "decrypt_into")
+
+
+class StreamError(ValueError):
+    pass
+
+
+def is_stream(head:bytes)->bool:
+    """
+    It tells if the first bytes of a container are the ones of a segmented container
+
+    :param head: The first bytes of the container, at least len(MAGIC)
+    :type head: bytes
+    :return: True for a segmented container, False for a legacy JSON container
+    """
+
+    return bytes(head[:len(MAGIC)]) == MAGIC
+
+
+def _stream_key(primitives, salt:bytes, version:int)->AESGCM:
+    key = primitives.derive_key(salt, version)
+    return AESGCM(base64.urlsafe_b64decode(key))
+
+
+def _count(stats, direction:str, chunks:int, size:int)->None:
+    if stats is not None:
+        stats.add(f"chunks_{direction}", chunks)
+        stats.add(f"bytes_{direction}", size)
+
+
+def _unpack_header(prefix)->tuple:
+    if len(prefix) < _HEADER.size:
+        raise StreamError("Truncated header")
+
+    magic, stream_version, version, chunk_size, salt_size = _HEADER.unpack_from(prefix)
+    if magic != MAGIC:
+        raise StreamError("Not a segmented container")
+    if stream_version != STREAM_VERSION:
+        raise StreamError(f"Unknown stream version {stream_version}")
+
+    return version, chunk_size, salt_size
+
+
+def _geometry(body_size:int, chunk_size:int)->tuple:
+    # returns the number of chunks and the size of the plain data
+    stored_chunk_size = chunk_size + CHUNK_OVERHEAD
+    chunks = -(-body_size // stored_chunk_size)
+    last_size = body_size - (chunks - 1) * stored_chunk_size
+    if chunks <= 0 or last_size < CHUNK_OVERHEAD:
+        raise StreamError("Truncated container")
+
+    return chunks, (chunks - 1) * chunk_size + last_size - CHUNK_OVERHEAD
+
+
+def encrypt_container(primitives, data, chunk_size:int=DEFAULT_CHUNK_SIZE)->bytes:
+    """
+    It encrypts data held in memory into a segmented container
+
+    :param primitives: The primitives providing the salt and the key
+    :type primitives: Primitives
+    :param data: The plain data, any bytes-like object
+    :param chunk_size: The size of the plain data of each chunk
+    :type chunk_size: int
+    :return: The container
+    """
+
+    output = io.BytesIO()
+    with StreamWriter(output, primitives, chunk_size, closefd=False) as writer:
+        writer.write(data)
+
+    return output.getvalue()
+
+
+def decrypt_container(primitives, container)->bytes:
+    """
+    It decrypts a segmented container held in memory. The container is only accessed through a
+    memoryview, so a buffer filled with readinto can be given without copy
+
+    :param primitives: The primitives providing the key
+    :type primitives: Primitives
+    :param container: The container, any bytes-like object
+    :return: The plain data
+    """
+
+    view = memoryview(container).cast("B")
+    version, chunk_size, salt_size = _unpack_header(view)
+
+    header_size = _HEADER.size + salt_size
+    if len(view) < header_size:
+        raise StreamError("Truncated header")
+    header = bytes(view[:header_size])
+    aesgcm = _stream_key(primitives, header[_HEADER.size:], version)
+
+    body = view[header_size:]
+    chunks, _ = _geometry(len(body), chunk_size)
+    stored_chunk_size = chunk_size + CHUNK_OVERHEAD
+
+    plain = []
+    with span(primitives.get_stats(), "cipher"):
+        for index in range(chunks):
+            stored = body[index * stored_chunk_size:(index + 1) * stored_chunk_size]
+            aad = header + _CHUNK_AAD.pack(index, index == chunks - 1)
+            plain.append(aesgcm.decrypt(stored[:NONCE_SIZE], stored[NONCE_SIZE:], aad))
+
+    data = b"".join(plain)
+    _count(primitives.get_stats(), "decrypted", chunks, len(data))
+
+    return data
+
+
+class StreamWriter(io.RawIOBase):
+    def __init__(self, fileobj, primitives, chunk_size:int=DEFAULT_CHUNK_SIZE, closefd:bool=True, append:bool=False) -> None:
+        """
+        A writable raw stream encrypting the data written into fixed-size chunks. Only one chunk is
+        kept in memory. The last chunk is written on close, so the container is incomplete - and
+        can't be read - until the writer is closed.
+
+        In append mode, the file object holds an existing container, opened "r+b". Its header is kept,
+        only its last chunk is authenticated and decrypted, then the writer goes on from the start of
+        that chunk : appending costs the appended data plus one chunk, whatever the size of the file.
+
+        :param fileobj: The binary file object receiving the container
+        :param primitives: The primitives providing the salt and the key
+        :type primitives: Primitives
+        :param chunk_size: The size of the plain data of each chunk, the one of the container in
+        append mode
+        :type chunk_size: int
+        :param closefd: Close the file object with the writer
+        :type closefd: bool
+        :param append: Append to the container of the file object
+        :type append: bool
+        """
+
+        super().__init__()
+        self._fileobj = fileobj
+        self._closefd = closefd
+        self._append = append
+        self._stats = primitives.get_stats()
+        self._tail = None
+
+        if append:
+            self._resume(primitives)
+            return
+
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._index = 0
+
+        salt = primitives.create_salt()
+        version = primitives.get_version()
+        self._header = _HEADER.pack(MAGIC, STREAM_VERSION, version, chunk_size, len(salt)) + salt
+        self._aesgcm = _stream_key(primitives, salt, version)
+
+        self._fileobj.write(self._header)
+
+    def _resume(self, primitives)->None:
+        self._fileobj.seek(0)
+        prefix = self._fileobj.read(_HEADER.size)
+        version, chunk_size, salt_size = _unpack_header(prefix)
+
+        salt = self._fileobj.read(salt_size)
+        if len(salt) < salt_size:
+            raise StreamError("Truncated header")
+
+        self._header = prefix + salt
+        self._chunk_size = chunk_size
+        self._aesgcm = _stream_key(primitives, salt, version)
+
+        end = self._fileobj.seek(0, io.SEEK_END)
+        chunks, _ = _geometry(end - len(self._header), chunk_size)
+
+        # the last chunk is the only one to change : it gets the new data and loses its final flag
+        self._index = chunks - 1
+        offset = len(self._header) + self._index * (chunk_size + CHUNK_OVERHEAD)
+        self._fileobj.seek(offset)
+        stored = self._fileobj.read(end - offset)
+
+        aad = self._header + _CHUNK_AAD.pack(self._index, True)
+        self._buffer = bytearray(self._aesgcm.decrypt(stored[:NONCE_SIZE], stored[NONCE_SIZE:], aad))
+        _count(self._stats, "decrypted", 1, len(self._buffer))
+        self._tail = (offset, stored)
+        self._fileobj.seek(offset)
+
+    def tail(self)->tuple:
+        """
+        In append mode, it returns the offset and the stored bytes of the last chunk before anything
+        was appended, enough to restore the container if the append is interrupted
+
+        :return: The offset and the bytes of the previous last chunk, None if not in append mode
+        """
+
+        return self._tail
+
+    def chunk_size(self)->int:
+        return self._chunk_size
+
+    def writable(self)->bool:
+        return True
+
+    def write(self, data)->int:
+        self._buffer += data
+
+        # a full chunk is kept until more data comes, it may be the last one
+        while len(self._buffer) > self._chunk_size:
+            self._write_chunk(memoryview(self._buffer)[:self._chunk_size], False)
+            del self._buffer[:self._chunk_size]
+
+        return len(data)
+
+    def _write_chunk(self, plain, final:bool)->None:
+        nonce = os.getrandom(NONCE_SIZE)
+        aad = self._header + _CHUNK_AAD.pack(self._index, final)
+        with span(self._stats, "cipher"):
+            stored = self._aesgcm.encrypt(nonce, bytes(plain), aad)
+        with span(self._stats, "io"):
+            self._fileobj.write(nonce)
+            self._fileobj.write(stored)
+        self._index += 1
+        _count(self._stats, "encrypted", 1, len(plain))
+
+    def close(self)->None:
+        if self.closed:
+            return
+
+        try:
+            self._write_chunk(self._buffer, True)
+            self._buffer = bytearray()
+            if self._append:
+                self._fileobj.truncate()
+            if self._closefd:
+                self._fileobj.close()
+        finally:
+            super().close()
+
+
+class StreamReader(io.RawIOBase):
+    def __init__(self, fileobj, primitives, cache_chunks:int=DEFAULT_CACHE_CHUNKS) -> None:
+        """
+        A readable and seekable raw stream decrypting a segmented container. Only the chunks covering
+        the requested range are read and authenticated, the last decrypted chunks are kept in a small
+        cache for sequential and nearby reads. The ciphertext is read into a reusable buffer, and a
+        readinto covering whole chunks decrypts them straight into the caller's buffer.
+
+        :param fileobj: The seekable binary file object of the container, it is closed with the reader
+        :param primitives: The primitives providing the key
+        :type primitives: Primitives
+        :param cache_chunks: The number of decrypted chunks kept in memory
+        :type cache_chunks: int
+        """
+
+        super().__init__()
+        self._fileobj = fileobj
+        self._stats = primitives.get_stats()
+
+        prefix = self._fileobj.read(_HEADER.size)
+        version, chunk_size, salt_size = _unpack_header(prefix)
+
+        salt = self._fileobj.read(salt_size)
+        if len(salt) < salt_size:
+            raise StreamError("Truncated header")
+
+        self._header = prefix + salt
+        self._chunk_size = chunk_size
+        self._aesgcm = _stream_key(primitives, salt, version)
+
+        end = self._fileobj.seek(0, io.SEEK_END)
+        self._chunks, self._size = _geometry(end - len(self._header), chunk_size)
+
+        self._stored = bytearray(chunk_size + CHUNK_OVERHEAD)
+        self._position = 0
+        self._cache = OrderedDict()
+        self._cache_chunks = max(cache_chunks, 1)
+        self._authenticated_end = False
+
+    def readable(self)->bool:
+        return True
+
+    def seekable(self)->bool:
+        return True
+
+    def size(self)->int:
+        """
+        It returns the size of the plain data, without decrypting anything
+        """
+
+        return self._size
+
+    def chunk_size(self)->int:
+        return self._chunk_size
+
+    def tell(self)->int:
+        return self._position
+
+    def seek(self, offset:int, whence:int=io.SEEK_SET)->int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self._position = position
+        return position
+
+    def _plain_size(self, index:int)->int:
+        if index == self._chunks - 1:
+            return self._size - index * self._chunk_size
+
+        return self._chunk_size
+
+    def _decrypt_chunk(self, index:int, output)->None:
+        # output is a writable memoryview of exactly the plain size of the chunk
+        final = index == self._chunks - 1
+        stored_size = len(output) + CHUNK_OVERHEAD
+        stored = memoryview(self._stored)[:stored_size]
+
+        with span(self._stats, "io"):
+            self._fileobj.seek(len(self._header) + index * (self._chunk_size + CHUNK_OVERHEAD))
+            received = 0
+            while received < stored_size:
+                count = self._fileobj.readinto(stored[received:])
+                if not count:
+                    raise StreamError("Truncated container")
+                received += count
+
+        aad = self._header + _CHUNK_AAD.pack(index, final)
+        with span(self._stats, "cipher"):
+            if _DECRYPT_INTO:
+                self._aesgcm.decrypt_into(stored[:NONCE_SIZE], stored[NONCE_SIZE:], aad, output)
+            else:
+                output[:] = self._aesgcm.decrypt(stored[:NONCE_SIZE], stored[NONCE_SIZE:], aad)
+        _count(self._stats, "decrypted", 1, len(output))
+
+        if final:
+            self._authenticated_end = True
+
+    def _read_chunk(self, index:int)->bytearray:
+        plain = self._cache.get(index)
+        if plain is not None:
+            self._cache.move_to_end(index)
+            return plain
+
+        plain = bytearray(self._plain_size(index))
+        self._decrypt_chunk(index, memoryview(plain))
+
+        self._cache[index] = plain
+        while len(self._cache) > self._cache_chunks:
+            self._cache.popitem(last=False)
+
+        return plain
+
+    def readinto(self, buffer)->int:
+        buffer = memoryview(buffer).cast("B")
+        total = 0
+
+        while total < len(buffer) and self._position < self._size:
+            index, offset = divmod(self._position, self._chunk_size)
+            plain_size = self._plain_size(index)
+
+            # a whole chunk is decrypted in place, without going through the cache. If it can't be
+            # authenticated, an exception is raised and the content of the buffer is undefined
+            if offset == 0 and len(buffer) - total >= plain_size and index not in self._cache:
+                self._decrypt_chunk(index, buffer[total:total + plain_size])
+                total += plain_size
+                self._position += plain_size
+                continue
+
+            plain = self._read_chunk(index)
+
+            length = min(len(buffer) - total, plain_size - offset)
+            buffer[total:total + length] = memoryview(plain)[offset:offset + length]
+            total += length
+            self._position += length
+
+        # the end of the data is only reported once the last chunk is authenticated
+        if total == 0 and len(buffer) > 0 and not self._authenticated_end:
+            self._read_chunk(self._chunks - 1)
+
+        return total
+
+    def readall(self)->bytes:
+        # one buffer of the remaining size instead of a list of blocks joined at the end
+        buffer = bytearray(max(self._size - self._position, 0))
+        view = memoryview(buffer)
+        total = 0
+
+        while total < len(buffer):
+            total += self.readinto(view[total:])
+        self.readinto(bytearray(1))
+
+        return bytes(buffer)
+
+    def close(self)->None:
+        if self.closed:
+            return
+
+        try:
+            self._cache.clear()
+            self._fileobj.close()
+        finally:
+            super().close()
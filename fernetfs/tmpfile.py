@@ -1,17 +1,47 @@
-from tempfile import mkstemp
+from tempfile import mkstemp, mkdtemp
+import io
 import os
-from threading import Thread, Lock
+import shutil
+from threading import Thread, Lock, Event
 import logging 
 import time
+from contextlib import suppress
 
 import inotify.adapters
+import inotify.constants
 
 from fernetfs.primitives import Primitives
+from fernetfs.keycache import KeyCache
+from fernetfs.stats import Stats
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("TmpFile")
 
 RAMFS = "/dev/shm"
+# a burst of saves is written back once, when no save happened during this delay (seconds)
+DEFAULT_DEBOUNCE = 0.5
+# the watcher wakes up at this interval to write back the files saved before the delay (seconds)
+POLL_INTERVAL = 0.1
+# created in a watched directory to wake up the watcher when it must stop. The directory must hold no
+# file of the user, which could have this name
+WAKE_FILENAME = ".fernetfs-wake"
+
+def wake(directory:str)->None:
+    """
+    It wakes up a watcher of the directory blocked on inotify, with an event of its own
+
+    :param directory: A directory watched for IN_CLOSE_WRITE events
+    :type directory: str
+    """
+
+    try:
+        open(os.path.join(directory, WAKE_FILENAME), "wb").close()
+    except OSError:
+        # the directory is gone, the watcher only waits until POLL_INTERVAL
+        pass
 
 class TmpFile:
-    def __init__(self, secret:bytes, filename:str, iterations:int=480000, salt_size=16):
+    def __init__(self, secret:bytes, filename:str, iterations:int=480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, debounce:float=DEFAULT_DEBOUNCE, stats:Stats=None):
         """
         `__init__` is a function that takes in a secret, a filename, an editor, and two optional
         arguments (iterations and salt_size) and sets the values of the class variables `_primitives`,
@@ -25,14 +55,24 @@ class TmpFile:
         :type iterations: int (optional)
         :param salt_size: The size of the salt to use. The default is 16 bytes, which is 128 bits,
         defaults to 16 (optional)
+        :param key_cache: The cache of derived keys shared with the mounted filesystem, if any
+        :type key_cache: KeyCache (optional)
+        :param version: The container version used to write back the file, defaults to PBKDF2 containers
+        :type version: int (optional)
+        :param debounce: The delay without save after which the file is written back, in seconds
+        :type debounce: float (optional)
+        :param stats: The counters of the mounted filesystem, if any
+        :type stats: Stats (optional)
         """
         
-        self._primitives = Primitives(secret, iterations, salt_size)
+        self._primitives = Primitives(secret, iterations, salt_size, key_cache, version, stats)
         self._filename = filename
-        self._log = logging.getLogger(f"TmpFile({filename})")
+        self._log = ContextLogger(_log, filename)
+        self._debounce = debounce
 
-        self._running = False
+        self._stop = Event()
 
+        self._directory = None
         self._decrypted_path = None
 
 
@@ -44,10 +84,11 @@ class TmpFile:
 
         self._log.debug("Decrypt")
         
+        plain = io.BytesIO()
         with open(self._filename, "rb") as f:
-            container = f.read()
+            self._primitives.decrypt_stream(f, plain)
     
-        return self._primitives.decrypt(container)
+        return plain.getvalue()
 
 
     def encrypt(self, path:str):
@@ -61,42 +102,79 @@ class TmpFile:
         
         self._log.debug("Encrypt")
 
-        with open(path, "rb") as f:
-            plain = f.read()
+        # the file is encrypted aside then replaces the previous one, readers and a failed write back
+        # never see a partial container
+        tmp_path = f"{self._filename}.{os.getpid()}-{id(self):x}.tmp"
+        try:
+            with open(path, "rb") as fin:
+                self._primitives.encrypt_stream(fin, open(tmp_path, "wb"))
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, self._filename)
+
+
+    def create(self)->str:
+        """
+        It writes the decrypted content of the file in a private directory of RAMFS, only readable by
+        the current user, and returns the path of the plain file
+
+        :return: The path of the plain file
+        """
+
+        decrypted = self.decrypt()
+
+        self._directory = mkdtemp(dir=RAMFS, prefix="fernetfs-")
+        fd, path = mkstemp(dir=self._directory, suffix=".plain")
+        self._log.debug("Create RAM file %s", path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(decrypted)
+        self._log.debug("Add plain data to RAM file %s", path)
 
-        encrypted = self._primitives.encrypt(plain)
+        return path
 
-        with open(self._filename, "w") as f:
-            f.write(encrypted)
+    def remove(self)->None:
+        """
+        It deletes the private directory and the plain file, along with anything the command left there
+        """
 
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._log.debug("Remove RAM directory %s", self._directory)
+            self._directory = None
 
     def write_back(self, watch_path:str):
         """
-        It watches the RAMFS directory for changes, and when a file is closed after being written to, it
-        encrypts it
+        It watches the private directory of the plain file, and encrypts the file once it was saved and
+        not saved again during the debounce delay. Files saved by renaming a new file over it are
+        handled too. It returns as soon as it is woken up once stop is requested; the last changes
+        are left to the caller.
         
         :param watch_path: The path to the file to watch
         :type watch_path: str
-        :return: The event is being returned.
         """
         
-        i = inotify.adapters.Inotify()
-
-        i.add_watch(RAMFS)
+        i = inotify.adapters.Inotify(block_duration_s=POLL_INTERVAL)
+        i.add_watch(os.path.dirname(watch_path), inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVED_TO)
+        name = os.path.basename(watch_path)
 
+        saved = None
         for event in i.event_gen():
+            if event is not None:
+                (_, _, _, filename) = event
+                if filename == name:
+                    saved = time.monotonic()
 
-            if not self._running:
-                self._log.debug(f"leave")
+            if self._stop.is_set():
+                self._log.debug("leave")
                 return
 
-            if event is not None:
-                (_, type_names, path, filename) = event
-
-                if os.path.join(path, filename) == watch_path:
-                    if "IN_CLOSE_WRITE" in type_names:
-                        self._log.debug(f"Write back {watch_path}")
-                        self.encrypt(watch_path)
+            if saved is not None and time.monotonic() - saved >= self._debounce:
+                self._log.debug("Write back %s", watch_path)
+                self.encrypt(watch_path)
+                saved = None
 
 
     def run(self, command:str):
@@ -105,52 +183,41 @@ class TmpFile:
         on it, and when the editor is closed, it re-encrypt the file and delete the temporary file
         """
         
-        decrypted = self.decrypt()
-
         try:
-            fd, path = mkstemp(dir=RAMFS, suffix=".plain")
-            self._log.debug(f"Create RAM file {path}")
-            with os.fdopen(fd, 'wb') as f:
-                f.write(decrypted)
-                f.flush()
-                self._log.debug(f"Add plain data to RAM file {path}")
-
-                # Run a thread that monitor file change.
-                # This way, modification are automatically write back to the encrypted file
-                self._running = True
-                write_back_thread = Thread(target=self.write_back, args=(path,))
-                write_back_thread.start()
-                self._log.debug(f"inotify is running")
-
-                self._log.debug(f"Running command '{command} {path}'")
+            path = self.create()
+
+            # Run a thread that monitor file change.
+            # This way, modification are automatically write back to the encrypted file
+            self._stop.clear()
+            write_back_thread = Thread(target=self.write_back, args=(path,), daemon=True)
+            write_back_thread.start()
+            self._log.debug("inotify is running")
+
+            try:
+                self._log.debug("Running command '%s %s'", command, path)
                 os.system(f"{command} {path}")
-                # stopping the write back thread
-                self._log.debug(f"End of command '{command} {path}'")
-                self._running = False
+                self._log.debug("End of command '%s %s'", command, path)
+            finally:
+                # stopping the write back thread before the last write back, they can't overlap
+                self._stop.set()
+                wake(os.path.dirname(path))
+                write_back_thread.join()
 
             self.encrypt(path)
-            self._log.debug(f"Encrypted write back")
+            self._log.debug("Encrypted write back")
             
         except Exception as e:
-            self._log.error(f"Something failed : {e}")
+            self._log.error("Something failed : %s", e)
         finally:
-            os.unlink(path)
-            self._log.debug(f"Unkink RAM file {path}")
+            self.remove()
 
     def __enter__(self):
-        decrypted = self.decrypt()
-
-        fd, path = mkstemp(dir=RAMFS, suffix=".plain")
-        self._log.debug(f"Create RAM file {path}")
-        with os.fdopen(fd, 'wb') as f:
-            f.write(decrypted)
-            f.flush()
-        self._log.debug(f"Add plain data to RAM file {path}")
-        self._decrypted_path = path
-        return path
+        self._decrypted_path = self.create()
+        return self._decrypted_path
      
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        self.encrypt(self._decrypted_path)
-        os.unlink(self._decrypted_path)
-        self._log.debug(f"Unkink RAM file {self._decrypted_path}")
-        self._log.debug(f"Encrypted write back")
+        try:
+            self.encrypt(self._decrypted_path)
+            self._log.debug("Encrypted write back")
+        finally:
+            self.remove()
@@ -0,0 +1,233 @@
+from tempfile import mkdtemp
+import os
+import shutil
+import hashlib
+import logging
+import time
+from contextlib import suppress
+from threading import Thread, Lock, Event
+from concurrent.futures import ThreadPoolExecutor
+
+import inotify.adapters
+import inotify.constants
+
+from fernetfs.primitives import Primitives
+from fernetfs.keycache import KeyCache
+from fernetfs.stats import Stats
+from fernetfs.tmpfile import RAMFS, DEFAULT_DEBOUNCE, POLL_INTERVAL, wake
+from fernetfs.log import ContextLogger
+
+_log = logging.getLogger("TmpSession")
+
+class TmpSession:
+    def __init__(self, secret:bytes, files:dict, iterations:int=480000, salt_size=16, key_cache:KeyCache=None, version:int=Primitives.VERSION_PBKDF2, workers:int=4, debounce:float=DEFAULT_DEBOUNCE, stats:Stats=None):
+        """
+        A set of encrypted files decrypted together into one private directory of RAMFS. A single
+        watcher thread writes back the files saved in the directory, and only the files whose content
+        changed are encrypted again when the session ends. Files created in the directory are not
+        written back.
+
+        :param secret: The secret key used to encrypt and decrypt the files
+        :type secret: bytes
+        :param files: The encrypted paths of the files, by relative plain path in the directory
+        :type files: dict
+        :param iterations: The number of iterations to use when generating the key, defaults to 480000
+        :type iterations: int (optional)
+        :param salt_size: The size of the salt to use, defaults to 16 (optional)
+        :param key_cache: The cache of derived keys shared with the mounted filesystem, if any
+        :type key_cache: KeyCache (optional)
+        :param version: The container version used to write back the files, defaults to PBKDF2 containers
+        :type version: int (optional)
+        :param workers: The number of threads decrypting and encrypting files
+        :type workers: int (optional)
+        :param debounce: The delay without save after which a file is written back, in seconds
+        :type debounce: float (optional)
+        :param stats: The counters of the mounted filesystem, if any
+        :type stats: Stats (optional)
+        """
+
+        self._primitives = Primitives(secret, iterations, salt_size, key_cache, version, stats)
+        self._files = dict(files)
+        self._workers = max(workers, 1)
+        self._debounce = debounce
+        self._log = ContextLogger(_log, f"{len(self._files)} files")
+
+        self._directory = None
+        # the watcher is woken up in a private directory of its own, a file of the session could have
+        # any name
+        self._wake_directory = None
+        # digest of the content last written to each encrypted file, by plain path
+        self._digests = {}
+        self._digests_lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def directory(self)->str:
+        return self._directory
+
+    def _plain_path(self, relative:str)->str:
+        return os.path.join(self._directory, relative)
+
+    def _digest(self, path:str)->bytes:
+        digest = hashlib.blake2b()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+
+        return digest.digest()
+
+    def _decrypt(self, relative:str)->None:
+        # run by the workers
+        path = self._plain_path(relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(self._files[relative], "rb") as fin, open(path, "wb") as fout:
+            self._primitives.decrypt_stream(fin, fout)
+
+        with self._digests_lock:
+            self._digests[relative] = self._digest(path)
+
+    def _encrypt(self, relative:str)->bool:
+        # the file is encrypted aside then replaces the previous one, it is skipped if unchanged
+        path = self._plain_path(relative)
+        digest = self._digest(path)
+        with self._digests_lock:
+            if self._digests.get(relative) == digest:
+                return False
+
+        target = self._files[relative]
+        tmp_path = f"{target}.{os.getpid()}-{id(self):x}.tmp"
+        try:
+            with open(path, "rb") as fin:
+                self._primitives.encrypt_stream(fin, open(tmp_path, "wb"))
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, target)
+
+        with self._digests_lock:
+            self._digests[relative] = digest
+        self._log.debug("Write back %s", relative)
+
+        return True
+
+    def open(self)->str:
+        """
+        It creates the private directory and decrypts the files into it in a pool of threads, then
+        starts the watcher
+
+        :return: The path of the directory
+        """
+
+        self._directory = mkdtemp(dir=RAMFS, prefix="fernetfs-")
+        self._log.debug("Create RAM directory %s", self._directory)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="fernetfs-session") as executor:
+                for future in [executor.submit(self._decrypt, relative) for relative in self._files]:
+                    future.result()
+        except BaseException:
+            self.remove()
+            raise
+
+        self._wake_directory = mkdtemp(dir=RAMFS, prefix="fernetfs-wake-")
+        self._stop.clear()
+        self._thread = Thread(target=self.write_back, daemon=True)
+        self._thread.start()
+
+        return self._directory
+
+    def write_back(self)->None:
+        """
+        It watches the directories of the session, and encrypts each file once it was saved and not
+        saved again during the debounce delay. It returns as soon as it is woken up once stop is
+        requested.
+        """
+
+        i = inotify.adapters.Inotify(block_duration_s=POLL_INTERVAL)
+        for directory in {self._wake_directory} | {os.path.dirname(self._plain_path(relative)) for relative in self._files}:
+            i.add_watch(directory, inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVED_TO)
+
+        # last save time, by relative plain path
+        saved = {}
+        for event in i.event_gen():
+            if event is not None:
+                (_, _, path, filename) = event
+                relative = os.path.relpath(os.path.join(path, filename), self._directory)
+                if relative in self._files:
+                    saved[relative] = time.monotonic()
+
+            if self._stop.is_set():
+                self._log.debug("leave")
+                return
+
+            now = time.monotonic()
+            for relative in [r for r, t in saved.items() if now - t >= self._debounce]:
+                del saved[relative]
+                try:
+                    self._encrypt(relative)
+                except Exception as e:
+                    # the file is tried again when the session ends
+                    self._log.error("Can't write back %s : %s", relative, e)
+
+    def close(self)->list:
+        """
+        It stops the watcher, encrypts the files which changed since they were last written back, in a
+        pool of threads, then deletes the directory
+
+        :return: The relative plain paths of the files encrypted on close
+        """
+
+        if self._thread is not None:
+            self._stop.set()
+            wake(self._wake_directory)
+            self._thread.join()
+            self._thread = None
+
+        try:
+            changed = []
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="fernetfs-session") as executor:
+                futures = [(relative, executor.submit(self._encrypt, relative)) for relative in self._files if os.path.isfile(self._plain_path(relative))]
+                for relative, future in futures:
+                    if future.result():
+                        changed.append(relative)
+            self._log.debug("Encrypted write back of %d files", len(changed))
+        finally:
+            self.remove()
+
+        return changed
+
+    def remove(self)->None:
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._log.debug("Remove RAM directory %s", self._directory)
+            self._directory = None
+
+        if self._wake_directory is not None:
+            shutil.rmtree(self._wake_directory, ignore_errors=True)
+            self._wake_directory = None
+
+    def run(self, command:str)->list:
+        """
+        It decrypts the files, runs the command with the directory as argument, and writes back the
+        files which changed once the command ends
+
+        :return: The relative plain paths of the files encrypted when the command ended
+        """
+
+        directory = self.open()
+        try:
+            self._log.debug("Running command '%s %s'", command, directory)
+            os.system(f"{command} {directory}")
+            self._log.debug("End of command '%s %s'", command, directory)
+        finally:
+            changed = self.close()
+
+        return changed
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+
+_log = logging.getLogger("Tracer")
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_stack", "_phases", "_start")
+
+    def __init__(self, tracer, name:str) -> None:
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._phases = None
+        self._stack = self._tracer._stack()
+        self._stack.append(self)
+        self._tracer.begin(self._name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+        stack = self._stack
+        stack.pop()
+        self._tracer.end(self._name, seconds)
+
+        if stack:
+            # the time of a phase is added to all the spans it is nested in
+            parent = stack[-1]
+            if parent._phases is None:
+                parent._phases = {}
+            phases = parent._phases
+            phases[self._name] = phases.get(self._name, 0.0) + seconds
+            if self._phases is not None:
+                for name, phase_seconds in self._phases.items():
+                    phases[name] = phases.get(name, 0.0) + phase_seconds
+        else:
+            self._tracer._check_slow(self._name, seconds, self._phases or {})
+
+
+class Tracer:
+    def __init__(self, slow_threshold:float=None) -> None:
+        """
+        It times nested spans : the operations of the filesystem (open, ls, mkdir...) and the phases of
+        the work they do - kdf, cipher, io and json. begin() and end() are called for each span, they
+        do nothing here and are meant to be overridden. A span started by no other one is an operation;
+        if it lasts more than slow_threshold, it is logged with the time spent in each phase. The time
+        of a phase includes the phases nested in it.
+
+        :param slow_threshold: The duration, in seconds, above which an operation is logged, never if None
+        :type slow_threshold: float
+        """
+
+        self.slow_threshold = slow_threshold
+        self._local = threading.local()
+
+    def _stack(self)->list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+
+        return stack
+
+    def span(self, name:str)->_Span:
+        """
+        It returns a context manager timing a span, nested in the current span of the thread if any
+        """
+
+        return _Span(self, name)
+
+    def begin(self, name:str)->None:
+        pass
+
+    def end(self, name:str, seconds:float)->None:
+        pass
+
+    def _check_slow(self, name:str, seconds:float, phases:dict)->None:
+        if self.slow_threshold is None or seconds <= self.slow_threshold:
+            return
+
+        breakdown = ", ".join(f"{phase} {phase_seconds * 1000:.3f} ms" for phase, phase_seconds in sorted(phases.items(), key=lambda item: -item[1]))
+        _log.warning("Slow %s : %.3f ms (%s)", name, seconds * 1000, breakdown or "no phase")
+
+
+class Histogram:
+    # each power of two is split into 2 ** SUB_BUCKET_BITS buckets, a relative precision of about 3%
+    SUB_BUCKET_BITS = 5
+
+    def __init__(self) -> None:
+        """
+        A histogram of durations with logarithmic buckets, in the spirit of HDR histograms : the memory
+        is bounded, whatever the number and the range of the values, and percentiles have a bounded
+        relative error. Durations are kept in nanoseconds.
+        """
+
+        self._buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds:float)->None:
+        value = int(seconds * 1e9)
+        if value < 0:
+            value = 0
+
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        bucket = (value >> shift) << shift if shift > 0 else value
+        buckets = self._buckets
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+        if self.count == 0:
+            self.min = value
+            self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent:float)->float:
+        """
+        It returns the duration, in seconds, below which percent of the durations are
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                # the highest value of the bucket, bounded by the largest recorded value
+                shift = max(bucket.bit_length() - self.SUB_BUCKET_BITS, 0)
+                return min(bucket + (1 << shift) - 1, self.max) / 1e9
+
+        return self.max / 1e9
+
+    def summary(self)->dict:
+        if self.count == 0:
+            return {"count": 0}
+
+        return {
+            "count": self.count,
+            "min": self.min / 1e9,
+            "mean": self.total / self.count / 1e9,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max / 1e9,
+        }
+
+
+class HistogramTracer(Tracer):
+    def __init__(self, slow_threshold:float=None) -> None:
+        """
+        A tracer recording the durations of each operation and phase in a histogram, by name
+
+        :param slow_threshold: The duration, in seconds, above which an operation is logged, never if None
+        :type slow_threshold: float
+        """
+
+        super().__init__(slow_threshold)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def end(self, name:str, seconds:float)->None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self._histograms[name] = histogram
+            histogram.record(seconds)
+
+    def histograms(self)->dict:
+        """
+        It returns the summary of each histogram - count, min, mean, p50, p90, p99, p999 and max, in
+        seconds - by name
+        """
+
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self)->None:
+        with self._lock:
+            self._histograms.clear()
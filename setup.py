@@ -6,7 +6,7 @@ setup(name='fernetfs',
     license='Apachev2',
     author='Laurent MOULIN',
     author_email='gignops@gmail.com',
-    description='Encrypt and decrypt your file with Fernet algorithm',
+    description='Encrypt and decrypt your file with AES-256-GCM, in a virtual file system',
     packages=find_packages(exclude=['tests', "etc", "build", "dist", "fernetfs.egg-info"]),
     install_requires=["cryptography", "inotify"],
     long_description=open('README.md').read(),
@@ -0,0 +1,151 @@
+import unittest
+import asyncio
+import os
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fernetfs.asyncfilesystem import AsyncFileSystem
+
+WORKING_DIR = "/tmp/test_directory"
+SECRET = b"secret"
+ITERATIONS = 100
+SALT = 16
+
+logging.basicConfig(level=logging.DEBUG)
+
+class TestAsyncFileSystem(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        os.mkdir(WORKING_DIR)
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self) -> None:
+        self.executor.shutdown()
+        shutil.rmtree(WORKING_DIR)
+
+    async def new_filesystem(self)->AsyncFileSystem:
+        fs = AsyncFileSystem(executor=self.executor)
+        await fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        await fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        return fs
+
+    async def test_open(self):
+        fs = await self.new_filesystem()
+
+        async with await fs.open("test.txt", "w") as f:
+            await f.write("demo")
+
+        async with await fs.open("test.txt", "r") as f:
+            result = await f.read()
+
+        self.assertEqual(result, "demo")
+
+    async def test_seek(self):
+        fs = await self.new_filesystem()
+        f = await fs.open("test.bin", "wb")
+        await f.write(b"0123456789")
+        await f.aclose()
+
+        f = await fs.open("test.bin", "rb")
+        await f.seek(4)
+        result = await f.read(3)
+        position = await f.tell()
+        await f.aclose()
+
+        self.assertEqual(result, b"456")
+        self.assertEqual(position, 7)
+        self.assertTrue(f.closed)
+
+    async def test_tree(self):
+        fs = await self.new_filesystem()
+
+        await fs.mkdir("foobar")
+        async with await fs.open("foobar/test.txt", "w") as f:
+            await f.write("demo")
+
+        self.assertTrue(await fs.is_directory_exist("foobar"))
+        self.assertTrue(await fs.is_file_exist("foobar/test.txt"))
+        self.assertDictEqual(await fs.ls("/"), {"foobar": "d"})
+        self.assertListEqual(await fs.walk("/"), [("/", ["foobar"], []), ("/foobar", [], ["test.txt"])])
+
+        await fs.remove_file("foobar/test.txt")
+        await fs.remove_directory("foobar")
+
+        self.assertDictEqual(await fs.ls("/"), {})
+
+    async def test_concurrent_files(self):
+        fs = await self.new_filesystem()
+
+        async def write(i):
+            async with await fs.open(f"test{i}.txt", "w") as f:
+                await f.write(str(i))
+
+        await asyncio.gather(*(write(i) for i in range(20)))
+
+        async def read(i):
+            async with await fs.open(f"test{i}.txt", "r") as f:
+                return await f.read()
+
+        results = await asyncio.gather(*(read(i) for i in range(20)))
+
+        self.assertListEqual(results, [str(i) for i in range(20)])
+
+    async def test_coalesce_ls(self):
+        fs = await self.new_filesystem()
+        await fs.mkdir("foobar")
+        cache = fs.get_filesystem().get_listing_cache()
+        cache.clear()
+        await fs.ls("/")
+        single = cache.hits + cache.misses
+        cache.clear()
+
+        results = await asyncio.gather(*(fs.ls("/") for _ in range(10)))
+
+        self.assertTrue(all(result == {"foobar": "d"} for result in results))
+        self.assertEqual(cache.hits + cache.misses, single)
+
+    async def test_no_stale_coalescing(self):
+        fs = await self.new_filesystem()
+
+        first = asyncio.ensure_future(fs.ls("/"))
+        await asyncio.sleep(0)
+        await fs.mkdir("foobar")
+        second = await fs.ls("/")
+
+        self.assertDictEqual(second, {"foobar": "d"})
+        await first
+
+    async def test_no_coalescing_with_read_during_change(self):
+        fs = await self.new_filesystem()
+        filesystem = fs.get_filesystem()
+        mkdir, is_directory_exist = filesystem.mkdir, filesystem.is_directory_exist
+        go, started, release = threading.Event(), threading.Event(), threading.Event()
+
+        def blocked_mkdir(path):
+            go.wait(5)
+            mkdir(path)
+
+        def slow_is_directory_exist(path):
+            result = is_directory_exist(path)
+            started.set()
+            release.wait(5)
+            return result
+
+        filesystem.mkdir = blocked_mkdir
+        filesystem.is_directory_exist = slow_is_directory_exist
+
+        # a read started while the directory is being created, and still running once it is
+        change = asyncio.ensure_future(fs.mkdir("/foobar"))
+        await asyncio.sleep(0)
+        during = asyncio.ensure_future(fs.is_directory_exist("/foobar"))
+        await asyncio.to_thread(started.wait, 5)
+        go.set()
+        await change
+
+        after = asyncio.ensure_future(fs.is_directory_exist("/foobar"))
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertFalse(await during)
+        self.assertTrue(await after)
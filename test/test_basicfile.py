@@ -2,8 +2,13 @@ import unittest
 import os
 from contextlib import suppress
 import logging 
+import json
+import threading
+
+from cryptography.fernet import Fernet
 
 from fernetfs.basicfile import BasicFile
+from fernetfs.primitives import Primitives
 
 WORKING_FILE = "/tmp/test.x"
 SECRET = b"secret"
@@ -11,12 +16,20 @@ ITERATIONS = 100
 
 #logging.basicConfig(level=logging.DEBUG)
 
+def legacy_encrypt(data:bytes)->str:
+    primitives = Primitives(SECRET, ITERATIONS)
+    salt = primitives.create_salt()
+    encrypted = Fernet(primitives.secret_2_key(salt, SECRET)).encrypt(data)
+    return json.dumps({"salt" : str(salt, "utf8"), "data" : str(encrypted, "utf8")}, indent=4)
+
 class TestFile(unittest.TestCase):
 
 
     def tearDown(self) -> None:
         with suppress(FileNotFoundError):
             os.remove(WORKING_FILE)
+        with suppress(FileNotFoundError):
+            os.remove(WORKING_FILE + ".append")
 
     def test_write_utf8(self):
         with BasicFile(WORKING_FILE, SECRET, "w", ITERATIONS) as f:
@@ -50,4 +63,256 @@ class TestFile(unittest.TestCase):
         with BasicFile(WORKING_FILE, SECRET, "a", ITERATIONS) as f:
             f.write("Hello")
 
-        
+    def test_append_existing_utf8(self):
+        with BasicFile(WORKING_FILE, SECRET, "w", ITERATIONS) as f:
+            f.write("Hello")
+
+        with BasicFile(WORKING_FILE, SECRET, "a", ITERATIONS) as f:
+            f.write(" world")
+
+        with BasicFile(WORKING_FILE, SECRET, "r", ITERATIONS) as f:
+            result = f.read()
+
+        expected = "Hello world"
+        self.assertEqual(result, expected)
+
+    def test_write_read_chunks(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            for i in range(0, len(data), 100):
+                f.write(data[i:i + 100])
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            result = f.read()
+
+        self.assertEqual(result, data)
+
+    def test_read_legacy(self):
+        with open(WORKING_FILE, "w") as f:
+            f.write(legacy_encrypt(b"Hello"))
+
+        with BasicFile(WORKING_FILE, SECRET, "r", ITERATIONS) as f:
+            result = f.read()
+
+        expected = "Hello"
+        self.assertEqual(result, expected)
+
+    def test_read_view(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+
+        result = BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS).read_view()
+
+        self.assertIsInstance(result, memoryview)
+        self.assertEqual(result, data)
+
+    def test_read_view_buffer(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+        buffer = bytearray(2000)
+
+        result = BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS).read_view(buffer)
+
+        self.assertEqual(result, data)
+        self.assertEqual(buffer[:1000], data)
+        with self.assertRaises(ValueError):
+            BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS).read_view(bytearray(999))
+
+    def test_read_view_legacy(self):
+        with open(WORKING_FILE, "w") as f:
+            f.write(legacy_encrypt(b"Hello"))
+
+        result = BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS).read_view()
+
+        self.assertEqual(result, b"Hello")
+
+    def test_append_in_place(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+        inode = os.stat(WORKING_FILE).st_ino
+
+        for i in range(10):
+            with BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS) as f:
+                f.write(bytes([i]) * 10)
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            result = f.read()
+
+        self.assertEqual(result, data + b"".join(bytes([i]) * 10 for i in range(10)))
+        self.assertEqual(os.stat(WORKING_FILE).st_ino, inode)
+        self.assertFalse(os.path.exists(WORKING_FILE + ".append"))
+
+    def test_append_legacy(self):
+        with open(WORKING_FILE, "w") as f:
+            f.write(legacy_encrypt(b"Hello"))
+
+        with BasicFile(WORKING_FILE, SECRET, "a", ITERATIONS) as f:
+            f.write(" world")
+
+        with BasicFile(WORKING_FILE, SECRET, "r", ITERATIONS) as f:
+            result = f.read()
+
+        self.assertEqual(result, "Hello world")
+
+    def test_append_interrupted(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+
+        file = BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS)
+        writer = file.__enter__()
+        writer.write(os.getrandom(200))
+        writer.flush()
+        # the process dies before the last chunk is written
+        file._append_file.close()
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            result = f.read()
+
+        self.assertEqual(result, data)
+        self.assertFalse(os.path.exists(WORKING_FILE + ".append"))
+
+    def test_append_interrupted_then_rewritten(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+
+        file = BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS)
+        writer = file.__enter__()
+        writer.write(os.getrandom(200))
+        writer.flush()
+        file._append_file.close()
+
+        # the rewrite drops the rollback record of the interrupted append
+        rewritten = os.getrandom(200000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS) as f:
+            f.write(rewritten)
+
+        self.assertFalse(os.path.exists(WORKING_FILE + ".append"))
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            self.assertEqual(f.read(), rewritten)
+
+    def test_append_record_of_another_container(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+
+        file = BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS)
+        writer = file.__enter__()
+        writer.write(os.getrandom(200))
+        writer.flush()
+        file._append_file.close()
+
+        # another container takes the path without going through BasicFile
+        other = os.getrandom(200000)
+        tmp = WORKING_FILE + ".other"
+        with BasicFile(tmp, SECRET, "wb", ITERATIONS) as f:
+            f.write(other)
+        os.replace(tmp, WORKING_FILE)
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            result = f.read()
+
+        self.assertEqual(result, other)
+        self.assertFalse(os.path.exists(WORKING_FILE + ".append"))
+
+    def test_append_after_interrupted(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+        inode = os.stat(WORKING_FILE).st_ino
+
+        file = BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS)
+        writer = file.__enter__()
+        writer.write(os.getrandom(200))
+        writer.flush()
+        file._append_file.close()
+
+        # the next append rolls back the interrupted one, then appends in place
+        with BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS) as f:
+            f.write(b"end")
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            result = f.read()
+
+        self.assertEqual(result, data + b"end")
+        self.assertEqual(os.stat(WORKING_FILE).st_ino, inode)
+
+    def _in_thread(self, target)->None:
+        # a deadlock fails the test instead of hanging the suite
+        errors = []
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        if errors:
+            raise errors[0]
+
+    def test_write_while_reading(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+
+        def nested():
+            with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as r:
+                with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS) as w:
+                    w.write(b"new")
+                # the reader keeps the previous container
+                self.assertEqual(r.read(), data)
+        self._in_thread(nested)
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            self.assertEqual(f.read(), b"new")
+
+    def test_append_while_reading(self):
+        data = os.getrandom(1000)
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS, chunk_size=64) as f:
+            f.write(data)
+
+        def nested():
+            with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as r:
+                with BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS) as w:
+                    w.write(b"end")
+                self.assertEqual(r.read(), data)
+        self._in_thread(nested)
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            self.assertEqual(f.read(), data + b"end")
+
+    def test_write_while_reading_in_other_thread(self):
+        with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS) as f:
+            f.write(b"Hello")
+
+        opened = threading.Event()
+        done = threading.Event()
+        def read():
+            with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as r:
+                opened.set()
+                done.wait(5)
+                self.assertEqual(r.read(), b"Hello")
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        opened.wait(5)
+
+        def write():
+            with BasicFile(WORKING_FILE, SECRET, "ab", ITERATIONS) as w:
+                w.write(b" world")
+            with BasicFile(WORKING_FILE, SECRET, "wb", ITERATIONS) as w:
+                w.write(b"Bye")
+        try:
+            self._in_thread(write)
+        finally:
+            done.set()
+            reader.join(5)
+
+        with BasicFile(WORKING_FILE, SECRET, "rb", ITERATIONS) as f:
+            self.assertEqual(f.read(), b"Bye")
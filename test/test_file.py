@@ -160,4 +160,16 @@ class TestFile(unittest.TestCase):
         
 
 
-    
\ No newline at end of file
+    
+    def test_rm_rollback_record(self):
+        file = File(SECRET, WORKING_DIR, ITERATIONS)
+        with file.open("foobar.txt", "w") as f:
+            f.write("test")
+        path = os.path.join(WORKING_DIR, file.get_hash("foobar.txt"))
+        # left by an interrupted append
+        with open(f"{path}.append", "wb") as f:
+            f.write(b"record")
+
+        file.rm("foobar.txt")
+
+        self.assertFalse(os.path.exists(f"{path}.append"))
@@ -4,8 +4,22 @@ import os
 import shutil
 import logging
 import os.path
+import json
+import base64
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
 
 from fernetfs.filesystem import FileSystem
+from fernetfs.listing import Listing, ListingDirectory, ListingFile
+from fernetfs.listinglock import ListingLock
+from fernetfs.masterconfiguration import MasterConfiguration
+from fernetfs.primitives import Primitives
+from fernetfs.stream import is_stream
+from fernetfs.tracer import HistogramTracer
 
 WORKING_DIR = "/tmp/test_directory"
 SECRET = b"secret"
@@ -32,6 +46,28 @@ class TestFileSystem(unittest.TestCase):
         fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
         fs.mount(SECRET, WORKING_DIR, ITERATIONS)
 
+    def test_mount_legacy_configuration(self):
+        # configurations written before the single key derivation are still mounted
+        salt = os.getrandom(FileSystem.SALT_LENGTH)
+        listing = Listing(SECRET, WORKING_DIR, MasterConfiguration.FILENAME, ITERATIONS, SALT)
+        listing.write({"salt": str(base64.urlsafe_b64encode(salt), "utf8"), "salt_size": SALT, "sub_iterations": ITERATIONS})
+
+        fs = FileSystem()
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        with fs.open("/test.txt", "w") as f:
+            f.write("legacy")
+
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        with fs.open("/test.txt", "r") as f:
+            self.assertEqual(f.read(), "legacy")
+
+    def test_mount_wrong_secret(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+
+        with self.assertRaises(InvalidTag):
+            fs.mount(b"wrong", WORKING_DIR, ITERATIONS)
+
     def test_miss_mount(self)->dict:
         fs = FileSystem()
 
@@ -228,3 +264,645 @@ class TestFileSystem(unittest.TestCase):
 
         expected = "test"
         self.assertEqual(results, expected)
+
+    def test_open_as_tmpsession(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.mkdir("/foobar")
+        fs.mkdir("/foobar/sub")
+        for path in ["/foobar/a.txt", "/foobar/sub/b.txt", "/c.txt", "/d.txt"]:
+            with fs.open(path, "w") as f:
+                f.write("read")
+
+        session = fs.open_as_tmpsession(["/foobar", "/c.txt"])
+        with session as directory:
+            results = sorted(os.path.relpath(os.path.join(root, name), directory) for root, _, names in os.walk(directory) for name in names)
+            with open(os.path.join(directory, "foobar/sub/b.txt"), "w") as f:
+                f.write("test")
+
+        self.assertEqual(results, ["c.txt", "foobar/a.txt", "foobar/sub/b.txt"])
+        with fs.open("/foobar/sub/b.txt", "r") as f:
+            self.assertEqual(f.read(), "test")
+        with fs.open("/foobar/a.txt", "r") as f:
+            self.assertEqual(f.read(), "read")
+
+    def test_stats(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        with fs.open("/test.txt", "wb") as f:
+            f.write(b"x" * 100)
+
+        fs.get_listing_cache().clear()
+        fs.reset_stats()
+        fs.ls("/")
+        first = fs.stats()
+        fs.reset_stats()
+        fs.ls("/")
+        second = fs.stats()
+
+        self.assertEqual(first["op_ls"], 1)
+        self.assertGreater(first["listing_reads"], 0)
+        # the listings come from the listing cache the second time, without any decryption
+        self.assertNotIn("listing_reads", second)
+        self.assertNotIn("chunks_decrypted", second)
+        self.assertEqual(second["listing_cache_hits"], first["listing_reads"])
+
+        fs.reset_stats()
+        with fs.open("/test.txt", "rb") as f:
+            f.read()
+        stats = fs.stats()
+
+        self.assertEqual(stats["files_read"], 1)
+        self.assertEqual(stats["bytes_decrypted"], 100)
+        self.assertEqual(stats["hkdf"], 1)
+
+    def test_stats_disabled(self):
+        fs = FileSystem(collect_stats=False)
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.mkdir("/foobar")
+        fs.ls("/")
+
+        self.assertEqual(fs.stats(), {})
+
+    def test_tracer(self):
+        tracer = HistogramTracer()
+        fs = FileSystem(tracer=tracer)
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.mkdir("/foobar")
+        with fs.open("/foobar/test.txt", "w") as f:
+            f.write("test")
+        fs.get_listing_cache().clear()
+        fs.ls("/foobar/test.txt")
+        fs.remove_file("/foobar/test.txt")
+        histograms = tracer.histograms()
+
+        for name in ["mount", "mkdir", "open", "ls", "remove_file", "kdf", "cipher", "io", "json", "encrypt", "decrypt"]:
+            self.assertGreater(histograms[name]["count"], 0, name)
+        self.assertIs(fs.get_tracer(), tracer)
+
+    def test_tracer_slow(self):
+        fs = FileSystem(tracer=HistogramTracer(0))
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+
+        with self.assertLogs("Tracer", "WARNING") as logs:
+            fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Slow mount", logs.output[0])
+        self.assertIn("kdf", logs.output[0])
+
+    def test_loggers(self):
+        before = len(logging.Logger.manager.loggerDict)
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        with fs.batch():
+            for i in range(10):
+                fs.mkdir(f"/d{i}")
+                for j in range(20):
+                    with fs.open(f"/d{i}/f{j}", "wb") as f:
+                        f.write(b"x")
+
+        fs.unmount()
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        for i in range(10):
+            for j in range(20):
+                with fs.open(f"/d{i}/f{j}", "rb") as f:
+                    f.read()
+
+        # the loggers are shared, files and directories don't add any to the logging module
+        self.assertEqual(len(logging.Logger.manager.loggerDict), before)
+
+    def test_unmount(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.get_key_cache().put(b"salt", b"key")
+        fs.unmount()
+
+        self.assertEqual(len(fs.get_key_cache()), 0)
+
+    def test_read_legacy_listing(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        legacy = ListingDirectory(fs._key, WORKING_DIR, ITERATIONS, SALT)
+        legacy.write(legacy.add("foobar", {}))
+        os.mkdir(os.path.join(WORKING_DIR, legacy.get()["foobar"]))
+
+        results = fs.ls("/")
+        expected = {"foobar": "d"}
+        self.assertDictEqual(results, expected)
+
+    def test_open_seek(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        data = os.getrandom(300000)
+        with fs.open("test.bin", "wb") as f:
+            f.write(data)
+
+        with fs.open("test.bin", "rb") as f:
+            f.seek(200000)
+            results = f.read(4096)
+
+        self.assertEqual(results, data[200000:204096])
+
+    def test_convert(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        legacy = Primitives(fs._key, ITERATIONS, SALT)
+        salt = legacy.create_salt()
+        encrypted = Fernet(legacy.secret_2_key(salt, fs._key)).encrypt(bytes(json.dumps({"test.txt": "a" * 64}), "utf8"))
+        with open(os.path.join(WORKING_DIR, ".files"), "w") as f:
+            f.write(json.dumps({"salt" : str(salt, "utf8"), "data" : str(encrypted, "utf8")}))
+
+        results = fs.convert()
+        self.assertEqual(results, 1)
+
+        with open(os.path.join(WORKING_DIR, ".files"), "rb") as f:
+            self.assertTrue(is_stream(f.read()))
+
+        self.assertDictEqual(fs.ls("/"), {"test.txt": "f"})
+        self.assertEqual(fs.convert(), 0)
+
+    def test_convert_tmp_and_lock(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        legacy = Primitives(fs._key, ITERATIONS, SALT)
+        salt = legacy.create_salt()
+        encrypted = Fernet(legacy.secret_2_key(salt, fs._key)).encrypt(bytes(json.dumps({"test.txt": "a" * 64}), "utf8"))
+        with open(os.path.join(WORKING_DIR, ".files"), "w") as f:
+            f.write(json.dumps({"salt" : str(salt, "utf8"), "data" : str(encrypted, "utf8")}))
+        # the temporary file of another writer
+        with open(os.path.join(WORKING_DIR, ".files.tmp"), "wb") as f:
+            f.write(b"other")
+
+        for_directory = ListingLock.for_directory
+        locked = []
+        def record(directory):
+            locked.append(directory)
+            return for_directory(directory)
+
+        with mock.patch.object(ListingLock, "for_directory", record):
+            self.assertEqual(fs.convert(), 1)
+
+        self.assertIn(WORKING_DIR, locked)
+        with open(os.path.join(WORKING_DIR, ".files.tmp"), "rb") as f:
+            self.assertEqual(f.read(), b"other")
+        self.assertEqual(glob(os.path.join(WORKING_DIR, ".files.*.tmp")), [])
+        self.assertDictEqual(fs.ls("/"), {"test.txt": "f"})
+
+    def test_listing_cache(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.mkdir("/foobar")
+        with fs.open("/foobar/test.txt", "w") as f:
+            f.write("demo")
+
+        fs.get_listing_cache().clear()
+        for _ in range(3):
+            with fs.open("/foobar/test.txt", "r") as f:
+                f.read()
+
+        self.assertGreater(fs.get_listing_cache().hits, fs.get_listing_cache().misses)
+
+    def test_resolution_cache(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        for path in ["a", "a/b", "a/b/c", "a/b/c/d", "a/b/c/d/e"]:
+            fs.mkdir(path)
+        with fs.open("a/b/c/d/e/file", "w") as f:
+            f.write("demo")
+
+        cache = fs.get_listing_cache()
+        lookups = cache.hits + cache.misses
+        for _ in range(5):
+            with fs.open("a/b/c/d/e/file", "r") as f:
+                f.read()
+
+        self.assertEqual(cache.hits + cache.misses - lookups, 5)
+
+    def test_resolution_cache_remove_directory(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.mkdir("foobar")
+        fs.mkdir("foobar/barfoo")
+        fs.is_directory_exist("foobar/barfoo/test")
+        fs.remove_directory("foobar", True)
+        fs.mkdir("foobar")
+
+        results = fs.is_directory_exist("foobar/barfoo")
+        self.assertFalse(results)
+
+    def test_batch(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        listing_path = os.path.join(WORKING_DIR, ".files")
+        with fs.batch():
+            fs.mkdir("foobar")
+            for i in range(10):
+                with fs.open(f"test{i}.txt", "w") as f:
+                    f.write(str(i))
+            fs.remove_file("test0.txt")
+
+            self.assertFalse(os.path.exists(listing_path))
+            self.assertTrue(fs.is_file_exist("test1.txt"))
+
+        self.assertTrue(os.path.exists(listing_path))
+        fs.get_listing_cache().clear()
+
+        results = fs.ls("/")
+        expected = {"foobar": "d"}
+        expected.update({f"test{i}.txt": "f" for i in range(1, 10)})
+        self.assertDictEqual(results, expected)
+
+        with fs.open("test9.txt", "r") as f:
+            self.assertEqual(f.read(), "9")
+
+    def test_batch_remove_all(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        with fs.batch():
+            with fs.open("test.txt", "w") as f:
+                f.write("demo")
+            fs.remove_file("test.txt")
+
+        self.assertDictEqual(fs.ls("/"), {})
+
+    def test_batch_other_process(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        with fs.open("seed", "w") as f:
+            f.write("seed")
+
+        context = multiprocessing.get_context("fork")
+        with fs.batch():
+            with fs.open("from_batch", "w") as f:
+                f.write("from_batch")
+            fs.mkdir("dir_batch")
+            fs.remove_file("seed")
+
+            process = context.Process(target=create_other)
+            process.start()
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        # the changes of the batch are applied to the listings written by the other process meanwhile
+        fs.get_listing_cache().clear()
+        expected = {"from_batch": "f", "from_other": "f", "dir_batch": "d", "dir_other": "d"}
+        self.assertDictEqual(fs.ls("/"), expected)
+        with fs.open("from_other", "r") as f:
+            self.assertEqual(f.read(), "from_other")
+
+    def test_journal_listings(self):
+        fs = FileSystem(journal_listings=True)
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        fs.mkdir("foobar")
+        for i in range(10):
+            with fs.open(f"foobar/test{i}.txt", "w") as f:
+                f.write(str(i))
+        fs.remove_file("foobar/test0.txt")
+
+        self.assertTrue(os.path.exists(os.path.join(WORKING_DIR, ".directories.journal")))
+
+        other = FileSystem()
+        other.mount(SECRET, WORKING_DIR, ITERATIONS)
+        expected = {f"test{i}.txt": "f" for i in range(1, 10)}
+        self.assertDictEqual(other.ls("/foobar/"), {"foobar": "d"})
+        self.assertDictEqual(other.ls("/foobar/x"), expected)
+
+        fs.compact("/")
+        fs.compact("/foobar/x")
+
+        names = [name for _, _, files in os.walk(WORKING_DIR) for name in files]
+        self.assertFalse(any(name.endswith(".journal") for name in names))
+        with other.open("foobar/test9.txt", "r") as f:
+            self.assertEqual(f.read(), "9")
+
+        fs.remove_directory("foobar", True)
+        self.assertDictEqual(fs.ls("/"), {})
+
+    def make_tree(self, fs:FileSystem)->None:
+        fs.mkdir("a")
+        fs.mkdir("a/b")
+        fs.mkdir("a/c")
+        fs.mkdir("d")
+        for path in ("root.txt", "a/a.txt", "a/b/b1.txt", "a/b/b2.txt", "d/d.txt"):
+            with fs.open(path, "w") as f:
+                f.write(path)
+
+    def test_walk(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        self.make_tree(fs)
+
+        results = list(fs.walk("/", workers=4))
+        expected = [
+            ("/", ["a", "d"], ["root.txt"]),
+            ("/a", ["b", "c"], ["a.txt"]),
+            ("/a/b", [], ["b1.txt", "b2.txt"]),
+            ("/a/c", [], []),
+            ("/d", [], ["d.txt"]),
+        ]
+        self.assertListEqual(results, expected)
+        self.assertListEqual(list(fs.walk("/", workers=1)), expected)
+        self.assertListEqual(list(fs.walk("a/", max_pending=1)), expected[1:4])
+
+    def test_walk_bottomup(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        self.make_tree(fs)
+
+        results = [dirpath for dirpath, _, _ in fs.walk("/", topdown=False)]
+
+        self.assertListEqual(results, ["/a/b", "/a/c", "/a", "/d", "/"])
+
+    def test_walk_prune(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        self.make_tree(fs)
+
+        results = []
+        for dirpath, dirnames, _ in fs.walk("/"):
+            results.append(dirpath)
+            if "a" in dirnames:
+                dirnames.remove("a")
+
+        self.assertListEqual(results, ["/", "/d"])
+
+    def test_walk_batch(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        with fs.batch():
+            self.make_tree(fs)
+            results = [dirpath for dirpath, _, _ in fs.walk("/")]
+
+        self.assertListEqual(results, ["/", "/a", "/a/b", "/a/c", "/d"])
+
+    def make_source(self)->str:
+        source = "/tmp/test_source"
+        os.mkdir(source)
+        self.addCleanup(shutil.rmtree, source)
+
+        os.makedirs(os.path.join(source, "a", "b"))
+        os.mkdir(os.path.join(source, "empty"))
+        for path, size in (("root.txt", 10), ("a/a.bin", 200000), ("a/b/b.txt", 0)):
+            with open(os.path.join(source, path), "wb") as f:
+                f.write(os.urandom(size))
+
+        return source
+
+    def test_import_tree(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        source = self.make_source()
+        fs.mkdir("import")
+
+        reports = []
+        stats = fs.import_tree(source, "/import", workers=4, progress=reports.append)
+
+        self.assertEqual(stats["directories"], 3)
+        self.assertEqual(stats["files"], 3)
+        self.assertEqual(stats["bytes"], 200010)
+        self.assertEqual(reports[-1]["files"], 3)
+
+        walked = [(dirpath, sorted(dirnames), filenames) for dirpath, dirnames, filenames in fs.walk("/import")]
+        expected = [
+            ("/import", ["a", "empty"], ["root.txt"]),
+            ("/import/a", ["b"], ["a.bin"]),
+            ("/import/a/b", [], ["b.txt"]),
+            ("/import/empty", [], []),
+        ]
+        self.assertListEqual(sorted(walked), expected)
+
+        for path in ("root.txt", "a/a.bin", "a/b/b.txt"):
+            with open(os.path.join(source, path), "rb") as f:
+                expected = f.read()
+            with fs.open(f"/import/{path}", "rb") as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_import_tree_bounded(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        source = self.make_source()
+        for i in range(10):
+            with open(os.path.join(source, f"file{i}.txt"), "w") as f:
+                f.write(str(i))
+
+        fs.import_tree(source, workers=2, max_pending=3)
+        stats = fs.import_tree(source, workers=2, max_pending=3)
+
+        self.assertEqual(stats["directories"], 0)
+        self.assertEqual(stats["files"], 13)
+        self.assertEqual(len(fs.ls("/")), 13)
+        with fs.open("file7.txt", "r") as f:
+            self.assertEqual(f.read(), "7")
+
+    def test_export_tree(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        source = self.make_source()
+        fs.import_tree(source)
+
+        destination = "/tmp/test_export"
+        self.addCleanup(shutil.rmtree, destination, True)
+        stats = fs.export_tree("/a", destination, workers=4, max_pending=1)
+
+        self.assertEqual(stats["directories"], 2)
+        self.assertEqual(stats["files"], 2)
+        self.assertEqual(stats["bytes"], 200000)
+        for path in ("a.bin", "b/b.txt"):
+            with open(os.path.join(source, "a", path), "rb") as f:
+                expected = f.read()
+            with open(os.path.join(destination, path), "rb") as f:
+                self.assertEqual(f.read(), expected)
+
+        fs.export_tree("/", destination)
+        self.assertTrue(os.path.isdir(os.path.join(destination, "empty")))
+        self.assertTrue(os.path.isfile(os.path.join(destination, "a", "b", "b.txt")))
+
+    def test_export_tree_tmp_names(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        expected = {}
+        with fs.batch():
+            for i in range(50):
+                for name, size in ((f"f{i}", 1000 + i), (f"f{i}.tmp", 50000 + i)):
+                    expected[name] = os.getrandom(size)
+                    with fs.open(name, "wb") as f:
+                        f.write(expected[name])
+
+        destination = "/tmp/test_export"
+        self.addCleanup(shutil.rmtree, destination, True)
+        stats = fs.export_tree("/", destination, workers=8)
+
+        self.assertEqual(stats["files"], 100)
+        self.assertEqual(sorted(os.listdir(destination)), sorted(expected))
+        for name, data in expected.items():
+            with open(os.path.join(destination, name), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_export_tree_errors(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        for i in range(3):
+            with fs.open(f"file{i}.txt", "w") as f:
+                f.write(str(i))
+        hash_name = ListingFile(fs._key, WORKING_DIR, ITERATIONS, SALT).lookup("file1.txt")
+        with open(os.path.join(WORKING_DIR, hash_name), "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)[0]
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last ^ 0xff]))
+
+        destination = "/tmp/test_export"
+        self.addCleanup(shutil.rmtree, destination, True)
+        with self.assertRaises(Exception):
+            fs.export_tree("/", destination)
+
+        stats = fs.export_tree("/", destination, ignore_errors=True)
+
+        self.assertEqual(stats["files"], 2)
+        self.assertEqual([path for path, _ in stats["errors"]], ["/file1.txt"])
+        self.assertEqual(sorted(os.listdir(destination)), ["file0.txt", "file2.txt"])
+
+    def test_threads_same_directory(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        fs.mkdir("shared")
+
+        def create(worker):
+            for i in range(25):
+                with fs.open(f"shared/{worker}-{i}.txt", "w") as f:
+                    f.write(f"{worker}-{i}")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(create, range(8)))
+
+        expected = {f"{worker}-{i}.txt": "f" for worker in range(8) for i in range(25)}
+        self.assertDictEqual(fs.ls("/shared/x"), expected)
+        fs.get_listing_cache().clear()
+        self.assertDictEqual(fs.ls("/shared/x"), expected)
+
+    def test_threads_directories(self):
+        fs = FileSystem(journal_listings=True)
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        def work(worker):
+            fs.mkdir(f"dir{worker}")
+            for i in range(20):
+                fs.mkdir(f"dir{worker}/sub{i}")
+                with fs.open(f"dir{worker}/sub{i}/file.txt", "w") as f:
+                    f.write(str(i))
+            fs.remove_directory(f"dir{worker}/sub0", True)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(8)))
+
+        self.assertEqual(len(fs.ls("/")), 8)
+        walked = list(fs.walk("/"))
+        self.assertEqual(len(walked), 1 + 8 + 8 * 19)
+        self.assertTrue(all(filenames == ["file.txt"] for _, dirnames, filenames in walked if not dirnames))
+
+    def test_threads_mkdir_same_name(self):
+        fs = FileSystem()
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+        def mkdir(_):
+            try:
+                fs.mkdir("foobar")
+                return True
+            except OSError:
+                return False
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(mkdir, range(8)))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(len([name for name in os.listdir(WORKING_DIR) if not name.startswith(".")]), 1)
+
+    def run_processes(self, journal_listings:bool):
+        fs = FileSystem(journal_listings=journal_listings)
+        fs.create(SECRET, WORKING_DIR, ITERATIONS, SALT, ITERATIONS)
+        fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+        fs.mkdir("shared")
+
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=create_files, args=(worker, 20, journal_listings)) for worker in range(6)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertTrue(all(process.exitcode == 0 for process in processes))
+        expected = {f"{worker}-{i}.txt": "f" for worker in range(6) for i in range(20)}
+        self.assertDictEqual(fs.ls("/shared/x"), expected)
+        expected = {f"dir{worker}": "d" for worker in range(6)}
+        expected["shared"] = "d"
+        self.assertDictEqual(fs.ls("/"), expected)
+        with fs.open("shared/5-19.txt", "r") as f:
+            self.assertEqual(f.read(), "5-19")
+
+    def test_processes(self):
+        self.run_processes(False)
+
+    def test_processes_journal(self):
+        self.run_processes(True)
+
+def create_files(worker:int, count:int, journal_listings:bool):
+    fs = FileSystem(journal_listings=journal_listings)
+    fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+    for i in range(count):
+        with fs.open(f"shared/{worker}-{i}.txt", "w") as f:
+            f.write(f"{worker}-{i}")
+    fs.mkdir(f"dir{worker}")
+
+def create_other():
+    fs = FileSystem()
+    fs.mount(SECRET, WORKING_DIR, ITERATIONS)
+
+    with fs.open("from_other", "w") as f:
+        f.write("from_other")
+    fs.mkdir("dir_other")
@@ -0,0 +1,50 @@
+import unittest
+
+from fernetfs.keycache import KeyCache
+
+class TestKeyCache(unittest.TestCase):
+    def test_miss(self):
+        cache = KeyCache(2)
+
+        result = cache.get(b"salt")
+
+        self.assertIsNone(result)
+        self.assertEqual(cache.misses, 1)
+
+    def test_hit(self):
+        cache = KeyCache(2)
+
+        cache.put(b"salt", b"key")
+        result = cache.get(b"salt")
+
+        self.assertEqual(result, b"key")
+        self.assertEqual(cache.hits, 1)
+
+    def test_eviction(self):
+        cache = KeyCache(2)
+
+        cache.put(b"salt1", b"key1")
+        cache.put(b"salt2", b"key2")
+        cache.get(b"salt1")
+        cache.put(b"salt3", b"key3")
+
+        self.assertIsNone(cache.get(b"salt2"))
+        self.assertEqual(cache.get(b"salt1"), b"key1")
+        self.assertEqual(cache.get(b"salt3"), b"key3")
+
+    def test_disabled(self):
+        cache = KeyCache(0)
+
+        cache.put(b"salt", b"key")
+
+        self.assertEqual(len(cache), 0)
+
+    def test_clear(self):
+        cache = KeyCache(2)
+
+        cache.put(b"salt", b"key")
+        cache.get(b"salt")
+        cache.clear()
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
@@ -1,10 +1,13 @@
 import unittest
 import os
 import shutil
+import json
 import logging
 import os.path
+from unittest import mock
 
-from fernetfs.listing import ListingDirectory
+from fernetfs.listing import Listing, ListingDirectory, ListingFile
+from fernetfs.listingcache import ListingCache
 
 WORKING_DIR = "/tmp/test_directory"
 SECRET = b"secret"
@@ -60,3 +63,296 @@ class TestFile(unittest.TestCase):
         expected = ["key", "foobar"]
         self.assertListEqual(result, expected)
     
+
+class TestShardedListing(unittest.TestCase):
+    def setUp(self) -> None:
+        os.mkdir(WORKING_DIR)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(WORKING_DIR)
+
+    def new_listing(self)->ListingFile:
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS)
+        listing.SHARD_THRESHOLD = 20
+        listing.PAGE_SIZE = 8
+        return listing
+
+    def test_insert_lookup(self):
+        listing = self.new_listing()
+
+        listing.insert("foobar", "value")
+        result = listing.lookup("foobar")
+
+        self.assertEqual(result, "value")
+        self.assertFalse(listing.is_sharded())
+
+    def test_shard(self):
+        listing = self.new_listing()
+
+        for i in range(200):
+            listing.insert(f"file{i}", f"value{i}")
+
+        self.assertTrue(listing.is_sharded())
+        self.assertFalse(os.path.exists(os.path.join(WORKING_DIR, ".files")))
+        for i in range(200):
+            self.assertEqual(listing.lookup(f"file{i}"), f"value{i}")
+        self.assertIsNone(listing.lookup("missing"))
+        self.assertEqual(sorted(listing.keys()), sorted(f"file{i}" for i in range(200)))
+
+    def test_shard_in_batch(self):
+        cache = ListingCache()
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, listing_cache=cache)
+        listing.SHARD_THRESHOLD = 20
+        listing.PAGE_SIZE = 8
+        events = []
+        replace = os.replace
+        remove = os.remove
+
+        def record_replace(source, destination):
+            events.append(("write", os.path.basename(destination)))
+            replace(source, destination)
+
+        def record_remove(path):
+            events.append(("remove", os.path.basename(path)))
+            remove(path)
+
+        for i in range(10):
+            listing.insert(f"file{i}", f"value{i}")
+
+        cache.begin_batch()
+        for i in range(10, 30):
+            listing.insert(f"file{i}", f"value{i}")
+        with mock.patch("os.replace", record_replace), mock.patch("os.remove", record_remove):
+            cache.end_batch()
+
+        # the flat listing is removed last, once the pages and their index are written
+        self.assertEqual(events[-2:], [("write", ".files.index"), ("remove", ".files")])
+        self.assertNotIn(("remove", ".files"), events[:-1])
+        self.assertEqual(sorted(listing.keys()), sorted(f"file{i}" for i in range(30)))
+
+    def test_batch_failed_write(self):
+        cache = ListingCache()
+        listings = [ListingFile(SECRET, os.path.join(WORKING_DIR, str(i)), ITERATIONS, listing_cache=cache) for i in range(3)]
+        for i in (0, 2):
+            os.mkdir(os.path.join(WORKING_DIR, str(i)))
+
+        cache.begin_batch()
+        for listing in listings:
+            listing.insert("key", "value")
+        # the directory of the second listing doesn't exist, its write fails
+        with self.assertRaises(FileNotFoundError):
+            cache.end_batch()
+
+        self.assertEqual(listings[0].lookup("key"), "value")
+        self.assertEqual(listings[2].lookup("key"), "value")
+
+    def test_page_size(self):
+        listing = self.new_listing()
+
+        for i in range(200):
+            listing.insert(f"file{i}", f"value{i}")
+
+        pages = [name for name in os.listdir(WORKING_DIR) if name[len(".files."):].isdigit()]
+        sizes = [len(Listing(SECRET, WORKING_DIR, name, ITERATIONS).read()) for name in pages]
+        self.assertGreater(len(pages), 200 // 8)
+        self.assertLessEqual(max(sizes), 2 * 8)
+
+    def test_discard_all(self):
+        listing = self.new_listing()
+
+        for i in range(100):
+            listing.insert(f"file{i}", f"value{i}")
+        for i in range(100):
+            self.assertTrue(listing.discard(f"file{i}"))
+
+        self.assertFalse(listing.discard("file0"))
+        self.assertEqual(listing.keys(), [])
+        self.assertEqual(os.listdir(WORKING_DIR), [])
+
+    def test_merge_reads_changed_pages(self):
+        listing = self.new_listing()
+        for i in range(200):
+            listing.insert(f"file{i}", f"value{i}")
+        paths = []
+        read = Listing.read
+
+        def record_read(page):
+            paths.append(os.path.basename(page._path))
+            return read(page)
+
+        with mock.patch.object(Listing, "read", record_read):
+            listing.merge({"file0": None, "new": "value"})
+
+        pages = [path for path in paths if path[len(".files."):].isdigit()]
+        self.assertLessEqual(len(set(pages)), 2)
+        self.assertIsNone(listing.lookup("file0"))
+        self.assertEqual(listing.lookup("new"), "value")
+
+    def test_merge_grows(self):
+        listing = self.new_listing()
+        for i in range(30):
+            listing.insert(f"file{i}", f"value{i}")
+
+        listing.merge({f"new{i}": "value" for i in range(300)})
+
+        pages = [name for name in os.listdir(WORKING_DIR) if name[len(".files."):].isdigit()]
+        sizes = [len(Listing(SECRET, WORKING_DIR, name, ITERATIONS).read()) for name in pages]
+        self.assertLessEqual(max(sizes), 8)
+        self.assertEqual(len(listing.keys()), 330)
+
+    def test_merge_discard_all(self):
+        listing = self.new_listing()
+        for i in range(100):
+            listing.insert(f"file{i}", f"value{i}")
+
+        listing.merge({f"file{i}": None for i in range(50)})
+        self.assertTrue(listing.is_sharded())
+        listing.merge({f"file{i}": None for i in range(50, 100)})
+
+        self.assertEqual(listing.keys(), [])
+        self.assertEqual(os.listdir(WORKING_DIR), [])
+
+    def test_migrate_flat(self):
+        flat = ListingFile(SECRET, WORKING_DIR, ITERATIONS)
+        flat.write({f"file{i}": f"value{i}" for i in range(50)})
+        listing = self.new_listing()
+
+        listing.shard()
+
+        self.assertTrue(listing.is_sharded())
+        self.assertEqual(listing.lookup("file42"), "value42")
+
+class TestJournaledListing(unittest.TestCase):
+    def setUp(self) -> None:
+        os.mkdir(WORKING_DIR)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(WORKING_DIR)
+
+    def new_listing(self, journal:bool=True)->ListingFile:
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, journal=journal)
+        listing.JOURNAL_THRESHOLD = 10
+        return listing
+
+    def test_insert_appends(self):
+        listing = self.new_listing()
+        listing.insert("base", "value")
+        listing.compact()
+
+        listing.insert("foobar", "value")
+        listing.insert("base", "other")
+
+        self.assertTrue(os.path.exists(os.path.join(WORKING_DIR, ".files.journal")))
+        self.assertEqual(Listing(SECRET, WORKING_DIR, ".files", ITERATIONS).read(), {"base": "value"})
+        self.assertEqual(listing.lookup("foobar"), "value")
+        self.assertEqual(listing.lookup("base"), "other")
+        self.assertEqual(listing.keys(), ["base", "foobar"])
+
+    def test_replay_by_other_reader(self):
+        listing = self.new_listing()
+        listing.insert("base", "value")
+        listing.compact()
+        listing.insert("foobar", "value")
+        listing.discard("base")
+
+        reader = self.new_listing(False)
+
+        self.assertIsNone(reader.lookup("base"))
+        self.assertEqual(reader.keys(), ["foobar"])
+
+    def test_discard(self):
+        listing = self.new_listing()
+        listing.insert("foobar", "value")
+        listing.insert("other", "value")
+
+        self.assertTrue(listing.discard("foobar"))
+        self.assertFalse(listing.discard("foobar"))
+        self.assertIsNone(listing.lookup("foobar"))
+        self.assertEqual(listing.keys(), ["other"])
+
+    def test_discard_all_removes_journal(self):
+        listing = self.new_listing()
+        listing.insert("foobar", "value")
+        listing.discard("foobar")
+
+        self.assertEqual(os.listdir(WORKING_DIR), [])
+
+    def test_compact(self):
+        listing = self.new_listing()
+        for i in range(5):
+            listing.insert(f"file{i}", f"value{i}")
+        listing.discard("file0")
+
+        listing.compact()
+
+        self.assertFalse(os.path.exists(os.path.join(WORKING_DIR, ".files.journal")))
+        expected = {f"file{i}": f"value{i}" for i in range(1, 5)}
+        self.assertEqual(Listing(SECRET, WORKING_DIR, ".files", ITERATIONS).read(), expected)
+
+    def test_automatic_compaction(self):
+        listing = self.new_listing()
+        for i in range(25):
+            listing.insert(f"file{i}", f"value{i}")
+
+        snapshot = Listing(SECRET, WORKING_DIR, ".files", ITERATIONS).read()
+        self.assertEqual(len(snapshot), 20)
+        self.assertEqual(len(listing.keys()), 25)
+
+    def test_torn_record(self):
+        listing = self.new_listing()
+        listing.insert("foobar", "value")
+        with open(os.path.join(WORKING_DIR, ".files.journal"), "ab") as f:
+            f.write(b"\x00\x00\x01\x00garbage")
+
+        reader = self.new_listing()
+        self.assertEqual(reader.keys(), ["foobar"])
+        reader.insert("other", "value")
+
+        self.assertEqual(self.new_listing().keys(), ["foobar", "other"])
+
+    def test_journal_recreated_by_other(self):
+        listing = self.new_listing()
+        for i in range(3):
+            listing.insert(f"file{i}", "value")
+        self.assertEqual(len(listing.keys()), 3)
+
+        # another mount compacts and starts a new journal, which lands on the same inode
+        path = os.path.join(WORKING_DIR, ".files.journal")
+        kept = os.path.join(WORKING_DIR, "kept")
+        os.link(path, kept)
+        other = self.new_listing()
+        other.compact()
+        for i in range(5):
+            other.insert(f"other{i}", "value")
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(kept, "r+b") as f:
+            f.write(data)
+        os.replace(kept, path)
+
+        expected = [f"file{i}" for i in range(3)] + [f"other{i}" for i in range(5)]
+        self.assertEqual(sorted(listing.keys()), expected)
+        listing.insert("last", "value")
+        self.assertEqual(sorted(self.new_listing().keys()), sorted(expected + ["last"]))
+
+    def test_legacy_journal(self):
+        listing = self.new_listing()
+        record = listing._primitives.encrypt(bytes(json.dumps(["foobar", "value"]), "utf8"))
+        with open(os.path.join(WORKING_DIR, ".files.journal"), "wb") as f:
+            f.write(len(record).to_bytes(4, "big") + record)
+
+        self.assertEqual(listing.keys(), ["foobar"])
+        listing.insert("other", "value")
+        self.assertEqual(self.new_listing().keys(), ["foobar", "other"])
+
+    def test_flat_writer_folds_journal(self):
+        listing = self.new_listing()
+        listing.insert("foobar", "value")
+        listing.discard("foobar")
+        listing.insert("foobar", "new")
+
+        writer = self.new_listing(False)
+        writer.discard("foobar")
+
+        self.assertFalse(os.path.exists(os.path.join(WORKING_DIR, ".files.journal")))
+        self.assertEqual(writer.keys(), [])
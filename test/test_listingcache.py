@@ -0,0 +1,110 @@
+import unittest
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fernetfs.listing import ListingFile
+from fernetfs.listingcache import ListingCache
+
+WORKING_DIR = "/tmp/test_directory"
+SECRET = b"secret"
+ITERATIONS = 100
+
+class TestListingCache(unittest.TestCase):
+    def setUp(self) -> None:
+        os.mkdir(WORKING_DIR)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(WORKING_DIR)
+
+    def test_hit(self):
+        cache = ListingCache()
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, listing_cache=cache)
+
+        listing.write({"key":"value"})
+        result = listing.read()
+
+        self.assertEqual(result, {"key":"value"})
+        self.assertEqual(cache.hits, 1)
+
+    def test_copy(self):
+        cache = ListingCache()
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, listing_cache=cache)
+
+        listing.write({"key":"value"})
+        listing.read()["other"] = "value"
+        result = listing.read()
+
+        self.assertEqual(result, {"key":"value"})
+
+    def test_other_writer(self):
+        cache = ListingCache()
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, listing_cache=cache)
+        other = ListingFile(SECRET, WORKING_DIR, ITERATIONS)
+
+        listing.write({"key":"value"})
+        other.write({"key":"value", "other":"value"})
+        result = listing.read()
+
+        self.assertEqual(result, {"key":"value", "other":"value"})
+        self.assertEqual(cache.hits, 0)
+
+    def test_remove(self):
+        cache = ListingCache()
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, listing_cache=cache)
+
+        listing.write({"key":"value"})
+        listing.remove()
+
+        self.assertEqual(listing.get(), {})
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        path = os.path.join(WORKING_DIR, "listing")
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        stat = os.stat(path)
+        cache = ListingCache(25)
+
+        cache.put("a", {}, stat)
+        cache.put("b", {}, stat)
+        cache.put("c", {}, stat)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a"))
+
+    def test_batch_per_thread(self):
+        cache = ListingCache()
+        listing = ListingFile(SECRET, WORKING_DIR, ITERATIONS, listing_cache=cache)
+        listing.insert("key", "value")
+
+        cache.begin_batch()
+        listing.insert("key", "staged")
+        other = []
+        thread = threading.Thread(target=lambda: other.append((cache.in_batch(), listing.items())))
+        thread.start()
+        thread.join()
+        self.assertEqual(listing.items(), {"key":"staged"})
+        cache.end_batch()
+
+        self.assertEqual(other, [(False, {"key":"value"})])
+        self.assertEqual(listing.items(), {"key":"staged"})
+
+    def test_threads(self):
+        cache = ListingCache(4096)
+        listings = [ListingFile(SECRET, os.path.join(WORKING_DIR, str(i)), ITERATIONS, listing_cache=cache) for i in range(16)]
+        for i, listing in enumerate(listings):
+            os.mkdir(os.path.join(WORKING_DIR, str(i)))
+            listing.write({"key": str(i)})
+
+        def read(i):
+            for _ in range(50):
+                if listings[i % 16].read() != {"key": str(i % 16)}:
+                    return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(read, range(64)))
+
+        self.assertTrue(all(results))
@@ -0,0 +1,61 @@
+import unittest
+import os
+import shutil
+import fcntl
+import multiprocessing
+
+from fernetfs.listinglock import ListingLock
+
+WORKING_DIR = "/tmp/test_directory"
+
+def try_lock(exclusive:bool)->bool:
+    fd = os.open(WORKING_DIR, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(fd)
+
+class TestListingLock(unittest.TestCase):
+    def setUp(self) -> None:
+        os.mkdir(WORKING_DIR)
+        self.pool = multiprocessing.get_context("fork").Pool(1)
+
+    def tearDown(self) -> None:
+        self.pool.terminate()
+        shutil.rmtree(WORKING_DIR)
+
+    def test_same_lock(self):
+        lock = ListingLock.for_directory(WORKING_DIR)
+
+        self.assertIs(ListingLock.for_directory(WORKING_DIR), lock)
+
+    def test_exclusive(self):
+        with ListingLock.for_directory(WORKING_DIR):
+            self.assertFalse(self.pool.apply(try_lock, (False,)))
+
+        self.assertTrue(self.pool.apply(try_lock, (True,)))
+
+    def test_shared(self):
+        with ListingLock.for_directory(WORKING_DIR).shared():
+            self.assertTrue(self.pool.apply(try_lock, (False,)))
+            self.assertFalse(self.pool.apply(try_lock, (True,)))
+
+    def test_upgrade(self):
+        lock = ListingLock.for_directory(WORKING_DIR)
+
+        with lock.shared():
+            with lock:
+                self.assertFalse(self.pool.apply(try_lock, (False,)))
+            # the lock is kept exclusive until the outermost release
+            self.assertFalse(self.pool.apply(try_lock, (False,)))
+
+        self.assertTrue(self.pool.apply(try_lock, (True,)))
+
+    def test_removed_directory(self):
+        lock = ListingLock.for_directory(os.path.join(WORKING_DIR, "missing"))
+
+        with lock:
+            pass
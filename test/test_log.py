@@ -0,0 +1,53 @@
+import unittest
+import logging
+
+from fernetfs.log import ContextLogger
+
+class Counted:
+    def __init__(self) -> None:
+        self.formatted = 0
+
+    def __str__(self) -> str:
+        self.formatted += 1
+        return "counted"
+
+class TestContextLogger(unittest.TestCase):
+    def setUp(self) -> None:
+        self.logger = logging.getLogger("TestContextLogger")
+        self.logger.setLevel(logging.DEBUG)
+
+    def test_context(self):
+        log = ContextLogger(self.logger, "/tmp/a%sb")
+
+        with self.assertLogs(self.logger, "DEBUG") as logs:
+            log.debug("Read %d entries", 3)
+            log.debug("Open with r")
+
+        self.assertEqual([record.getMessage() for record in logs.records], ["/tmp/a%sb : Read 3 entries", "/tmp/a%sb : Open with r"])
+
+    def test_caller(self):
+        log = ContextLogger(self.logger, "/tmp")
+
+        with self.assertLogs(self.logger, "DEBUG") as logs:
+            log.debug("here")
+
+        self.assertEqual(logs.records[0].funcName, "test_caller")
+
+    def test_lazy(self):
+        log = ContextLogger(self.logger, Counted())
+        argument = Counted()
+        self.logger.setLevel(logging.INFO)
+
+        log.debug("%s", argument)
+
+        self.assertEqual(log.context.formatted, 0)
+        self.assertEqual(argument.formatted, 0)
+
+    def test_no_logger_by_context(self):
+        self.logger.setLevel(logging.INFO)
+        before = len(logging.Logger.manager.loggerDict)
+
+        for i in range(100000):
+            ContextLogger(self.logger, f"/tmp/{i}").debug("Open with r")
+
+        self.assertEqual(len(logging.Logger.manager.loggerDict), before)
@@ -3,8 +3,15 @@ import os
 import shutil
 import logging
 import os.path
+import base64
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 from fernetfs.masterconfiguration import MasterConfiguration
+from fernetfs.listing import Listing
+from fernetfs.stats import Stats
 
 WORKING_DIR = "/tmp/test_directory"
 SECRET = b"secret"
@@ -29,7 +36,7 @@ class TestMasterConfiguration(unittest.TestCase):
 
         conf.create(SECRET, WORKING_DIR, ITERATIONS)
         results = list(conf.get(SECRET, WORKING_DIR, ITERATIONS).keys())
-        expected = ["salt", "salt_size", "sub_iterations"]
+        expected = ["salt", "salt_size", "sub_iterations", "key"]
 
         self.assertListEqual(results, expected)
 
@@ -42,3 +49,40 @@ class TestMasterConfiguration(unittest.TestCase):
             self.assertTrue(False)
         except:
             pass
+
+    def test_get_single_kdf(self):
+        conf = MasterConfiguration()
+        stats = Stats()
+
+        conf.create(SECRET, WORKING_DIR, ITERATIONS, 16, 1000)
+        results = conf.get(SECRET, WORKING_DIR, ITERATIONS, stats=stats)
+
+        self.assertEqual(results["salt_size"], 16)
+        self.assertEqual(results["sub_iterations"], 1000)
+        self.assertEqual(len(results["key"]), 256)
+        self.assertEqual(results["key"], conf.get(SECRET, WORKING_DIR, ITERATIONS)["key"])
+        # the password is stretched once, to check it and to get the master key
+        self.assertEqual(stats.snapshot()["pbkdf2"], 1)
+
+    def test_get_wrong_secret(self):
+        conf = MasterConfiguration()
+
+        conf.create(SECRET, WORKING_DIR, ITERATIONS)
+
+        with self.assertRaises(InvalidTag):
+            conf.get(b"wrong", WORKING_DIR, ITERATIONS)
+
+    def test_get_legacy(self):
+        conf = MasterConfiguration()
+        salt = os.getrandom(128)
+        listing = Listing(SECRET, WORKING_DIR, MasterConfiguration.FILENAME, ITERATIONS)
+        listing.write({"salt": str(base64.urlsafe_b64encode(salt), "utf8"), "salt_size": 16, "sub_iterations": 1000})
+        stats = Stats()
+
+        results = conf.get(SECRET, WORKING_DIR, ITERATIONS, stats=stats)
+
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=256, salt=salt, iterations=ITERATIONS)
+        self.assertEqual(results["key"], kdf.derive(SECRET))
+        self.assertEqual(results["salt"], salt)
+        self.assertEqual(results["sub_iterations"], 1000)
+        self.assertEqual(stats.snapshot()["pbkdf2"], 2)
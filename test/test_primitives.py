@@ -2,8 +2,13 @@ import unittest
 import os
 from contextlib import suppress
 import logging 
+import json
+
+from cryptography.fernet import Fernet
 
 from fernetfs.primitives import Primitives
+from fernetfs.stream import MAGIC
+from fernetfs.keycache import KeyCache
 
 WORKING_FILE = "/tmp/test.x"
 PLAIN_FILE = "/tmp/test.bin"
@@ -12,6 +17,12 @@ ITERATIONS = 100
 
 #logging.basicConfig(level=logging.DEBUG)
 
+def legacy_encrypt(data:bytes)->str:
+    primitives = Primitives(SECRET, ITERATIONS)
+    salt = primitives.create_salt()
+    encrypted = Fernet(primitives.secret_2_key(salt, SECRET)).encrypt(data)
+    return json.dumps({"salt" : str(salt, "utf8"), "data" : str(encrypted, "utf8")}, indent=4)
+
 class TestPrimitives(unittest.TestCase):
     def tearDown(self) -> None:
         with suppress(FileNotFoundError):
@@ -27,6 +38,56 @@ class TestPrimitives(unittest.TestCase):
 
         self.assertEqual(result, expected)
 
+    def test_encrypt_decrypt_key_cache(self):
+        cache = KeyCache()
+        fp = Primitives(SECRET, ITERATIONS, key_cache=cache)
+        encrypted = fp.encrypt(b"hello")
+        fp.decrypt(encrypted)
+        result = fp.decrypt(encrypted)
+        expected = b"hello"
+
+        self.assertEqual(result, expected)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+
+    def test_encrypt_decrypt_hkdf(self):
+        fp = Primitives(SECRET, ITERATIONS, version=Primitives.VERSION_HKDF)
+        encrypted = fp.encrypt(b"hello")
+        result = fp.decrypt(encrypted)
+        expected = b"hello"
+
+        self.assertEqual(result, expected)
+
+    def test_decrypt_legacy_with_hkdf(self):
+        legacy = Primitives(SECRET, ITERATIONS)
+        encrypted = legacy.encrypt(b"hello")
+        fp = Primitives(SECRET, ITERATIONS, version=Primitives.VERSION_HKDF)
+        result = fp.decrypt(encrypted)
+        expected = b"hello"
+
+        self.assertEqual(result, expected)
+
+    def test_encrypt_binary(self):
+        fp = Primitives(SECRET, ITERATIONS)
+        encrypted = fp.encrypt(b"hello")
+
+        self.assertTrue(encrypted.startswith(MAGIC))
+
+    def test_decrypt_memoryview(self):
+        fp = Primitives(SECRET, ITERATIONS)
+        encrypted = bytearray(fp.encrypt(b"hello"))
+        result = fp.decrypt(memoryview(encrypted))
+        expected = b"hello"
+
+        self.assertEqual(result, expected)
+
+    def test_decrypt_legacy_json(self):
+        fp = Primitives(SECRET, ITERATIONS)
+        result = fp.decrypt(legacy_encrypt(b"hello"))
+        expected = b"hello"
+
+        self.assertEqual(result, expected)
+
     def test_encrypt_decrypt_file(self):
         with open(PLAIN_FILE, "wb") as f:
             f.write(b"hello")
@@ -0,0 +1,50 @@
+import unittest
+import threading
+
+from fernetfs.stats import Stats
+
+class TestStats(unittest.TestCase):
+    def test_add(self):
+        stats = Stats()
+
+        stats.add("a")
+        stats.add("a")
+        stats.add("b", 10)
+
+        self.assertEqual(stats.snapshot(), {"a": 2, "b": 10})
+
+    def test_disabled(self):
+        stats = Stats(False)
+
+        stats.add("a")
+
+        self.assertEqual(stats.snapshot(), {})
+
+    def test_reset(self):
+        stats = Stats()
+        stats.add("a")
+
+        stats.reset()
+        stats.add("b")
+
+        self.assertEqual(stats.snapshot(), {"b": 1})
+
+    def test_threads(self):
+        stats = Stats()
+        barrier = threading.Barrier(4)
+
+        def count():
+            barrier.wait()
+            for _ in range(1000):
+                stats.add("a")
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats.add("a")
+
+        # the counters of the ended threads are kept
+        self.assertEqual(stats.snapshot(), {"a": 4001})
+        self.assertEqual(len(stats._threads), 1)
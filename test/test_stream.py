@@ -0,0 +1,241 @@
+import unittest
+import os
+import io
+from contextlib import suppress
+from unittest.mock import patch
+
+from fernetfs.primitives import Primitives
+from fernetfs.stream import StreamReader, StreamWriter, StreamError, CHUNK_OVERHEAD
+
+WORKING_FILE = "/tmp/test.x"
+SECRET = b"secret"
+ITERATIONS = 100
+CHUNK_SIZE = 16
+
+class TestStream(unittest.TestCase):
+    def setUp(self) -> None:
+        self._primitives = Primitives(SECRET, ITERATIONS)
+
+    def tearDown(self) -> None:
+        with suppress(FileNotFoundError):
+            os.remove(WORKING_FILE)
+
+    def write(self, data:bytes)->None:
+        with StreamWriter(open(WORKING_FILE, "wb"), self._primitives, CHUNK_SIZE) as writer:
+            writer.write(data)
+
+    def read(self)->bytes:
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            return reader.read()
+
+    def chunks(self)->tuple:
+        with open(WORKING_FILE, "rb") as f:
+            container = f.read()
+        stored = CHUNK_SIZE + CHUNK_OVERHEAD
+        # fixed part of the header ends with the salt size
+        header_size = 11 + container[10]
+        header = container[:header_size]
+        body = container[header_size:]
+        return header, [body[i:i + stored] for i in range(0, len(body), stored)]
+
+    def test_write_read(self):
+        self.write(b"hello")
+
+        result = self.read()
+
+        self.assertEqual(result, b"hello")
+
+    def test_write_read_empty(self):
+        self.write(b"")
+
+        result = self.read()
+
+        self.assertEqual(result, b"")
+
+    def test_write_read_chunks(self):
+        data = os.getrandom(CHUNK_SIZE * 5 + 3)
+        self.write(data)
+
+        result = self.read()
+
+        self.assertEqual(result, data)
+
+    def test_write_read_full_chunks(self):
+        data = os.getrandom(CHUNK_SIZE * 4)
+        self.write(data)
+
+        result = self.read()
+
+        self.assertEqual(result, data)
+
+    def test_size(self):
+        data = os.getrandom(CHUNK_SIZE * 3 + 1)
+        self.write(data)
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            result = reader.size()
+
+        self.assertEqual(result, len(data))
+
+    def test_truncated(self):
+        data = os.getrandom(CHUNK_SIZE * 4)
+        self.write(data)
+
+        header, chunks = self.chunks()
+        with open(WORKING_FILE, "wb") as f:
+            f.write(header + b"".join(chunks[:-1]))
+
+        with self.assertRaises(Exception):
+            self.read()
+
+    def test_reordered(self):
+        data = os.getrandom(CHUNK_SIZE * 4)
+        self.write(data)
+
+        header, chunks = self.chunks()
+        chunks[0], chunks[1] = chunks[1], chunks[0]
+        with open(WORKING_FILE, "wb") as f:
+            f.write(header + b"".join(chunks))
+
+        with self.assertRaises(Exception):
+            self.read()
+
+    def test_not_a_stream(self):
+        with open(WORKING_FILE, "wb") as f:
+            f.write(b"{}")
+
+        with self.assertRaises(StreamError):
+            self.read()
+
+    def test_seek_read(self):
+        data = os.getrandom(CHUNK_SIZE * 5 + 3)
+        self.write(data)
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            reader.seek(CHUNK_SIZE * 2 + 5)
+            result = reader.read(CHUNK_SIZE)
+
+        self.assertEqual(result, data[CHUNK_SIZE * 2 + 5:CHUNK_SIZE * 3 + 5])
+
+    def test_seek_end(self):
+        data = os.getrandom(CHUNK_SIZE * 5 + 3)
+        self.write(data)
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            reader.seek(-4, io.SEEK_END)
+            result = reader.read()
+
+        self.assertEqual(result, data[-4:])
+
+    def test_readinto(self):
+        data = os.getrandom(CHUNK_SIZE * 5 + 3)
+        self.write(data)
+        buffer = bytearray(CHUNK_SIZE * 2)
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            reader.seek(CHUNK_SIZE - 1)
+            length = reader.readinto(buffer)
+
+        self.assertEqual(length, len(buffer))
+        self.assertEqual(bytes(buffer), data[CHUNK_SIZE - 1:CHUNK_SIZE * 3 - 1])
+
+    def test_read_only_touched_chunks(self):
+        data = os.getrandom(CHUNK_SIZE * 5)
+        self.write(data)
+
+        header, chunks = self.chunks()
+        chunks[0] = chunks[0][:-1] + bytes([chunks[0][-1] ^ 1])
+        with open(WORKING_FILE, "wb") as f:
+            f.write(header + b"".join(chunks))
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            reader.seek(CHUNK_SIZE * 3)
+            result = reader.read(CHUNK_SIZE)
+
+            self.assertEqual(result, data[CHUNK_SIZE * 3:CHUNK_SIZE * 4])
+
+            reader.seek(0)
+            with self.assertRaises(Exception):
+                reader.read(1)
+
+    def test_readinto_whole_chunks(self):
+        data = os.getrandom(CHUNK_SIZE * 5 + 3)
+        self.write(data)
+        buffer = bytearray(len(data) + 10)
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            length = reader.readinto(buffer)
+
+        self.assertEqual(length, len(data))
+        self.assertEqual(bytes(buffer[:length]), data)
+
+    def test_readinto_without_decrypt_into(self):
+        data = os.getrandom(CHUNK_SIZE * 3 + 3)
+        self.write(data)
+        buffer = bytearray(len(data))
+
+        with patch("fernetfs.stream._DECRYPT_INTO", False):
+            with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+                length = reader.readinto(buffer)
+
+        self.assertEqual(bytes(buffer[:length]), data)
+
+    def test_readinto_tampered_end(self):
+        data = os.getrandom(CHUNK_SIZE * 2)
+        self.write(data)
+
+        header, chunks = self.chunks()
+        chunks[-1] = chunks[-1][:-1] + bytes([chunks[-1][-1] ^ 1])
+        with open(WORKING_FILE, "wb") as f:
+            f.write(header + b"".join(chunks))
+
+        with StreamReader(open(WORKING_FILE, "rb"), self._primitives) as reader:
+            self.assertEqual(reader.readinto(bytearray(CHUNK_SIZE)), CHUNK_SIZE)
+            with self.assertRaises(Exception):
+                reader.readall()
+
+    def test_append(self):
+        data = os.getrandom(CHUNK_SIZE * 3 + 5)
+        self.write(data)
+        _, before = self.chunks()
+
+        with StreamWriter(open(WORKING_FILE, "r+b"), self._primitives, append=True) as writer:
+            writer.write(b"more")
+            writer.write(os.getrandom(CHUNK_SIZE * 2))
+
+        header, after = self.chunks()
+        # the complete chunks are left as is, only the last one is rewritten
+        self.assertEqual(after[:3], before[:3])
+        self.assertNotEqual(after[3], before[3])
+        self.assertEqual(self.read()[:len(data) + 4], data + b"more")
+        self.assertEqual(len(after), 6)
+
+    def test_append_empty(self):
+        self.write(b"")
+
+        with StreamWriter(open(WORKING_FILE, "r+b"), self._primitives, append=True) as writer:
+            writer.write(b"hello")
+
+        self.assertEqual(self.read(), b"hello")
+
+    def test_append_tail(self):
+        self.write(os.getrandom(CHUNK_SIZE + 5))
+        header, before = self.chunks()
+
+        writer = StreamWriter(open(WORKING_FILE, "r+b"), self._primitives, append=True)
+        offset, stored = writer.tail()
+        writer.close()
+
+        self.assertEqual(offset, len(header) + CHUNK_SIZE + CHUNK_OVERHEAD)
+        self.assertEqual(stored, before[1])
+
+    def test_append_tampered(self):
+        self.write(os.getrandom(CHUNK_SIZE * 2 + 5))
+        with open(WORKING_FILE, "r+b") as f:
+            f.seek(-1, io.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, io.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+
+        with self.assertRaises(Exception):
+            StreamWriter(open(WORKING_FILE, "r+b"), self._primitives, append=True)
@@ -2,9 +2,13 @@ import unittest
 import os
 from contextlib import suppress
 import logging
+import time
+import threading
+import glob
+from unittest.mock import patch
 
 from fernetfs.basicfile import BasicFile
-from fernetfs.tmpfile import TmpFile
+from fernetfs.tmpfile import TmpFile, RAMFS
 
 WORKING_FILE = "/tmp/test.x"
 SECRET = b"secret"
@@ -92,4 +96,66 @@ class TestTmpFile(unittest.TestCase):
 
         self.assertEqual(results, expected)
 
+    def test_write_back_debounced(self):
+        with BasicFile(WORKING_FILE, SECRET, "w", ITERATIONS) as f:
+            f.write("")
+
+        tmp = TmpFile(SECRET,WORKING_FILE, ITERATIONS, debounce=0.3)
+
+        # a burst of saves, then the command keeps running after the debounce delay
+        with patch.object(TmpFile, "encrypt", autospec=True, side_effect=TmpFile.encrypt) as encrypt:
+            tmp.run("sh -c 'for i in 1 2 3 4 5; do echo $i > $0; done; sleep 1'")
+
+        # once for the burst, once when the command ends
+        self.assertEqual(encrypt.call_count, 2)
+        with BasicFile(WORKING_FILE, SECRET, "r", ITERATIONS) as f:
+            self.assertEqual(f.read(), "5\n")
+
+    def test_write_back_stops(self):
+        with BasicFile(WORKING_FILE, SECRET, "w", ITERATIONS) as f:
+            f.write("test_write_back_stops")
+        threads = threading.active_count()
+
+        tmp = TmpFile(SECRET,WORKING_FILE, ITERATIONS)
+        start = time.monotonic()
+        tmp.run("true")
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_private_directory(self):
+        with BasicFile(WORKING_FILE, SECRET, "w", ITERATIONS) as f:
+            f.write("test_private_directory")
+
+        tmp = TmpFile(SECRET,WORKING_FILE, ITERATIONS)
+
+        with tmp as filename:
+            directory = os.path.dirname(filename)
+            self.assertNotEqual(directory, RAMFS)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+        self.assertFalse(os.path.exists(directory))
 
+    def test_encrypt_failure(self):
+        with BasicFile(WORKING_FILE, SECRET, "w", ITERATIONS) as f:
+            f.write("previous")
+
+        tmp = TmpFile(SECRET, WORKING_FILE, ITERATIONS)
+        path = tmp.create()
+        self.addCleanup(tmp.remove)
+        with open(path, "w") as f:
+            f.write("next" * 100000)
+
+        def fail(infile, outfile):
+            outfile.write(b"partial")
+            outfile.close()
+            raise OSError("No space left on device")
+
+        with patch.object(tmp._primitives, "encrypt_stream", fail):
+            with self.assertRaises(OSError):
+                tmp.encrypt(path)
+
+        # the previous container is intact and no temporary file is left
+        with BasicFile(WORKING_FILE, SECRET, "r", ITERATIONS) as f:
+            self.assertEqual(f.read(), "previous")
+        self.assertEqual(glob.glob(f"{WORKING_FILE}.*.tmp"), [])
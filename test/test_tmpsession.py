@@ -0,0 +1,108 @@
+import unittest
+import os
+import shutil
+import time
+import glob
+from unittest.mock import patch
+
+from fernetfs.basicfile import BasicFile
+from fernetfs.tmpsession import TmpSession
+
+WORKING_DIR = "/tmp/test_directory"
+SECRET = b"secret"
+ITERATIONS = 100
+
+class TestTmpSession(unittest.TestCase):
+    def setUp(self) -> None:
+        os.mkdir(WORKING_DIR)
+        self.files = {}
+        for name in ["a.txt", "b.txt", "sub/c.txt"]:
+            path = os.path.join(WORKING_DIR, name.replace("/", "_"))
+            with BasicFile(path, SECRET, "w", ITERATIONS) as f:
+                f.write(name)
+            self.files[name] = path
+
+    def tearDown(self) -> None:
+        shutil.rmtree(WORKING_DIR)
+
+    def read(self, name:str)->str:
+        with BasicFile(self.files[name], SECRET, "r", ITERATIONS) as f:
+            return f.read()
+
+    def test_decrypt(self):
+        with TmpSession(SECRET, self.files, ITERATIONS) as directory:
+            for name in self.files:
+                with open(os.path.join(directory, name)) as f:
+                    self.assertEqual(f.read(), name)
+
+        self.assertFalse(os.path.exists(directory))
+
+    def test_changed_only(self):
+        before = {name: os.stat(path).st_ino for name, path in self.files.items()}
+
+        session = TmpSession(SECRET, self.files, ITERATIONS)
+        directory = session.open()
+        with open(os.path.join(directory, "sub/c.txt"), "w") as f:
+            f.write("changed")
+        # saved with the same content
+        with open(os.path.join(directory, "a.txt"), "w") as f:
+            f.write("a.txt")
+        changed = session.close()
+
+        self.assertEqual(changed, ["sub/c.txt"])
+        self.assertEqual(self.read("sub/c.txt"), "changed")
+        self.assertEqual(os.stat(self.files["a.txt"]).st_ino, before["a.txt"])
+        self.assertEqual(os.stat(self.files["b.txt"]).st_ino, before["b.txt"])
+
+    def test_file_named_as_wake(self):
+        path = os.path.join(WORKING_DIR, "wake")
+        with BasicFile(path, SECRET, "w", ITERATIONS) as f:
+            f.write("content")
+        self.files[".fernetfs-wake"] = path
+
+        session = TmpSession(SECRET, self.files, ITERATIONS)
+        session.open()
+        changed = session.close()
+
+        self.assertEqual(changed, [])
+        self.assertEqual(self.read(".fernetfs-wake"), "content")
+
+    def test_encrypt_failure(self):
+        session = TmpSession(SECRET, self.files, ITERATIONS)
+        directory = session.open()
+        with open(os.path.join(directory, "a.txt"), "w") as f:
+            f.write("changed")
+
+        def fail(infile, outfile):
+            outfile.write(b"partial")
+            outfile.close()
+            raise OSError("No space left on device")
+
+        with patch.object(session._primitives, "encrypt_stream", fail):
+            with self.assertRaises(OSError):
+                session.close()
+
+        # the previous container is intact and no temporary file is left
+        self.assertEqual(self.read("a.txt"), "a.txt")
+        self.assertEqual(glob.glob(os.path.join(WORKING_DIR, "*.tmp")), [])
+
+    def test_write_back_debounced(self):
+        session = TmpSession(SECRET, self.files, ITERATIONS, debounce=0.2)
+
+        with patch.object(TmpSession, "_encrypt", autospec=True, side_effect=TmpSession._encrypt) as encrypt:
+            changed = session.run("sh -c 'for i in 1 2 3; do echo $i > $0/a.txt; echo $i > $0/sub/c.txt; done; sleep 0.8'")
+
+        # written back once each by the watcher, nothing left to do on close
+        self.assertEqual(changed, [])
+        self.assertEqual(self.read("a.txt"), "3\n")
+        self.assertEqual(self.read("sub/c.txt"), "3\n")
+        self.assertEqual(encrypt.call_count, 2 + len(self.files))
+
+    def test_close_stops_watcher(self):
+        session = TmpSession(SECRET, self.files, ITERATIONS)
+        session.open()
+
+        start = time.monotonic()
+        session.close()
+
+        self.assertLess(time.monotonic() - start, 0.5)
@@ -0,0 +1,76 @@
+import unittest
+import time
+
+from fernetfs.tracer import Tracer, HistogramTracer, Histogram
+
+class RecordingTracer(Tracer):
+    def __init__(self, slow_threshold:float=None) -> None:
+        super().__init__(slow_threshold)
+        self.calls = []
+
+    def begin(self, name:str)->None:
+        self.calls.append(("begin", name))
+
+    def end(self, name:str, seconds:float)->None:
+        self.calls.append(("end", name))
+
+class TestTracer(unittest.TestCase):
+    def test_begin_end(self):
+        tracer = RecordingTracer()
+
+        with tracer.span("ls"):
+            with tracer.span("io"):
+                pass
+
+        self.assertEqual(tracer.calls, [("begin", "ls"), ("begin", "io"), ("end", "io"), ("end", "ls")])
+
+    def test_slow(self):
+        tracer = Tracer(0.01)
+
+        with self.assertLogs("Tracer", "WARNING") as logs:
+            with tracer.span("open"):
+                with tracer.span("kdf"):
+                    time.sleep(0.02)
+                with tracer.span("io"):
+                    pass
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Slow open", logs.output[0])
+        self.assertIn("kdf", logs.output[0])
+        self.assertIn("io", logs.output[0])
+
+    def test_not_slow(self):
+        tracer = Tracer(1)
+
+        with self.assertNoLogs("Tracer", "WARNING"):
+            with tracer.span("open"):
+                pass
+
+    def test_histogram(self):
+        histogram = Histogram()
+
+        for value in range(1, 1001):
+            histogram.record(value / 1e6)
+
+        self.assertEqual(histogram.count, 1000)
+        # about 3% of relative error
+        self.assertAlmostEqual(histogram.percentile(50), 500e-6, delta=20e-6)
+        self.assertAlmostEqual(histogram.percentile(99), 990e-6, delta=40e-6)
+        self.assertEqual(histogram.percentile(100), 1000e-6)
+
+    def test_histogram_tracer(self):
+        tracer = HistogramTracer()
+
+        for _ in range(10):
+            with tracer.span("ls"):
+                with tracer.span("io"):
+                    pass
+
+        histograms = tracer.histograms()
+
+        self.assertEqual(list(histograms), ["io", "ls"])
+        self.assertEqual(histograms["ls"]["count"], 10)
+        self.assertLessEqual(histograms["io"]["p50"], histograms["io"]["max"])
+
+        tracer.reset()
+        self.assertEqual(tracer.histograms(), {})